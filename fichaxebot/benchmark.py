@@ -0,0 +1,231 @@
+"""End-to-end latency benchmark of the portal backends.
+
+Run it with ``python -m fichaxebot.benchmark``. Every backend is exercised in
+its own process against a local fake portal, so the figures can be compared
+on a laptop without network access and the peak RSS belongs to one backend
+only. Each round marks an entry and an exit, reads today's marks and reads
+the annual calendar.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import replace
+from datetime import timedelta
+from pathlib import Path
+from typing import Any, Optional
+
+from fichaxebot.config import PORTAL_BACKENDS, load_config, set_config
+from fichaxebot.fake_portal import FakePortal, start_fake_portal
+from fichaxebot.fichador import get_today_records, perform_check_in, shutdown_backend
+from fichaxebot.latency import PHASES, get_latency_stats
+from fichaxebot.view_calendar import fetch_calendar_summary
+
+USER = "benchmark"
+PASSWORD = "benchmark"
+OPERATIONS = ("check_in", "records", "calendar")
+
+SAMPLE_CALENDAR = [
+    {"startDate": "2025-08-03", "endDate": "2025-08-22", "tipo": "DIA_VACACIONS_APROBADA"},
+    {"startDate": "2025-12-24", "endDate": "2025-12-26", "tipo": "DIA_NON_LABORABLE"},
+]
+
+
+def _percentile(values: list[float], quantile: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(1, math.ceil(quantile * len(ordered))) - 1]
+
+
+def _peak_rss_mib(who: int) -> float:
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux reports KiB, macOS bytes.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_backend(
+    backend: str,
+    rounds: int,
+    latency: float,
+    jitter: float,
+    failure_rate: float,
+    seed: Optional[int],
+) -> dict[str, Any]:
+    """Benchmark ``backend`` in this process and return the collected figures."""
+
+    portal = FakePortal(
+        USER,
+        PASSWORD,
+        calendario=SAMPLE_CALENDAR,
+        recent_window=0.0,
+        latency=latency,
+        jitter=jitter,
+        failure_rate=failure_rate,
+        seed=seed,
+    )
+    server = start_fake_portal(portal)
+    set_config(
+        replace(
+            load_config(),
+            usc_user=USER,
+            usc_pass=PASSWORD,
+            portal_backend=backend,
+            portal_url=server.url,
+            records_cache_ttl=timedelta(0),
+        )
+    )
+
+    timings: dict[str, list[float]] = {operation: [] for operation in OPERATIONS}
+    failures = 0
+    started = time.perf_counter()
+    try:
+        for _ in range(rounds):
+            portal.reset()
+            for action in ("entrada", "salida"):
+                operation_started = time.perf_counter()
+                result = perform_check_in(action)
+                timings["check_in"].append(time.perf_counter() - operation_started)
+                failures += not result.success
+
+            for operation, func in (
+                ("records", lambda: get_today_records(force_refresh=True)),
+                ("calendar", fetch_calendar_summary),
+            ):
+                operation_started = time.perf_counter()
+                try:
+                    func()
+                except Exception:  # noqa: BLE001
+                    failures += 1
+                timings[operation].append(time.perf_counter() - operation_started)
+    finally:
+        shutdown_backend()
+        server.shutdown()
+        server.server_close()
+    elapsed = time.perf_counter() - started
+
+    stats = get_latency_stats()
+    count = sum(len(values) for values in timings.values())
+    return {
+        "backend": backend,
+        "operations": count,
+        "failures": failures,
+        "elapsed": elapsed,
+        "throughput": count / elapsed if elapsed else 0.0,
+        "peak_rss_mib": _peak_rss_mib(resource.RUSAGE_SELF),
+        "children_peak_rss_mib": _peak_rss_mib(resource.RUSAGE_CHILDREN),
+        "phases": {
+            phase: {"p50": stats.percentile(phase, 0.5), "p95": stats.percentile(phase, 0.95)}
+            for phase in PHASES
+        },
+        "timings": {
+            operation: {"p50": _percentile(values, 0.5), "p95": _percentile(values, 0.95)}
+            for operation, values in timings.items()
+        },
+    }
+
+
+def _run_isolated(backend: str, args: argparse.Namespace) -> dict[str, Any]:
+    """Run one backend in a fresh process inside an empty working directory."""
+
+    package_root = str(Path(__file__).resolve().parent.parent)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [package_root, env.get("PYTHONPATH")]))
+    command = [
+        sys.executable,
+        "-m",
+        "fichaxebot.benchmark",
+        "--worker",
+        backend,
+        "--rounds",
+        str(args.rounds),
+        "--latency",
+        str(args.latency),
+        "--jitter",
+        str(args.jitter),
+        "--failure-rate",
+        str(args.failure_rate),
+    ]
+    if args.seed is not None:
+        command += ["--seed", str(args.seed)]
+
+    with tempfile.TemporaryDirectory(prefix="fichaxe-bench-") as workdir:
+        completed = subprocess.run(
+            command, cwd=workdir, env=env, capture_output=True, text=True, check=False
+        )
+    if completed.returncode != 0:
+        return {"backend": backend, "error": completed.stderr.strip().splitlines()[-1:]}
+    return json.loads(completed.stdout)
+
+
+def _format_seconds(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value * 1000:.0f} ms"
+
+
+def _print_report(results: list[dict[str, Any]]) -> None:
+    for result in results:
+        print(f"== {result['backend']} ==")
+        if "error" in result:
+            print(f"  failed: {' '.join(result['error']) or 'unknown error'}")
+            continue
+        print(
+            f"  {result['operations']} operations, {result['failures']} failed, "
+            f"{result['elapsed']:.2f} s, {result['throughput']:.2f} ops/s"
+        )
+        print(
+            f"  peak RSS {result['peak_rss_mib']:.1f} MiB "
+            f"(child processes {result['children_peak_rss_mib']:.1f} MiB)"
+        )
+        for title, figures in (("phase", result["phases"]), ("operation", result["timings"])):
+            for name, values in figures.items():
+                print(
+                    f"  {title:<9} {name:<12} p50 {_format_seconds(values['p50']):>8}"
+                    f"  p95 {_format_seconds(values['p95']):>8}"
+                )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--backends",
+        default=",".join(PORTAL_BACKENDS),
+        help="comma separated backends to compare",
+    )
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", action="store_true", help="print raw results as JSON")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        result = run_backend(
+            args.worker, args.rounds, args.latency, args.jitter, args.failure_rate, args.seed
+        )
+        print(json.dumps(result))
+        return
+
+    backends = [name.strip() for name in args.backends.split(",") if name.strip()]
+    unknown = [name for name in backends if name not in PORTAL_BACKENDS]
+    if unknown:
+        parser.error("unknown backends: " + ", ".join(unknown))
+
+    results = [_run_isolated(backend, args) for backend in backends]
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        _print_report(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -17,10 +17,14 @@ from fichaxebot.commands import (
     cancel,
     mark as mark_command,
     process_response,
+    register,
+    routine,
     show_pending,
     show_records,
     show_calendar,
+    show_status,
     start,
+    unregister,
 )
 from fichaxebot.config import get_config
 from fichaxebot.utils import (
@@ -29,105 +33,260 @@ from fichaxebot.utils import (
     get_madrid_now,
     is_galicia_holiday,
 )
-from fichaxebot.fichador import get_today_records
+from fichaxebot.executor import READ_DEADLINE, Priority, run_portal_task, shutdown_executor
+from fichaxebot.fichador import Credentials, get_backend, get_today_records, shutdown_backend
+from fichaxebot.latency import get_latency_stats
 from fichaxebot.logging_config import get_logger
-from fichaxebot.scheduler import SchedulerManager
+from fichaxebot.mark_store import get_mark_store
+from fichaxebot.metrics import get_metrics
+from fichaxebot.outbox import get_outbox, start_outbox, stop_outbox
+from fichaxebot.profiling import profiled
+from fichaxebot.schedule_store import shutdown_schedule_writer
+from fichaxebot.users import get_user_registry
+from fichaxebot.view_calendar import (
+    calendar_is_stale,
+    has_current_calendar,
+    refresh_calendar,
+    refresh_calendar_if_stale,
+)
+from fichaxebot.workdays import get_working_days
 
 logger = get_logger(__name__)
 
 config = get_config()
 TOKEN = config.telegram_token
-CHAT_ID = config.telegram_chat_id
 
 MAX_REMINDERS = config.max_reminders
 REMINDER_INTERVAL = config.reminder_interval
 QUESTION_TIME = config.daily_question_time
+METRICS_EXPORT_INTERVAL = 60
+WORKER_RESULTS_INTERVAL = 2
+CALENDAR_CHECK_INTERVAL = 60 * 60
+# First check a while after start-up; active users refresh on their own.
+CALENDAR_CHECK_DELAY = 5 * 60
+# Seconds between two calendar logins of the check.
+CALENDAR_REFRESH_SPACING = 30
+
+
+async def ask_all_users(context: ContextTypes.DEFAULT_TYPE) -> None:
+    today = get_madrid_now().date()
+    if today.weekday() >= 5 or is_galicia_holiday(today):
+        logger.info("Skipping question on %s (weekend or holiday)", today)
+        return
+
+    # One job per user so that each one runs with the chat data of its chat.
+    for chat_id in get_user_registry().chat_ids():
+        context.job_queue.run_once(
+            ask_for_check_in, when=0, chat_id=chat_id, name=f"pregunta_{chat_id}"
+        )
+
+
+async def prefetch_calendars(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Spread over the next hour the refresh of every calendar missing or stale.
+
+    Each refresh is a job of its own so that the portal sees one login at a
+    time instead of one per registered user at once.
+    """
+
+    registry = get_user_registry()
+    stale: dict[str, Credentials] = {}
+    for chat_id in registry.chat_ids():
+        credentials = registry.credentials(chat_id)
+        if credentials is not None and calendar_is_stale(credentials):
+            stale[credentials.user] = credentials
+    if not stale:
+        return
+
+    spacing = min(CALENDAR_REFRESH_SPACING, CALENDAR_CHECK_INTERVAL / len(stale))
+    logger.info("Refreshing %s stale calendars every %.0f s", len(stale), spacing)
+    for position, credentials in enumerate(stale.values()):
+        context.job_queue.run_once(
+            refresh_stale_calendar, when=position * spacing, data=credentials
+        )
+
+
+async def refresh_stale_calendar(context: ContextTypes.DEFAULT_TYPE) -> None:
+    refresh_calendar_if_stale(context.job.data)
 
 
 async def ask_for_check_in(context: ContextTypes.DEFAULT_TYPE) -> None:
     today = get_madrid_now().date()
-    scheduler_manager: SchedulerManager = context.application.scheduler_manager
-    if scheduler_manager.has_pending():
-        logger.info("Skipping daily question because there are already scheduled marks.")
-        cancel_reminder(context.application, REMINDER_JOB_KEY, REMINDER_ATTEMPTS_KEY)
+    chat_id = context.job.chat_id
+    state = context.chat_data
+    user = get_user_registry().get(context.application, chat_id)
+    if user is None:
         return
 
-    if today.weekday() >= 5 or is_galicia_holiday(today):
-        logger.info("Skipping question on %s (weekend or holiday)", today)
-        cancel_reminder(context.application, REMINDER_JOB_KEY, REMINDER_ATTEMPTS_KEY)
+    if not has_current_calendar(user.credentials):
+        # Without the calendar a vacation day looks like a working day.
+        try:
+            await run_portal_task(
+                refresh_calendar, user.credentials, priority=Priority.READ, deadline=READ_DEADLINE
+            )
+        except Exception:  # noqa: BLE001
+            logger.warning("Could not read the calendar of chat %s", chat_id, exc_info=True)
+
+    if not get_working_days(user.credentials).is_working_day(today):
+        logger.info("Skipping daily question for chat %s: %s is a day off.", chat_id, today)
+        cancel_reminder(state, REMINDER_JOB_KEY, REMINDER_ATTEMPTS_KEY)
         return
 
-    logger.info("Sending check-in request for %s", today.isoformat())
-    context.application.bot_data[QUESTION_DATE_KEY] = today
-    context.application.bot_data[AWAITING_RESPONSE_KEY] = True
-    cancel_reminder(context.application, REMINDER_JOB_KEY, REMINDER_ATTEMPTS_KEY)
-    await context.bot.send_message(
-        chat_id=CHAT_ID,
-        text="📅 Buenos días! ¿Quieres fichar hoy?",
+    if user.scheduler.pending_on(today):
+        logger.info(
+            "Skipping daily question for chat %s because there are already scheduled marks.",
+            chat_id,
+        )
+        cancel_reminder(state, REMINDER_JOB_KEY, REMINDER_ATTEMPTS_KEY)
+        return
+
+    logger.info("Sending check-in request for %s to chat %s", today.isoformat(), chat_id)
+    state[QUESTION_DATE_KEY] = today
+    state[AWAITING_RESPONSE_KEY] = True
+    cancel_reminder(state, REMINDER_JOB_KEY, REMINDER_ATTEMPTS_KEY)
+    get_outbox().send(
+        chat_id,
+        "📅 Buenos días! ¿Quieres fichar hoy?",
         reply_markup=ReplyKeyboardMarkup(
             [["Sí", "No"]], one_time_keyboard=True, resize_keyboard=True
         ),
     )
 
-    context.application.bot_data[REMINDER_ATTEMPTS_KEY] = 0
+    state[REMINDER_ATTEMPTS_KEY] = 0
     if MAX_REMINDERS > 0:
         reminder_job = context.job_queue.run_repeating(
             send_check_in_reminder,
             interval=REMINDER_INTERVAL.total_seconds(),
             first=REMINDER_INTERVAL.total_seconds(),
-            name="recordatorio_pregunta",
+            chat_id=chat_id,
+            name=f"recordatorio_pregunta_{chat_id}",
         )
-        context.application.bot_data[REMINDER_JOB_KEY] = reminder_job
+        state[REMINDER_JOB_KEY] = reminder_job
 
 
 async def send_check_in_reminder(context: ContextTypes.DEFAULT_TYPE) -> None:
-    if not context.application.bot_data.get(AWAITING_RESPONSE_KEY):
-        cancel_reminder(context.application, REMINDER_JOB_KEY, REMINDER_ATTEMPTS_KEY)
+    state = context.chat_data
+    if not state.get(AWAITING_RESPONSE_KEY):
+        cancel_reminder(state, REMINDER_JOB_KEY, REMINDER_ATTEMPTS_KEY)
         return
 
-    attempts = context.application.bot_data.get(REMINDER_ATTEMPTS_KEY, 0) + 1
+    chat_id = context.job.chat_id
+    user = get_user_registry().get(context.application, chat_id)
+    if user is None or not get_working_days(user.credentials).is_working_day(
+        get_madrid_now().date()
+    ):
+        cancel_reminder(state, REMINDER_JOB_KEY, REMINDER_ATTEMPTS_KEY)
+        state[AWAITING_RESPONSE_KEY] = False
+        return
+
+    attempts = state.get(REMINDER_ATTEMPTS_KEY, 0) + 1
 
     if attempts > MAX_REMINDERS:
         logger.info("Maximum number of reminders reached. Stopping notifications.")
-        cancel_reminder(context.application, REMINDER_JOB_KEY, REMINDER_ATTEMPTS_KEY)
-        context.application.bot_data[AWAITING_RESPONSE_KEY] = False
+        cancel_reminder(state, REMINDER_JOB_KEY, REMINDER_ATTEMPTS_KEY)
+        state[AWAITING_RESPONSE_KEY] = False
         return
 
-    context.application.bot_data[REMINDER_ATTEMPTS_KEY] = attempts
+    state[REMINDER_ATTEMPTS_KEY] = attempts
     logger.info("Sending check-in reminder %s/%s", attempts, MAX_REMINDERS)
-    await context.bot.send_message(
-        chat_id=CHAT_ID,
-        text="⏰ Recordatorio: ¿Quieres fichar hoy? Responde 'Sí' o 'No'.",
+    get_outbox().send(
+        chat_id,
+        "⏰ Recordatorio: ¿Quieres fichar hoy? Responde 'Sí' o 'No'.",
         reply_markup=ReplyKeyboardMarkup(
             [["Sí", "No"]], one_time_keyboard=True, resize_keyboard=True
         ),
     )
 
 
+async def evict_idle_users(context: ContextTypes.DEFAULT_TYPE) -> None:
+    app = context.application
+
+    def busy(chat_id: int) -> bool:
+        state = app.chat_data.get(chat_id)
+        return bool(state and state.get(AWAITING_RESPONSE_KEY))
+
+    for chat_id in get_user_registry().evict_idle(
+        get_config().user_idle_timeout.total_seconds(), busy
+    ):
+        app.drop_chat_data(chat_id)
+
+
+async def relay_worker_results(context: ContextTypes.DEFAULT_TYPE) -> None:
+    registry = get_user_registry()
+    try:
+        events = await asyncio.to_thread(get_mark_store().take_events)
+    except Exception:  # noqa: BLE001
+        logger.exception("Could not read the results of the workers")
+        return
+    for event in events:
+        user = registry.get(context.application, int(event.chat_id))
+        if user is None:
+            logger.warning("Dropping worker result for unknown chat %s", event.chat_id)
+            continue
+        await user.scheduler.apply_worker_event(context.application, event)
+
+
+async def export_metrics(context: ContextTypes.DEFAULT_TYPE) -> None:
+    try:
+        get_metrics().export()
+    except OSError:
+        logger.warning("Could not export the metrics file", exc_info=True)
+
+
+async def _send_today_summary(chat_id: int, credentials: Credentials) -> None:
+    try:
+        records = await run_portal_task(
+            get_today_records, False, credentials, priority=Priority.READ
+        )
+    except Exception as exc:  # noqa: BLE001
+        get_outbox().send(
+            chat_id,
+            f"❌ No se pudieron consultar los marcajes actuales: {exc}",
+        )
+    else:
+        if records:
+            resumen = "\n".join(
+                f"• Entrada: {item['entrada']} | Salida: {item['salida']}" for item in records
+            )
+        else:
+            resumen = "ℹ️ No hay marcajes registrados hoy."
+        get_outbox().send(chat_id, resumen)
+
+
 async def _run_bot() -> None:
     appconfig = get_config()
-    scheduler_manager = SchedulerManager(
-        appconfig.telegram_chat_id,
-        appconfig.auto_checkout_delay,
-        appconfig.auto_checkout_random_offset_minutes,
-    )
+    registry = get_user_registry()
     app = ApplicationBuilder().token(TOKEN).build()
-    app.scheduler_manager = scheduler_manager
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("marcar", mark_command))
-    app.add_handler(CommandHandler("cancelar", cancel))
-    app.add_handler(CommandHandler("marcajes", show_records))
-    app.add_handler(CommandHandler("pendientes", show_pending))
-    app.add_handler(CommandHandler("calendario", show_calendar))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, process_response))
-
+    app.add_handler(CommandHandler("start", profiled(start)))
+    app.add_handler(CommandHandler("registro", profiled(register)))
+    app.add_handler(CommandHandler("baja", profiled(unregister)))
+    app.add_handler(CommandHandler("marcar", profiled(mark_command)))
+    app.add_handler(CommandHandler("cancelar", profiled(cancel)))
+    app.add_handler(CommandHandler("marcajes", profiled(show_records)))
+    app.add_handler(CommandHandler("pendientes", profiled(show_pending)))
+    app.add_handler(CommandHandler("rutina", profiled(routine)))
+    app.add_handler(CommandHandler("calendario", profiled(show_calendar)))
+    app.add_handler(CommandHandler("estado", profiled(show_status)))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, profiled(process_response)))
+
+    app.job_queue.run_repeating(
+        prefetch_calendars, interval=CALENDAR_CHECK_INTERVAL, first=CALENDAR_CHECK_DELAY
+    )
     app.job_queue.run_daily(
-        ask_for_check_in,
+        ask_all_users,
         time=QUESTION_TIME.replace(tzinfo=MADRID_TZ),
         days=(1, 2, 3, 4, 5), # Sunday-Saturday numeration
     )
+    app.job_queue.run_repeating(
+        export_metrics, interval=METRICS_EXPORT_INTERVAL, first=METRICS_EXPORT_INTERVAL
+    )
+    if appconfig.scheduled_marks_runner == "workers":
+        app.job_queue.run_repeating(
+            relay_worker_results, interval=WORKER_RESULTS_INTERVAL, first=WORKER_RESULTS_INTERVAL
+        )
+    idle_seconds = appconfig.user_idle_timeout.total_seconds()
+    app.job_queue.run_repeating(evict_idle_users, interval=idle_seconds, first=idle_seconds)
 
-    restaurados = scheduler_manager.load_from_disk(app)
+    restaurados = registry.restore(app)
 
     now = get_madrid_now()
     question_time = now.replace(
@@ -138,13 +297,12 @@ async def _run_bot() -> None:
     )
 
     if (
-        not scheduler_manager.has_pending()
-        and now >= question_time
+        now >= question_time
         and now.weekday() < 5 # Monday-Sunday numeration
         and not is_galicia_holiday(now.date())
     ):
-        logger.info("🤖 Bot started after 9:00 without scheduled marks. Triggering question.")
-        app.job_queue.run_once(ask_for_check_in, when=0)
+        logger.info("🤖 Bot started after 9:00. Asking users without scheduled marks.")
+        app.job_queue.run_once(ask_all_users, when=0)
     else:
         logger.info("🤖 Bot started. Waiting for question schedule.")
 
@@ -158,33 +316,28 @@ async def _run_bot() -> None:
         asyncio.get_running_loop().add_signal_handler(sig, handle_stop)
 
     await app.initialize()
+    start_outbox(app.bot)
     await app.start()
 
-    if restaurados:
+    try:
+        await run_portal_task(get_backend().prepare, priority=Priority.READ)
+    except Exception:  # noqa: BLE001
+        logger.exception("Could not prepare the portal backend")
+
+    for chat_id, marks in restaurados.items():
         lineas = []
-        for mark in restaurados:
+        for mark in marks:
             fecha = mark.when.astimezone(MADRID_TZ)
             lineas.append(f"• {mark.action.capitalize()} el {fecha.strftime('%d/%m %H:%M')}")
-        await app.bot.send_message(
-            chat_id=CHAT_ID,
-            text="♻️ Bot reiniciado. Marcajes restaurados:\n" + "\n".join(lineas),
+        get_outbox().send(
+            chat_id,
+            "♻️ Bot reiniciado. Marcajes restaurados:\n" + "\n".join(lineas),
         )
 
-    try:
-        records = await asyncio.to_thread(get_today_records)
-    except Exception as exc:  # noqa: BLE001
-        await app.bot.send_message(
-            chat_id=CHAT_ID,
-            text=f"❌ No se pudieron consultar los marcajes actuales: {exc}",
-        )
-    else:
-        if records:
-            resumen = "\n".join(
-                f"• Entrada: {item['entrada']} | Salida: {item['salida']}" for item in records
-            )
-        else:
-            resumen = "ℹ️ No hay marcajes registrados hoy."
-        await app.bot.send_message(chat_id=CHAT_ID, text=resumen)
+    owner_chat_id = registry.owner_chat_id
+    owner = registry.get(app, owner_chat_id) if owner_chat_id is not None else None
+    if owner is not None:
+        await _send_today_summary(owner.chat_id, owner.credentials)
 
     await app.updater.start_polling()
     print("🤖 Bot running. Press Ctrl+C to stop.")
@@ -193,7 +346,12 @@ async def _run_bot() -> None:
 
     await app.updater.stop()
     await app.stop()
+    await stop_outbox()
     await app.shutdown()
+    await asyncio.to_thread(shutdown_executor)
+    await asyncio.to_thread(shutdown_backend)
+    await asyncio.to_thread(shutdown_schedule_writer)
+    get_latency_stats().save()
 
 def main() -> None:
     asyncio.run(_run_bot())
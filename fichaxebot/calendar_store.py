@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Optional
+
+from fichaxebot.config import get_config, scoped_path, write_atomic
+from fichaxebot.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+CALENDAR_FILE = Path(".calendar.data")
+
+
+def calendar_hash(entries: list[dict[str, Any]]) -> str:
+    """Return a stable digest of a raw ``calendario`` array."""
+
+    canonical = json.dumps(entries, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+@dataclass(frozen=True)
+class StoredCalendar:
+    """Raw ``calendario`` array of one year as last read from the portal."""
+
+    entries: list[dict[str, Any]]
+    digest: str
+    fetched_at: datetime
+
+
+class CalendarStore:
+    """Persistent copy of the annual calendars, keyed by year."""
+
+    def __init__(self, path: Path = CALENDAR_FILE) -> None:
+        self._path = path
+        self._lock = threading.Lock()
+        self._stamp = self._file_stamp()
+        self._years: dict[int, StoredCalendar] = self._load()
+
+    def _file_stamp(self) -> Optional[tuple[int, int]]:
+        try:
+            stat = self._path.stat()
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _reload_if_changed(self) -> None:
+        """Read the calendars again if another process, such as the bot, rewrote the file."""
+
+        stamp = self._file_stamp()
+        with self._lock:
+            if stamp == self._stamp:
+                return
+            self._stamp = stamp
+            self._years = self._load()
+        logger.info("Reloaded the cached calendars from %s", self._path)
+
+    def _load(self) -> dict[int, StoredCalendar]:
+        if not self._path.exists():
+            return {}
+        try:
+            data = json.loads(self._path.read_text(encoding="utf-8"))
+            return {
+                int(year): StoredCalendar(
+                    entries=list(item["calendario"]),
+                    digest=str(item["hash"]),
+                    fetched_at=datetime.fromisoformat(item["fetched_at"]),
+                )
+                for year, item in data.items()
+            }
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            logger.warning("Invalid format in %s. Cached calendars will be ignored.", self._path)
+            return {}
+
+    def get(self, year: int) -> Optional[StoredCalendar]:
+        self._reload_if_changed()
+        with self._lock:
+            return self._years.get(year)
+
+    def update(
+        self, year: int, entries: list[dict[str, Any]], fetched_at: datetime
+    ) -> tuple[StoredCalendar, bool]:
+        """Store a fresh read of ``year``; also report whether its content changed."""
+
+        digest = calendar_hash(entries)
+        with self._lock:
+            previous = self._years.get(year)
+            changed = previous is None or previous.digest != digest
+            if not changed:
+                entries = previous.entries
+            stored = self._years[year] = StoredCalendar(entries, digest, fetched_at)
+            self._save()
+        return stored, changed
+
+    def _save(self) -> None:
+        data = {
+            str(year): {
+                "calendario": item.entries,
+                "hash": item.digest,
+                "fetched_at": item.fetched_at.isoformat(),
+            }
+            for year, item in sorted(self._years.items())
+        }
+        try:
+            write_atomic(self._path, json.dumps(data, ensure_ascii=False))
+        except OSError:
+            logger.warning("Could not persist the calendar cache to %s", self._path, exc_info=True)
+            return
+        self._stamp = self._file_stamp()
+
+
+_stores: dict[str, CalendarStore] = {}
+_store_lock = threading.Lock()
+
+
+def get_calendar_store(user: Optional[str] = None) -> CalendarStore:
+    """Return the calendars of the portal account ``user`` (default: configured one)."""
+
+    user = get_config().usc_user if user is None else user
+    with _store_lock:
+        store = _stores.get(user)
+        if store is None:
+            scope = None if user == get_config().usc_user else user
+            store = _stores[user] = CalendarStore(scoped_path(CALENDAR_FILE, scope))
+        return store
+
+
+def forget_calendar_store(user: str) -> None:
+    """Drop the in-memory calendars of an account that is no longer active."""
+
+    with _store_lock:
+        _stores.pop(user, None)
@@ -10,6 +10,9 @@ from fichaxebot.commands.mark import mark
 from fichaxebot.commands.messages import process_response
 from fichaxebot.commands.pending import show_pending
 from fichaxebot.commands.records import show_records
+from fichaxebot.commands.register import register, unregister
+from fichaxebot.commands.routine import routine
+from fichaxebot.commands.status import show_status
 from fichaxebot.commands.start import start
 
 __all__ = [
@@ -21,7 +24,11 @@ __all__ = [
     "show_calendar",
     "mark",
     "process_response",
+    "register",
+    "routine",
     "show_pending",
     "show_records",
+    "show_status",
     "start",
+    "unregister",
 ]
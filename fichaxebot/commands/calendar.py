@@ -1,15 +1,15 @@
 from __future__ import annotations
 
-import asyncio
-import json
-from urllib.parse import quote
-
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update, WebAppInfo
 from telegram.ext import ContextTypes
 
-from fichaxebot.view_calendar import CalendarFetchError, fetch_calendar_summary
+from fichaxebot.commands.state import require_user
+from fichaxebot.view_calendar import CalendarFetchError, load_calendar_summary
 from fichaxebot.config import get_config
+from fichaxebot.executor import READ_DEADLINE, Priority, run_portal_task
 from fichaxebot.logging_config import get_logger
+from fichaxebot.outbox import get_outbox, reply
+from fichaxebot.utils import MADRID_TZ
 
 logger = get_logger(__name__)
 
@@ -18,37 +18,64 @@ async def show_calendar(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     if not update.message:
         return
 
-    status_message = await update.message.reply_text("🔄 Obteniendo calendario anual...")
+    user = await require_user(update, context)
+    if user is None:
+        return
+
+    chat_id = update.effective_chat.id
+    # The portal read starts while the status message is still being sent.
+    outbox = get_outbox()
+    status = reply(update, "🔄 Obteniendo calendario anual...", merge=False)
 
     try:
-        entries = await asyncio.to_thread(fetch_calendar_summary)
+        summary = await run_portal_task(
+            load_calendar_summary,
+            user.credentials,
+            priority=Priority.READ,
+            deadline=READ_DEADLINE,
+        )
     except CalendarFetchError as exc:
         logger.warning("Calendar fetch failed: %s", exc)
-        await status_message.edit_text(f"❌ No se pudo obtener el calendario: {exc}")
+        await outbox.edit_or_send(status, chat_id, f"❌ No se pudo obtener el calendario: {exc}")
         return
-    except Exception as exc:  # noqa: BLE001
+    except Exception:  # noqa: BLE001
         logger.exception("Unexpected error while fetching the calendar")
-        await status_message.edit_text(
+        await outbox.edit_or_send(
+            status,
+            chat_id,
             "❌ Error inesperado al obtener el calendario. Inténtalo de nuevo más tarde.",
         )
         return
 
+    entries = summary.entries
+    note = ""
+    if summary.cached:
+        fetched_at = summary.fetched_at.astimezone(MADRID_TZ).strftime("%d/%m %H:%M")
+        note = f"\n🗂️ Datos guardados del {fetched_at}"
+        if summary.refreshing:
+            note += "; actualizando en segundo plano"
+        note += "."
+
     if not entries:
-        await status_message.edit_text(
-            "ℹ️ No hay vacaciones ni días no laborables registrados en el calendario.",
+        await outbox.edit_or_send(
+            status,
+            chat_id,
+            "ℹ️ No hay vacaciones ni días no laborables registrados en el calendario." + note,
         )
         return
 
     config = get_config()
     webapp_url = getattr(config, "calendar_webapp_url", "") or ""
     if not webapp_url:
-        await status_message.edit_text(
+        await outbox.edit_or_send(
+            status,
+            chat_id,
             "⚙️ Configura 'calendar_webapp_url' en config.json para abrir el calendario.",
         )
         return
 
-    payload = quote(json.dumps(entries, ensure_ascii=False, separators=(",", ":")), safe="")
-    url = f"{webapp_url}?data={payload}"
+    # The compact payload is base64url, so it needs no quoting.
+    url = f"{webapp_url}?data={summary.payload}"
 
     keyboard = InlineKeyboardMarkup(
         [
@@ -61,7 +88,9 @@ async def show_calendar(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         ]
     )
 
-    await status_message.edit_text(
-        "📆 Calendario listo. Pulsa el botón para abrirlo.",
+    await outbox.edit_or_send(
+        status,
+        chat_id,
+        "📆 Calendario listo. Pulsa el botón para abrirlo." + note,
         reply_markup=keyboard,
     )
@@ -1,17 +1,28 @@
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from fichaxebot.scheduler import SchedulerManager
+from fichaxebot.commands.state import require_user
+from fichaxebot.outbox import reply
 
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not update.message:
         return
 
-    scheduler_manager: SchedulerManager = context.application.scheduler_manager
+    user = await require_user(update, context)
+    if user is None:
+        return
+
+    scheduler_manager = user.scheduler
     if not scheduler_manager.has_pending():
-        await update.message.reply_text("No hay marcajes programados actualmente.")
+        reply(update, "No hay marcajes programados actualmente.")
         return
 
-    scheduler_manager.cancel_all()
-    await update.message.reply_text("🗓️ Todos los marcajes programados han sido cancelados.")
+    scheduler_manager.cancel_all(context.application)
+    text = "🗓️ Todos los marcajes programados han sido cancelados."
+    if scheduler_manager.list_rules():
+        text += (
+            "\n🔁 Las rutinas siguen activas desde su próxima repetición; "
+            "gestiónalas con /rutina."
+        )
+    reply(update, text)
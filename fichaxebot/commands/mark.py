@@ -4,8 +4,9 @@ from typing import Optional
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from fichaxebot.scheduler import SchedulerManager
+from fichaxebot.commands.state import require_user
 from fichaxebot.config import get_config
+from fichaxebot.outbox import reply
 from fichaxebot.utils import (
     MADRID_TZ,
     execute_check_in_async,
@@ -18,14 +19,18 @@ async def mark(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not update.message:
         return
 
+    user = await require_user(update, context)
+    if user is None:
+        return
+
     appconfig = get_config()
     if not context.args:
-        await update.message.reply_text("Uso: /marcar entrada|salida [HH:MM]")
+        reply(update, "Uso: /marcar entrada|salida [HH:MM]")
         return
 
     action = context.args[0].lower().strip()
     if action not in {"entrada", "salida"}:
-        await update.message.reply_text("Acción no reconocida. Usa 'entrada' o 'salida'.")
+        reply(update, "Acción no reconocida. Usa 'entrada' o 'salida'.")
         return
 
     scheduled_time: Optional[datetime] = None
@@ -33,7 +38,8 @@ async def mark(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         hour_arg = context.args[1]
         parsed_time = parse_hour_minute(hour_arg)
         if parsed_time is None:
-            await update.message.reply_text(
+            reply(
+                update,
                 "Formato de hora inválido. Usa HH:MM en formato 24 horas."
             )
             return
@@ -41,28 +47,30 @@ async def mark(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         now = get_madrid_now()
         scheduled_time = datetime.combine(now.date(), parsed_time, tzinfo=MADRID_TZ)
         if scheduled_time <= now:
-            await update.message.reply_text(
+            reply(
+                update,
                 "La hora indicada ya ha pasado hoy. Indica una hora futura."
             )
             return
 
-    scheduler_manager: SchedulerManager = context.application.scheduler_manager
+    scheduler_manager = user.scheduler
     if scheduled_time:
         try:
             scheduler_manager.schedule(context.application, action, scheduled_time)
         except ValueError as exc:  # pragma: no cover - validated earlier
-            await update.message.reply_text(str(exc))
+            reply(update, str(exc))
             return
 
-        await update.message.reply_text(
+        reply(
+            update,
             "🗓️ Marcaje programado de {} para las {}.".format(
                 action, scheduled_time.strftime("%H:%M")
             )
         )
         return
 
-    result = await execute_check_in_async(action, context)
-    await update.message.reply_text(result.message)
+    result = await execute_check_in_async(action, context, credentials=user.credentials)
+    reply(update, result.message)
 
     if action == "entrada":
         if result.success:
@@ -73,28 +81,33 @@ async def mark(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
                         context.application
                     )
                 except ValueError:
-                    await update.message.reply_text(
+                    reply(
+                        update,
                         "⚠️ No se programó la salida porque la hora calculada no es válida."
                     )
                 else:
-                    await update.message.reply_text(
+                    reply(
+                        update,
                         "🕐 Salida programada para las {}".format(
                             auto_mark.when.strftime("%H:%M")
                         )
                     )
             else:
-                await update.message.reply_text(
+                reply(
+                    update,
                     "ℹ️ La salida automática está desactivada en la configuración."
                 )
         else:
-            await update.message.reply_text(
+            reply(
+                update,
                 "🚫 No se programó la salida porque la entrada no se confirmó."
             )
         return
     else:
         if result.success:
-            removed = scheduler_manager.cancel_by_action("salida")
+            removed = scheduler_manager.cancel_by_action("salida", context.application)
             if removed:
-                await update.message.reply_text(
+                reply(
+                    update,
                     "🗓️ Se cancelaron {} marcajes de salida programados.".format(removed)
                 )
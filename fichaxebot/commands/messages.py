@@ -1,8 +1,8 @@
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from fichaxebot.scheduler import SchedulerManager
 from fichaxebot.config import get_config
+from fichaxebot.outbox import reply
 from fichaxebot.utils import cancel_reminder, execute_check_in_async, get_madrid_now
 
 from fichaxebot.commands.state import (
@@ -10,6 +10,7 @@ from fichaxebot.commands.state import (
     QUESTION_DATE_KEY,
     REMINDER_ATTEMPTS_KEY,
     REMINDER_JOB_KEY,
+    require_user,
 )
 
 
@@ -20,25 +21,34 @@ async def process_response(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     response = update.message.text.lower().strip()
     today = get_madrid_now().date()
 
-    scheduler_manager: SchedulerManager = context.application.scheduler_manager
+    state = context.chat_data
+    awaiting = bool(state.get(AWAITING_RESPONSE_KEY))
     appconfig = get_config()
-    if response in {"sí", "si"} and context.application.bot_data[AWAITING_RESPONSE_KEY]:
-        if scheduler_manager.has_pending():
-            await update.message.reply_text(
+    if response in {"sí", "si"} and awaiting:
+        user = await require_user(update, context)
+        if user is None:
+            return
+
+        scheduler_manager = user.scheduler
+        if scheduler_manager.pending_on(today):
+            reply(
+                update,
                 "⚠️ Ya existen marcajes programados. Cancélalos con /cancelar si deseas reiniciar."
             )
-            context.application.bot_data[AWAITING_RESPONSE_KEY] = False
-            context.application.bot_data[QUESTION_DATE_KEY] = today
+            state[AWAITING_RESPONSE_KEY] = False
+            state[QUESTION_DATE_KEY] = today
             cancel_reminder(
-                context.application,
+                state,
                 REMINDER_JOB_KEY,
                 REMINDER_ATTEMPTS_KEY,
             )
             return
 
-        await update.message.reply_text("🔄 Intentando fichaje de entrada...")
-        result = await execute_check_in_async("entrada", context)
-        await update.message.reply_text(result.message)
+        reply(update, "🔄 Intentando fichaje de entrada...")
+        result = await execute_check_in_async(
+            "entrada", context, credentials=user.credentials
+        )
+        reply(update, result.message)
 
         if result.success:
             auto_delay = appconfig.auto_checkout_delay
@@ -48,39 +58,43 @@ async def process_response(update: Update, context: ContextTypes.DEFAULT_TYPE) -
                         context.application
                     )
                 except ValueError:
-                    await update.message.reply_text(
+                    reply(
+                        update,
                         "⚠️ La hora calculada para la salida ya no es válida."
                     )
                 else:
-                    await update.message.reply_text(
+                    reply(
+                        update,
                         "🕐 Salida programada para las {}".format(
                             auto_mark.when.strftime("%H:%M")
                         )
                     )
             else:
-                await update.message.reply_text(
+                reply(
+                    update,
                     "ℹ️ La salida automática está desactivada en la configuración."
                 )
         else:
-            await update.message.reply_text(
+            reply(
+                update,
                 "🚫 No se programó la salida porque la entrada no se confirmó."
             )
 
-        context.application.bot_data[AWAITING_RESPONSE_KEY] = False
-        context.application.bot_data[QUESTION_DATE_KEY] = today
+        state[AWAITING_RESPONSE_KEY] = False
+        state[QUESTION_DATE_KEY] = today
         cancel_reminder(
-            context.application,
+            state,
             REMINDER_JOB_KEY,
             REMINDER_ATTEMPTS_KEY,
         )
         return
 
-    if response == "no" and context.application.bot_data[AWAITING_RESPONSE_KEY]:
-        await update.message.reply_text("🚫 No se fichará hoy.")
-        context.application.bot_data[AWAITING_RESPONSE_KEY] = False
-        context.application.bot_data[QUESTION_DATE_KEY] = today
+    if response == "no" and awaiting:
+        reply(update, "🚫 No se fichará hoy.")
+        state[AWAITING_RESPONSE_KEY] = False
+        state[QUESTION_DATE_KEY] = today
         cancel_reminder(
-            context.application,
+            state,
             REMINDER_JOB_KEY,
             REMINDER_ATTEMPTS_KEY,
         )
@@ -89,5 +103,5 @@ async def process_response(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     if response in {"marcar", "/marcar", "cancelar", "/cancelar"}:
         return
 
-    if context.application.bot_data.get(AWAITING_RESPONSE_KEY):
-        await update.message.reply_text("Por favor responde 'Sí' o 'No'.")
+    if awaiting:
+        reply(update, "Por favor responde 'Sí' o 'No'.")
@@ -1,7 +1,8 @@
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from fichaxebot.scheduler import SchedulerManager
+from fichaxebot.commands.state import require_user
+from fichaxebot.outbox import reply
 from fichaxebot.utils import MADRID_TZ
 
 
@@ -9,10 +10,14 @@ async def show_pending(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     if not update.message:
         return
 
-    scheduler_manager: SchedulerManager = context.application.scheduler_manager
+    user = await require_user(update, context)
+    if user is None:
+        return
+
+    scheduler_manager = user.scheduler
     pending = scheduler_manager.list_pending()
     if not pending:
-        await update.message.reply_text("No hay marcajes programados en el scheduler.")
+        reply(update, "No hay marcajes programados en el scheduler.")
         return
 
     lines = []
@@ -20,4 +25,4 @@ async def show_pending(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         when = mark.when.astimezone(MADRID_TZ)
         lines.append(f"• {mark.action.capitalize()} el {when.strftime('%d/%m a las %H:%M')}")
 
-    await update.message.reply_text("Marcajes pendientes:\n" + "\n".join(lines))
+    reply(update, "Marcajes pendientes:\n" + "\n".join(lines))
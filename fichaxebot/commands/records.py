@@ -1,25 +1,44 @@
-import asyncio
-
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from fichaxebot.fichador import get_today_records
+from fichaxebot.executor import READ_DEADLINE, Priority, run_portal_task
+from fichaxebot.commands.state import require_user
+from fichaxebot.fichador import get_today_snapshot
+from fichaxebot.outbox import reply
+
+REFRESH_ARGUMENTS = {"actualizar", "refrescar"}
 
 
 async def show_records(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not update.message:
         return
 
-    await update.message.reply_text("🔍 Consultando marcajes de hoy...")
+    user = await require_user(update, context)
+    if user is None:
+        return
+
+    force_refresh = bool(context.args) and context.args[0].lower().strip() in REFRESH_ARGUMENTS
+    if force_refresh:
+        reply(update, "🔍 Consultando marcajes de hoy...")
     try:
-        records = await asyncio.to_thread(get_today_records)
+        snapshot = await run_portal_task(
+            get_today_snapshot,
+            force_refresh,
+            user.credentials,
+            priority=Priority.READ,
+            deadline=READ_DEADLINE,
+        )
     except Exception as exc:  # noqa: BLE001
-        await update.message.reply_text(f"❌ No se pudo obtener la información: {exc}")
+        reply(update, f"❌ No se pudo obtener la información: {exc}")
         return
 
-    if not records:
-        await update.message.reply_text("ℹ️ No se encontraron marcajes registrados hoy.")
+    stamp = f"🕒 Datos de las {snapshot.fetched_at.strftime('%H:%M:%S')} (/marcajes actualizar)"
+    if not snapshot.records:
+        reply(update, f"ℹ️ No se encontraron marcajes registrados hoy.\n{stamp}")
         return
 
-    lines = [f"• Entrada: {item['entrada']} | Salida: {item['salida']}" for item in records]
-    await update.message.reply_text("\n".join(lines))
+    lines = [
+        f"• Entrada: {item['entrada']} | Salida: {item['salida']}" for item in snapshot.records
+    ]
+    lines.append(stamp)
+    reply(update, "\n".join(lines))
@@ -0,0 +1,86 @@
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import ContextTypes
+
+from fichaxebot.commands.state import (
+    AWAITING_RESPONSE_KEY,
+    REMINDER_ATTEMPTS_KEY,
+    REMINDER_JOB_KEY,
+)
+from fichaxebot.executor import READ_DEADLINE, Priority, run_portal_task
+from fichaxebot.fichador import Credentials, PortalLoginError, verify_credentials
+from fichaxebot.logging_config import get_logger
+from fichaxebot.outbox import get_outbox, reply
+from fichaxebot.users import get_user_registry
+from fichaxebot.utils import cancel_reminder
+
+logger = get_logger(__name__)
+
+
+async def register(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not update.message or not update.effective_chat:
+        return
+
+    chat_id = update.effective_chat.id
+    if context.args:
+        # The message carries the password; do not leave it in the chat.
+        try:
+            await update.message.delete()
+        except TelegramError:
+            logger.warning("Could not delete the registration message of chat %s", chat_id)
+
+    if not context.args or len(context.args) != 2:
+        reply(update, "Uso: /registro usuario contraseña")
+        return
+
+    credentials = Credentials(context.args[0].strip(), context.args[1])
+    outbox = get_outbox()
+    status = reply(update, "🔐 Comprobando las credenciales en el portal...", merge=False)
+    try:
+        await run_portal_task(
+            verify_credentials,
+            credentials,
+            priority=Priority.INTERACTIVE,
+            deadline=READ_DEADLINE,
+        )
+    except PortalLoginError:
+        await outbox.edit_or_send(
+            status,
+            chat_id,
+            "❌ El portal no aceptó el usuario o la contraseña. No se guardó nada."
+        )
+        return
+    except Exception as exc:  # noqa: BLE001
+        logger.warning("Could not verify the credentials of chat %s: %s", chat_id, exc)
+        await outbox.edit_or_send(
+            status,
+            chat_id,
+            f"❌ No se pudieron comprobar las credenciales: {exc}\nInténtalo más tarde."
+        )
+        return
+
+    get_user_registry().register(chat_id, credentials)
+    await outbox.edit_or_send(
+        status,
+        chat_id,
+        f"✅ Cuenta {credentials.user} registrada. La contraseña se guarda cifrada."
+    )
+
+
+async def unregister(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not update.message or not update.effective_chat:
+        return
+
+    chat_id = update.effective_chat.id
+    registry = get_user_registry()
+    user = registry.get(context.application, chat_id)
+    if not registry.unregister(chat_id):
+        reply(update, "No hay ninguna cuenta registrada en este chat.")
+        return
+
+    if user is not None:
+        user.scheduler.remove_all_rules()
+        user.scheduler.cancel_all()
+    cancel_reminder(context.chat_data, REMINDER_JOB_KEY, REMINDER_ATTEMPTS_KEY)
+    context.chat_data[AWAITING_RESPONSE_KEY] = False
+    reply(update, "🗑️ Cuenta eliminada y marcajes programados cancelados.")
@@ -0,0 +1,80 @@
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from fichaxebot.commands.state import require_user
+from fichaxebot.outbox import reply
+from fichaxebot.scheduler import parse_weekdays
+from fichaxebot.utils import parse_hour_minute
+
+USAGE = (
+    "Uso:\n"
+    "• /rutina: lista las rutinas\n"
+    "• /rutina días entrada|salida HH:MM: añade una rutina, p. ej. "
+    "/rutina L-V entrada 08:00 o /rutina V salida 14:00\n"
+    "• /rutina borrar N: borra la rutina número N\n"
+    "Días: L M X J V S D, separados por comas o en rangos (L-V), o 'laborables' y 'diario'."
+)
+
+
+async def routine(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not update.message:
+        return
+
+    user = await require_user(update, context)
+    if user is None:
+        return
+
+    scheduler_manager = user.scheduler
+    args = context.args or []
+
+    if not args:
+        rules = scheduler_manager.list_rules()
+        if not rules:
+            reply(update, "No hay rutinas configuradas.\n\n" + USAGE)
+            return
+        lines = []
+        for number, rule in enumerate(rules, start=1):
+            line = f"{number}. {rule.describe().capitalize()}"
+            pending = scheduler_manager.pending_for_rule(rule.identifier)
+            if pending is not None:
+                line += f", próxima el {pending.when.strftime('%d/%m a las %H:%M')}"
+            lines.append(line)
+        reply(update, "🔁 Rutinas:\n" + "\n".join(lines))
+        return
+
+    if args[0].lower() == "borrar":
+        rules = scheduler_manager.list_rules()
+        if len(args) != 2 or not args[1].isdigit() or not 1 <= int(args[1]) <= len(rules):
+            reply(update, "Indica el número de la rutina que quieres borrar (ver /rutina).")
+            return
+        rule = rules[int(args[1]) - 1]
+        scheduler_manager.remove_rule(rule.identifier)
+        reply(update, f"🗑️ Rutina borrada: {rule.describe()}.")
+        return
+
+    if len(args) != 3:
+        reply(update, USAGE)
+        return
+
+    weekdays = parse_weekdays(args[0])
+    if weekdays is None:
+        reply(update, "Días no reconocidos. Usa L M X J V S D, rangos como L-V o 'laborables'.")
+        return
+
+    action = args[1].lower().strip()
+    if action not in {"entrada", "salida"}:
+        reply(update, "Acción no reconocida. Usa 'entrada' o 'salida'.")
+        return
+
+    at = parse_hour_minute(args[2])
+    if at is None:
+        reply(update, "Formato de hora inválido. Usa HH:MM en formato 24 horas.")
+        return
+
+    rule, mark = scheduler_manager.add_rule(context.application, action, at, weekdays)
+    text = f"🔁 Rutina añadida: {rule.describe()}."
+    if mark is not None:
+        text += f"\n🗓️ Próximo marcaje el {mark.when.strftime('%d/%m a las %H:%M')}."
+    else:
+        text += "\n⚠️ No hay ningún día laborable para ella en el próximo año."
+    reply(update, text)
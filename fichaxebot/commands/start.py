@@ -2,6 +2,8 @@ from telegram import Update
 from telegram.ext import ContextTypes
 
 from fichaxebot.config import get_config
+from fichaxebot.outbox import reply
+from fichaxebot.users import get_user_registry
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -11,8 +13,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     appconfig = get_config()
     ask_time = appconfig.daily_question_time.strftime("%H:%M")
 
-    await update.message.reply_text(
+    text = (
         "👋 Bot de fichaje USC listo.\n"
         f"Preguntaré cada día laborable a las {ask_time} (hora de Madrid).\n"
-        "Comandos: /marcar entrada|salida [HH:MM], /marcajes, /pendientes y /cancelar."
+        "Comandos: /marcar entrada|salida [HH:MM], /marcajes [actualizar], /pendientes, "
+        "/rutina, /cancelar, /estado, /registro usuario contraseña y /baja."
     )
+    if update.effective_chat and not get_user_registry().is_registered(
+        update.effective_chat.id
+    ):
+        text += "\n🔐 Antes de nada, registra tu cuenta del portal con /registro."
+    reply(update, text)
@@ -1,4 +1,32 @@
+from typing import Optional
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from fichaxebot.outbox import reply
+from fichaxebot.users import UserContext, get_user_registry
+
+# Keys of the per-chat state kept in ``context.chat_data``.
 QUESTION_DATE_KEY = "question_date"
 AWAITING_RESPONSE_KEY = "awaiting_response"
 REMINDER_JOB_KEY = "reminder_job"
 REMINDER_ATTEMPTS_KEY = "reminder_attempts"
+
+NOT_REGISTERED_TEXT = (
+    "🔐 Este chat no tiene una cuenta del portal registrada. "
+    "Usa /registro usuario contraseña para empezar."
+)
+
+
+async def require_user(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> Optional[UserContext]:
+    """Return the user of the chat, telling unregistered chats how to register."""
+
+    if not update.effective_chat:
+        return None
+
+    user = get_user_registry().get(context.application, update.effective_chat.id)
+    if user is None and update.message:
+        reply(update, NOT_REGISTERED_TEXT)
+    return user
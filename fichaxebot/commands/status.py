@@ -0,0 +1,94 @@
+from typing import Optional
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from fichaxebot.commands.state import require_user
+from fichaxebot.config import get_config
+from fichaxebot.executor import get_executor
+from fichaxebot.logging_config import get_logger
+from fichaxebot.mark_store import get_mark_store
+from fichaxebot.metrics import get_metrics
+from fichaxebot.outbox import get_outbox, reply
+from fichaxebot.users import get_user_registry
+
+logger = get_logger(__name__)
+
+
+def _seconds(value: Optional[float]) -> str:
+    if value is None:
+        return "-"
+    return f"{value:.2f} s" if value < 10 else f"{value:.0f} s"
+
+
+def build_status_text() -> str:
+    metrics = get_metrics()
+    lines = ["📊 Estado del bot"]
+
+    spans = metrics.spans()
+    if spans:
+        lines.append("\nTiempos (p50 / p95):")
+        for name, summary in spans.items():
+            errors = f", {summary.errors} con error" if summary.errors else ""
+            lines.append(
+                f"• {name}: {_seconds(summary.p50)} / {_seconds(summary.p95)} "
+                f"(n={summary.count}{errors})"
+            )
+    else:
+        lines.append("\nSin operaciones registradas desde el arranque.")
+
+    lines.append("\nFichajes:")
+    for action in ("entrada", "salida"):
+        ok = metrics.counter("checkins", action=action, outcome="success")
+        failed = metrics.counter("checkins", action=action, outcome="failure")
+        lines.append(f"• {action.capitalize()}: {ok} ✅ / {failed} ❌")
+
+    registry = get_user_registry()
+    lines.append(
+        f"\nUsuarios: {registry.registered_count} registrados, "
+        f"{registry.active_count} cargados en memoria"
+    )
+    lines.append(
+        f"Mensajes: {get_outbox().depth} en cola, "
+        f"{metrics.counter('telegram_messages', outcome='sent')} enviados, "
+        f"{metrics.counter('telegram_messages', outcome='merged')} agrupados, "
+        f"{metrics.counter('telegram_messages', outcome='retry_after')} esperas por límite"
+    )
+
+    if get_config().scheduled_marks_runner == "workers":
+        counts = get_mark_store().counts()
+        lines.append(
+            f"Marcajes en los workers: {counts['queued']} pendientes, "
+            f"{counts['leased']} en curso, {counts['events']} resultados por avisar"
+        )
+
+    executor = get_executor()
+    lines.append(
+        f"\nCola del portal: {executor.depth} en espera (máximo {executor.max_depth})"
+    )
+    for priority, item in executor.metrics().items():
+        if item.submitted:
+            lines.append(
+                f"• {priority.name.lower()}: {item.submitted} tareas, espera media "
+                f"{_seconds(item.mean_wait)}, máxima {_seconds(item.max_wait)}"
+            )
+    return "\n".join(lines)
+
+
+async def show_status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not update.message:
+        return
+
+    # The figures cover every user of the bot, so only its owner sees them.
+    user = await require_user(update, context)
+    if user is None:
+        return
+    if user.chat_id != get_user_registry().owner_chat_id:
+        reply(update, "⛔ /estado solo está disponible en el chat del propietario del bot.")
+        return
+
+    try:
+        get_metrics().export()
+    except OSError:
+        logger.warning("Could not export the metrics file", exc_info=True)
+    reply(update, build_status_text())
@@ -1,10 +1,14 @@
 from __future__ import annotations
 
+import hashlib
 import json
+import os
+import tempfile
 from dataclasses import dataclass
 from datetime import time as dtime, timedelta
 from pathlib import Path
-from typing import Optional
+from typing import Final, List, Optional, Union
+from zoneinfo import ZoneInfo
 
 from fichaxebot.logging_config import get_logger
 
@@ -12,6 +16,18 @@ logger = get_logger(__name__)
 
 CONFIG_FILE = Path(__file__).parent.parent / "config.json"
 
+# Time zone of the portal and of every time the bot shows or schedules.
+MADRID_TZ: Final[ZoneInfo] = ZoneInfo("Europe/Madrid")
+
+PORTAL_BACKENDS = ("selenium", "http")
+MARK_RUNNERS = ("bot", "workers")
+DEFAULT_MARK_STORE_PATH = ".marks.db"
+DEFAULT_PORTAL_URL = "https://fichaxe.usc.gal"
+RESOURCE_CATEGORIES = ("images", "fonts", "media", "stylesheets", "analytics")
+# Stylesheets are opt-in: without them the portal may lay out its buttons
+# differently, so they are only blocked when the configuration asks for it.
+DEFAULT_BLOCKED_RESOURCES = ("images", "fonts", "media", "analytics")
+
 
 @dataclass
 class AppConfig:
@@ -25,6 +41,23 @@ class AppConfig:
     max_reminders: int
     reminder_interval: timedelta
     calendar_webapp_url: str
+    driver_pool_size: int
+    driver_max_uses: int
+    portal_backend: str
+    portal_url: str
+    mark_confirmation_timeout: timedelta
+    blocked_resources: List[str]
+    chromedriver_path: str
+    prewarm_lead: timedelta
+    mark_target_window: timedelta
+    records_cache_ttl: timedelta
+    calendar_max_age: timedelta
+    portal_workers: int
+    user_idle_timeout: timedelta
+    telegram_messages_per_second: int
+    telegram_chat_messages_per_minute: int
+    scheduled_marks_runner: str
+    mark_store_path: str
 
 
 _config: Optional[AppConfig] = None
@@ -110,6 +143,107 @@ def load_config(path: Optional[Path] = None) -> AppConfig:
 
     calendar_webapp_url = str(data.get("calendar_webapp_url", "") or "").strip()
 
+    pool_size_raw = data.get("driver_pool_size", 1)
+    driver_pool_size = _parse_int_field(pool_size_raw, "driver_pool_size")
+    if driver_pool_size <= 0:
+        raise ValueError("El valor de 'driver_pool_size' debe ser mayor que cero")
+
+    max_uses_raw = data.get("driver_max_uses", 25)
+    driver_max_uses = _parse_int_field(max_uses_raw, "driver_max_uses")
+    if driver_max_uses <= 0:
+        raise ValueError("El valor de 'driver_max_uses' debe ser mayor que cero")
+
+    portal_backend = str(data.get("portal_backend", "selenium") or "").strip().lower()
+    if portal_backend not in PORTAL_BACKENDS:
+        raise ValueError(
+            "El valor de 'portal_backend' debe ser uno de: " + ", ".join(PORTAL_BACKENDS)
+        )
+
+    portal_url = str(data.get("portal_url", DEFAULT_PORTAL_URL) or "").strip().rstrip("/")
+    if not portal_url.startswith(("http://", "https://")):
+        raise ValueError("El valor de 'portal_url' debe ser una URL http(s)")
+
+    confirmation_raw = data.get("mark_confirmation_timeout_seconds", 30)
+    confirmation_seconds = _parse_int_field(confirmation_raw, "mark_confirmation_timeout_seconds")
+    if confirmation_seconds <= 0:
+        raise ValueError(
+            "El valor de 'mark_confirmation_timeout_seconds' debe ser mayor que cero"
+        )
+    mark_confirmation_timeout = timedelta(seconds=confirmation_seconds)
+
+    blocked_raw = data.get("blocked_resources", list(DEFAULT_BLOCKED_RESOURCES))
+    if not isinstance(blocked_raw, list):
+        raise ValueError("El valor de 'blocked_resources' debe ser una lista")
+    blocked_resources = [str(item).strip().lower() for item in blocked_raw]
+    unknown = sorted(set(blocked_resources) - set(RESOURCE_CATEGORIES))
+    if unknown:
+        raise ValueError(
+            "Categorías desconocidas en 'blocked_resources': " + ", ".join(unknown)
+        )
+
+    chromedriver_path = str(data.get("chromedriver_path", "") or "").strip()
+
+    prewarm_raw = data.get("prewarm_lead_seconds", 60)
+    prewarm_seconds = _parse_int_field(prewarm_raw, "prewarm_lead_seconds")
+    if prewarm_seconds < 0:
+        raise ValueError("El valor de 'prewarm_lead_seconds' no puede ser negativo")
+    prewarm_lead = timedelta(seconds=prewarm_seconds)
+
+    target_window_raw = data.get("mark_target_window_seconds", 30)
+    target_window_seconds = _parse_int_field(target_window_raw, "mark_target_window_seconds")
+    if target_window_seconds < 0:
+        raise ValueError("El valor de 'mark_target_window_seconds' no puede ser negativo")
+    mark_target_window = timedelta(seconds=target_window_seconds)
+
+    records_ttl_raw = data.get("records_cache_ttl_seconds", 60)
+    records_ttl_seconds = _parse_int_field(records_ttl_raw, "records_cache_ttl_seconds")
+    if records_ttl_seconds < 0:
+        raise ValueError("El valor de 'records_cache_ttl_seconds' no puede ser negativo")
+    records_cache_ttl = timedelta(seconds=records_ttl_seconds)
+
+    calendar_age_raw = data.get("calendar_max_age_hours", 24)
+    calendar_age_hours = _parse_int_field(calendar_age_raw, "calendar_max_age_hours")
+    if calendar_age_hours < 0:
+        raise ValueError("El valor de 'calendar_max_age_hours' no puede ser negativo")
+    calendar_max_age = timedelta(hours=calendar_age_hours)
+
+    workers_raw = data.get("portal_workers", 2)
+    portal_workers = _parse_int_field(workers_raw, "portal_workers")
+    if portal_workers <= 0:
+        raise ValueError("El valor de 'portal_workers' debe ser mayor que cero")
+
+    idle_raw = data.get("user_idle_minutes", 30)
+    idle_minutes = _parse_int_field(idle_raw, "user_idle_minutes")
+    if idle_minutes <= 0:
+        raise ValueError("El valor de 'user_idle_minutes' debe ser mayor que cero")
+    user_idle_timeout = timedelta(minutes=idle_minutes)
+
+    global_rate_raw = data.get("telegram_messages_per_second", 25)
+    telegram_messages_per_second = _parse_int_field(
+        global_rate_raw, "telegram_messages_per_second"
+    )
+    if telegram_messages_per_second <= 0:
+        raise ValueError("El valor de 'telegram_messages_per_second' debe ser mayor que cero")
+
+    chat_rate_raw = data.get("telegram_chat_messages_per_minute", 30)
+    telegram_chat_messages_per_minute = _parse_int_field(
+        chat_rate_raw, "telegram_chat_messages_per_minute"
+    )
+    if telegram_chat_messages_per_minute <= 0:
+        raise ValueError(
+            "El valor de 'telegram_chat_messages_per_minute' debe ser mayor que cero"
+        )
+
+    scheduled_marks_runner = (
+        str(data.get("scheduled_marks_runner", "bot") or "").strip().lower()
+    )
+    if scheduled_marks_runner not in MARK_RUNNERS:
+        raise ValueError(
+            "El valor de 'scheduled_marks_runner' debe ser uno de: " + ", ".join(MARK_RUNNERS)
+        )
+
+    mark_store_path = str(data.get("mark_store_path", "") or "").strip() or DEFAULT_MARK_STORE_PATH
+
     return AppConfig(
         telegram_token=str(data["telegram_token"]),
         telegram_chat_id=str(data["telegram_chat_id"]),
@@ -121,6 +255,23 @@ def load_config(path: Optional[Path] = None) -> AppConfig:
         max_reminders=max_reminders,
         reminder_interval=reminder_interval,
         calendar_webapp_url=calendar_webapp_url,
+        driver_pool_size=driver_pool_size,
+        driver_max_uses=driver_max_uses,
+        portal_backend=portal_backend,
+        portal_url=portal_url,
+        mark_confirmation_timeout=mark_confirmation_timeout,
+        blocked_resources=blocked_resources,
+        chromedriver_path=chromedriver_path,
+        prewarm_lead=prewarm_lead,
+        mark_target_window=mark_target_window,
+        records_cache_ttl=records_cache_ttl,
+        calendar_max_age=calendar_max_age,
+        portal_workers=portal_workers,
+        user_idle_timeout=user_idle_timeout,
+        telegram_messages_per_second=telegram_messages_per_second,
+        telegram_chat_messages_per_minute=telegram_chat_messages_per_minute,
+        scheduled_marks_runner=scheduled_marks_runner,
+        mark_store_path=mark_store_path,
     )
 
 
@@ -130,3 +281,53 @@ def get_config() -> AppConfig:
         _config = load_config()
         logger.info("Configuration loaded from %s", CONFIG_FILE)
     return _config
+
+
+def set_config(config: AppConfig) -> None:
+    """Replace the active configuration, e.g. to point the bot to a local portal."""
+
+    global _config
+    _config = config
+
+
+def scoped_path(base: Path, scope: Optional[str]) -> Path:
+    """Return the file of one account next to ``base``.
+
+    The account of the configuration file (``scope`` ``None``) keeps using
+    ``base`` itself so that its data survives the move to several users.
+    """
+
+    if scope is None:
+        return base
+    digest = hashlib.sha256(scope.encode("utf-8")).hexdigest()[:16]
+    return base.with_name(f"{base.stem}.{digest}{base.suffix}")
+
+
+def write_atomic(
+    path: Path, content: Union[str, bytes], mode: int = 0o644, durable: bool = False
+) -> None:
+    """Replace ``path`` with ``content`` without readers ever seeing half of it.
+
+    The content is written to a temporary file of its own next to ``path``,
+    so processes saving the same file at once never write into each other's
+    copy. With ``durable`` it reaches the disk before the rename.
+    """
+
+    data = content.encode("utf-8") if isinstance(content, str) else content
+    handle = tempfile.NamedTemporaryFile(
+        dir=path.parent, prefix=f"{path.name}.", suffix=".tmp", delete=False
+    )
+    try:
+        with handle:
+            os.chmod(handle.name, mode)
+            handle.write(data)
+            if durable:
+                handle.flush()
+                os.fsync(handle.fileno())
+        os.replace(handle.name, path)
+    except BaseException:
+        try:
+            os.unlink(handle.name)
+        except OSError:
+            pass
+        raise
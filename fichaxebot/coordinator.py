@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Hashable, Iterator, Optional, TypeVar
+
+from fichaxebot.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+
+class _AccountLock:
+    """Shared/exclusive lock of one portal account that favours marks.
+
+    Reads share the account among themselves, a mark owns it alone, and a mark
+    waiting for the lock stops new reads from starting so that they queue
+    behind it instead of racing it.
+    """
+
+    def __init__(self) -> None:
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+        # Operations using the lock; the coordinator drops it when none is left.
+        self.holders = 0
+
+    @contextmanager
+    def shared(self) -> Iterator[None]:
+        with self._condition:
+            while self._writing or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def exclusive(self) -> Iterator[None]:
+        with self._condition:
+            self._writers_waiting += 1
+            try:
+                while self._writing or self._readers:
+                    self._condition.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+class _Flight:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class PortalCoordinator:
+    """Serialises the portal operations issued against every account.
+
+    Identical reads that overlap in time share a single execution, and marks
+    take the account exclusively.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._accounts: dict[str, _AccountLock] = {}
+        self._flights: dict[tuple[str, Hashable], _Flight] = {}
+
+    @contextmanager
+    def _account(self, user: str) -> Iterator[_AccountLock]:
+        """Lend ``user``'s lock, which only lives while some operation holds it."""
+
+        with self._lock:
+            account = self._accounts.get(user)
+            if account is None:
+                account = self._accounts[user] = _AccountLock()
+            account.holders += 1
+        try:
+            yield account
+        finally:
+            with self._lock:
+                account.holders -= 1
+                if not account.holders:
+                    del self._accounts[user]
+
+    @contextmanager
+    def exclusive(self, user: str) -> Iterator[None]:
+        """Hold ``user``'s account alone, e.g. while registering a mark."""
+
+        with self._account(user) as account, account.exclusive():
+            yield
+
+    def read(self, user: str, key: Hashable, func: Callable[[], T]) -> T:
+        """Run the read ``func`` or join the identical one already in flight."""
+
+        flight_key = (user, key)
+        with self._lock:
+            flight = self._flights.get(flight_key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[flight_key] = _Flight()
+
+        if not leader:
+            logger.info("Joining in-flight portal read %s", key)
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            with self._account(user) as account, account.shared():
+                flight.result = func()
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._flights[flight_key]
+            flight.done.set()
+        return flight.result
+
+
+_coordinator = PortalCoordinator()
+
+
+def get_portal_coordinator() -> PortalCoordinator:
+    return _coordinator
@@ -0,0 +1,248 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Callable, Optional, TypeVar
+
+from fichaxebot.config import get_config
+from fichaxebot.logging_config import get_logger
+from fichaxebot.metrics import get_metrics
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+# Longest queue wait for a read a user is waiting on in the chat.
+READ_DEADLINE: float = 120.0
+
+
+class Priority(IntEnum):
+    """Order in which queued portal work is picked up (lowest first)."""
+
+    SCHEDULED = 0
+    INTERACTIVE = 1
+    READ = 2
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a task is still queued after its deadline."""
+
+
+@dataclass(order=True)
+class _Task:
+    priority: int
+    sequence: int
+    func: Callable[..., Any] = field(compare=False)
+    args: tuple[Any, ...] = field(compare=False)
+    future: Future = field(compare=False)
+    submitted: float = field(compare=False)
+    deadline: Optional[float] = field(compare=False)
+
+
+@dataclass
+class PriorityMetrics:
+    """Counters of the tasks submitted with one priority."""
+
+    submitted: int = 0
+    completed: int = 0
+    failed: int = 0
+    expired: int = 0
+    cancelled: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+    @property
+    def started(self) -> int:
+        return self.completed + self.failed
+
+    @property
+    def mean_wait(self) -> float:
+        return self.total_wait / self.started if self.started else 0.0
+
+
+class PortalExecutor:
+    """Bounded pool of threads that runs blocking portal work by priority.
+
+    Scheduled marks are served before interactive marks, and those before
+    read-only queries. Tasks may carry a deadline: one that is still queued
+    when it expires fails with :class:`DeadlineExceeded` without running.
+    """
+
+    def __init__(self, workers: int) -> None:
+        self._condition = threading.Condition()
+        self._queue: list[_Task] = []
+        self._sequence = itertools.count()
+        self._closed = False
+        self._max_depth = 0
+        self._metrics = {priority: PriorityMetrics() for priority in Priority}
+        self._threads = [
+            threading.Thread(target=self._work, name=f"portal-worker-{index}", daemon=True)
+            for index in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(
+        self,
+        func: Callable[..., T],
+        *args: Any,
+        priority: Priority = Priority.READ,
+        deadline: Optional[float] = None,
+    ) -> "Future[T]":
+        """Queue ``func(*args)``; ``deadline`` is the longest wait in seconds."""
+
+        future: Future = Future()
+        now = time.monotonic()
+        task = _Task(
+            priority=priority,
+            sequence=next(self._sequence),
+            func=func,
+            args=args,
+            future=future,
+            submitted=now,
+            deadline=None if deadline is None else now + deadline,
+        )
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("The portal executor has been shut down")
+            heapq.heappush(self._queue, task)
+            self._max_depth = max(self._max_depth, len(self._queue))
+            self._metrics[priority].submitted += 1
+            self._condition.notify()
+        return future
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                while not self._queue and not self._closed:
+                    self._condition.wait()
+                if not self._queue:
+                    return
+                task = heapq.heappop(self._queue)
+            self._run(task)
+
+    def _run(self, task: _Task) -> None:
+        metrics = self._metrics[Priority(task.priority)]
+        if not task.future.set_running_or_notify_cancel():
+            with self._condition:
+                metrics.cancelled += 1
+            return
+
+        started = time.monotonic()
+        if task.deadline is not None and started > task.deadline:
+            with self._condition:
+                metrics.expired += 1
+            logger.warning(
+                "Dropping %s: queued for %.1f s, past its deadline",
+                getattr(task.func, "__name__", task.func),
+                started - task.submitted,
+            )
+            task.future.set_exception(
+                DeadlineExceeded("La operación esperó demasiado en la cola del portal")
+            )
+            return
+
+        wait = started - task.submitted
+        if wait >= 1.0:
+            logger.info(
+                "%s waited %.1f s in the portal queue (%s)",
+                getattr(task.func, "__name__", task.func),
+                wait,
+                Priority(task.priority).name.lower(),
+            )
+        try:
+            result = task.func(*task.args)
+        except BaseException as exc:  # noqa: BLE001
+            outcome = "failed"
+            task.future.set_exception(exc)
+        else:
+            outcome = "completed"
+            task.future.set_result(result)
+        with self._condition:
+            setattr(metrics, outcome, getattr(metrics, outcome) + 1)
+            metrics.total_wait += wait
+            metrics.max_wait = max(metrics.max_wait, wait)
+
+    @property
+    def depth(self) -> int:
+        with self._condition:
+            return len(self._queue)
+
+    @property
+    def max_depth(self) -> int:
+        with self._condition:
+            return self._max_depth
+
+    def metrics(self) -> dict[Priority, PriorityMetrics]:
+        with self._condition:
+            return {
+                priority: PriorityMetrics(**vars(item)) for priority, item in self._metrics.items()
+            }
+
+    def collect(self) -> list[tuple[str, dict[str, str], float]]:
+        """Return the queue figures as gauge samples for the metrics export."""
+
+        samples: list[tuple[str, dict[str, str], float]] = [
+            ("executor_queue_depth", {}, self.depth),
+            ("executor_queue_max_depth", {}, self.max_depth),
+        ]
+        for priority, item in self.metrics().items():
+            labels = {"priority": priority.name.lower()}
+            samples += [
+                ("executor_wait_mean_seconds", labels, item.mean_wait),
+                ("executor_wait_max_seconds", labels, item.max_wait),
+                ("executor_tasks_expired", labels, item.expired),
+            ]
+        return samples
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop accepting work; queued tasks still run before the workers exit."""
+
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+
+_executor: Optional[PortalExecutor] = None
+_lock = threading.Lock()
+
+
+def get_executor() -> PortalExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = PortalExecutor(get_config().portal_workers)
+            get_metrics().register_collector(_executor.collect)
+        return _executor
+
+
+def shutdown_executor() -> None:
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown()
+
+
+async def run_portal_task(
+    func: Callable[..., T],
+    *args: Any,
+    priority: Priority = Priority.READ,
+    deadline: Optional[float] = None,
+) -> T:
+    """Run blocking portal work on the executor and await its result.
+
+    Cancelling the awaiting coroutine cancels the task if it has not started.
+    """
+
+    future = get_executor().submit(func, *args, priority=priority, deadline=deadline)
+    return await asyncio.wrap_future(future)
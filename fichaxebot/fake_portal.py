@@ -0,0 +1,448 @@
+"""Local stand-in for the fichaxe portal built from the captured pages.
+
+Run it with ``python -m fichaxebot.fake_portal`` and point ``portal_url`` in
+``config.json`` to it to exercise the backends without touching the real
+portal. Every request can be slowed down and made to fail at random to
+reproduce a struggling portal.
+"""
+
+from __future__ import annotations
+
+import argparse
+import html
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from importlib.resources import files
+from typing import Any, Optional
+from urllib.parse import parse_qs, urlparse
+from uuid import uuid4
+from zoneinfo import ZoneInfo
+
+# Captured portal pages, shipped as package data.
+RESOURCES = files("fichaxebot") / "resources"
+SESSION_COOKIE = "JSESSIONID"
+LOGIN_PATH = "/cas/login"
+MARKS_PATH = "/pas/marcaxesDiarias"
+CALENDAR_PATH = "/pas/calendarioAnual"
+MARK_PATHS = {"/pas/marcaxe/marcaxe", "/pas/marcaxe/marcaxe-recente"}
+
+# States of the last row of the marks table.
+NO_MARKS = "sen_marcaxes"
+ENTRY_OPEN = "entrada_aberta"
+ENTRY_CLOSED = "entrada_pechada"
+
+_TBODY_RE = re.compile(r"<tbody>.*?</tbody>", re.DOTALL)
+_CALENDAR_RE = re.compile(r"var calendario = \[\];")
+
+LOGIN_PAGE = """<!DOCTYPE html>
+<html lang="gl">
+  <body>
+    <form method="post" action="{action}">
+      <input type="hidden" name="execution" value="{execution}" />
+      <input type="text" id="username-input" name="username" />
+      <input type="password" id="password" name="password" />
+      <button type="submit">Acceder</button>
+    </form>
+  </body>
+</html>
+"""
+
+# The captured pages load jQuery from the portal; this covers the part of it
+# they use so that the Selenium backend can click and reload offline. Plugin
+# calls (modal, calendar, typeahead...) are accepted and ignored.
+JQUERY_SHIM = """(function () {
+  function wrap(nodes) {
+    var api = {
+      length: nodes.length,
+      each: function (fn) {
+        nodes.forEach(function (node, index) { fn.call(node, index, node); });
+        return proxy;
+      },
+      on: function (event, fn) {
+        nodes.forEach(function (node) { node.addEventListener(event, fn); });
+        return proxy;
+      },
+      one: function (event, fn) {
+        nodes.forEach(function (node) { node.addEventListener(event, fn, { once: true }); });
+        return proxy;
+      },
+      click: function (fn) {
+        if (fn) return api.on("click", fn);
+        nodes.forEach(function (node) { node.click(); });
+        return proxy;
+      },
+      ready: function (fn) { $(fn); return proxy; },
+      attr: function (name, value) {
+        if (value === undefined) return nodes[0] ? nodes[0].getAttribute(name) : undefined;
+        nodes.forEach(function (node) { node.setAttribute(name, value); });
+        return proxy;
+      },
+      removeAttr: function (name) {
+        nodes.forEach(function (node) { node.removeAttribute(name); });
+        return proxy;
+      },
+      css: function (name, value) {
+        nodes.forEach(function (node) { node.style[name] = value; });
+        return proxy;
+      },
+      show: function () { return api.css("display", "block"); },
+      hide: function () { return api.css("display", "none"); },
+      val: function (value) {
+        if (value === undefined) return nodes[0] ? nodes[0].value : undefined;
+        nodes.forEach(function (node) { node.value = value; });
+        return proxy;
+      },
+      modal: function (action) {
+        if (action === "show") {
+          nodes.forEach(function (node) { node.classList.add("in"); node.style.display = "block"; });
+        }
+        return proxy;
+      }
+    };
+    var proxy = new Proxy(api, {
+      get: function (target, key) {
+        if (key in target) return target[key];
+        if (typeof key === "symbol") return undefined;
+        return function () { return proxy; };
+      }
+    });
+    return proxy;
+  }
+
+  function $(selector) {
+    if (typeof selector === "function") {
+      if (document.readyState === "loading") {
+        document.addEventListener("DOMContentLoaded", selector);
+      } else {
+        selector();
+      }
+      return wrap([]);
+    }
+    if (selector && (selector.nodeType || selector === window)) return wrap([selector]);
+    try {
+      return wrap(Array.from(document.querySelectorAll(selector)));
+    } catch (error) {
+      return wrap([]);
+    }
+  }
+
+  $.ajax = function (settings) {
+    var callbacks = { done: [], fail: [] };
+    var body = new URLSearchParams();
+    Object.keys(settings.data || {}).forEach(function (key) {
+      var value = settings.data[key];
+      body.append(key, value === null || value === undefined ? "" : value);
+    });
+    var method = (settings.type || "GET").toUpperCase();
+    fetch(settings.url, {
+      method: method,
+      body: method === "GET" ? undefined : body,
+      credentials: "same-origin",
+      headers: { "X-Requested-With": "XMLHttpRequest" }
+    }).then(function (response) {
+      return response.text().then(function (text) {
+        if (response.ok) {
+          callbacks.done.forEach(function (fn) { fn(text); });
+        } else {
+          callbacks.fail.forEach(function (fn) { fn(null, "error", response.statusText); });
+        }
+      });
+    }, function (error) {
+      callbacks.fail.forEach(function (fn) { fn(null, "error", String(error)); });
+    });
+    var request = {
+      done: function (fn) { callbacks.done.push(fn); return request; },
+      fail: function (fn) { callbacks.fail.push(fn); return request; }
+    };
+    return request;
+  };
+  $.getJSON = function () {};
+
+  window.jQuery = window.$ = $;
+})();
+"""
+
+
+class FakePortal:
+    """In-memory portal state shared by every request handler."""
+
+    def __init__(
+        self,
+        user: str,
+        password: str,
+        calendario: Optional[list[dict[str, Any]]] = None,
+        recent_window: float = 60.0,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        failure_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.user = user
+        self.password = password
+        self.calendario = calendario or []
+        self.recent_window = recent_window
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.marks: list[list[str]] = []
+        self.sessions: set[str] = set()
+        self.last_mark_at: Optional[datetime] = None
+        self.lock = threading.Lock()
+        self.empty_template = (RESOURCES / "initial.html").read_text(encoding="utf-8")
+        self.marks_template = (RESOURCES / "after_first_opening.html").read_text(
+            encoding="utf-8"
+        )
+        self.calendar_template = (RESOURCES / "calendar.html").read_text(encoding="utf-8")
+
+    @staticmethod
+    def now() -> datetime:
+        return datetime.now(ZoneInfo("Europe/Madrid"))
+
+    def delay(self) -> None:
+        """Sleep for the configured latency plus a random share of the jitter."""
+
+        with self.lock:
+            pause = self.latency + self.random.uniform(0.0, self.jitter)
+        if pause > 0:
+            time.sleep(pause)
+
+    def should_fail(self) -> bool:
+        with self.lock:
+            return self.random.random() < self.failure_rate
+
+    def login(self, user: str, password: str) -> Optional[str]:
+        if user != self.user or password != self.password:
+            return None
+        token = uuid4().hex
+        with self.lock:
+            self.sessions.add(token)
+        return token
+
+    def has_recent_mark(self) -> bool:
+        with self.lock:
+            if self.last_mark_at is None:
+                return False
+            return (self.now() - self.last_mark_at).total_seconds() < self.recent_window
+
+    def _state(self) -> str:
+        if not self.marks:
+            return NO_MARKS
+        return ENTRY_OPEN if self.marks[-1][1] == "-" else ENTRY_CLOSED
+
+    @property
+    def state(self) -> str:
+        with self.lock:
+            return self._state()
+
+    def mark(self) -> str:
+        """Apply a mark to the table and return the resulting state.
+
+        A mark closes the open entry if there is one and opens a new row
+        otherwise, just like the portal does.
+        """
+
+        now = self.now()
+        with self.lock:
+            if self._state() == ENTRY_OPEN:
+                self.marks[-1][1] = now.strftime("%H:%M")
+            else:
+                self.marks.append([now.strftime("%H:%M"), "-"])
+            self.last_mark_at = now
+            return self._state()
+
+    def reset(self) -> None:
+        """Forget every mark, e.g. between benchmark rounds."""
+
+        with self.lock:
+            self.marks.clear()
+            self.last_mark_at = None
+
+    def render_marks(self) -> str:
+        with self.lock:
+            template = self.marks_template if self.marks else self.empty_template
+            rows = "".join(
+                "<tr><td>{}</td><td>{}</td><td>-</td></tr>".format(
+                    html.escape(entry), html.escape(exit_value)
+                )
+                for entry, exit_value in self.marks
+            )
+        return _TBODY_RE.sub(lambda _: f"<tbody>{rows}</tbody>", template, count=1)
+
+    def render_calendar(self) -> str:
+        payload = json.dumps(self.calendario)
+        return _CALENDAR_RE.sub(
+            lambda _: f"var calendario = {payload};", self.calendar_template, count=1
+        )
+
+
+class FakePortalHandler(BaseHTTPRequestHandler):
+    server: "FakePortalServer"
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+        return
+
+    def _session(self) -> Optional[str]:
+        cookie = SimpleCookie(self.headers.get("Cookie", ""))
+        morsel = cookie.get(SESSION_COOKIE)
+        if morsel and morsel.value in self.server.portal.sessions:
+            return morsel.value
+        return None
+
+    def _form(self) -> dict[str, str]:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode("utf-8") if length else ""
+        return {key: values[0] for key, values in parse_qs(body).items()}
+
+    def _send(
+        self,
+        status: int,
+        body: str = "",
+        content_type: str = "text/html; charset=utf-8",
+        headers: Optional[dict[str, str]] = None,
+    ) -> None:
+        payload = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _redirect(self, location: str, headers: Optional[dict[str, str]] = None) -> None:
+        self._send(302, headers={"Location": location, **(headers or {})})
+
+    def _injected_failure(self) -> bool:
+        """Apply the configured latency and report whether to fail the request."""
+
+        portal = self.server.portal
+        portal.delay()
+        if portal.should_fail():
+            self._send(500, "Erro interno", "text/plain")
+            return True
+        return False
+
+    def do_GET(self) -> None:  # noqa: N802
+        path = urlparse(self.path).path
+        portal = self.server.portal
+
+        if path.startswith("/pas/jquery/"):
+            self._send(200, JQUERY_SHIM, "application/javascript")
+        elif path.endswith((".js", ".css")):
+            content_type = "application/javascript" if path.endswith(".js") else "text/css"
+            self._send(200, "", content_type)
+        elif path not in {LOGIN_PATH, MARKS_PATH, CALENDAR_PATH}:
+            self._send(404, "Not found", "text/plain")
+        elif self._injected_failure():
+            return
+        elif path == LOGIN_PATH:
+            self._send(200, LOGIN_PAGE.format(action=LOGIN_PATH, execution=uuid4().hex))
+        elif not self._session():
+            self._redirect(f"{LOGIN_PATH}?service={path}")
+        elif path == MARKS_PATH:
+            self._send(200, portal.render_marks())
+        else:
+            self._send(200, portal.render_calendar())
+
+    def do_POST(self) -> None:  # noqa: N802
+        parsed = urlparse(self.path)
+        portal = self.server.portal
+
+        if parsed.path not in {LOGIN_PATH, *MARK_PATHS}:
+            self._send(404, "Not found", "text/plain")
+            return
+        form = self._form()
+        if self._injected_failure():
+            return
+
+        if parsed.path == LOGIN_PATH:
+            token = portal.login(form.get("username", ""), form.get("password", ""))
+            if token is None:
+                self._send(200, LOGIN_PAGE.format(action=LOGIN_PATH, execution=uuid4().hex))
+                return
+            service = parse_qs(parsed.query).get("service", [MARKS_PATH])[0]
+            self._redirect(
+                service,
+                {"Set-Cookie": f"{SESSION_COOKIE}={token}; Path=/; HttpOnly"},
+            )
+        elif not self._session():
+            self._send(403, "Forbidden", "text/plain")
+        elif parsed.path.endswith("recente"):
+            self._send(200, "success" if portal.has_recent_mark() else "", "text/plain")
+        else:
+            portal.mark()
+            self._send(200, "success", "text/plain")
+
+
+class FakePortalServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], portal: FakePortal) -> None:
+        super().__init__(address, FakePortalHandler)
+        self.portal = portal
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_fake_portal(
+    portal: FakePortal, host: str = "127.0.0.1", port: int = 0
+) -> FakePortalServer:
+    """Serve ``portal`` from a background thread and return the running server."""
+
+    server = FakePortalServer((host, port), portal)
+    threading.Thread(target=server.serve_forever, name="fake-portal", daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--user", default="usuario")
+    parser.add_argument("--password", default="contrasinal")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds added to every request"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.0, help="random extra seconds per request"
+    )
+    parser.add_argument(
+        "--failure-rate", type=float, default=0.0, help="share of requests answered with 500"
+    )
+    parser.add_argument(
+        "--recent-window", type=float, default=60.0, help="seconds a mark counts as recent"
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    portal = FakePortal(
+        args.user,
+        args.password,
+        recent_window=args.recent_window,
+        latency=args.latency,
+        jitter=args.jitter,
+        failure_rate=args.failure_rate,
+        seed=args.seed,
+    )
+    server = FakePortalServer((args.host, args.port), portal)
+    print(f"Fake fichaxe portal listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,32 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
 import time
+from abc import ABC, abstractmethod
 from asyncio import InvalidStateError
+from collections import OrderedDict
+from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import Final
+from datetime import date, datetime, timedelta, timezone
+from html.parser import HTMLParser
+from pathlib import Path
+from typing import Any, Callable, Final, Iterator, NamedTuple, Optional
+from urllib.parse import urljoin, urlparse
 
+import requests
+from requests.adapters import HTTPAdapter
+from requests.cookies import RequestsCookieJar
 from selenium import webdriver
+from selenium.common.exceptions import (
+    JavascriptException,
+    NoSuchElementException,
+    TimeoutException,
+    WebDriverException,
+)
 from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
@@ -11,8 +34,20 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from webdriver_manager.chrome import ChromeDriverManager
 
-from fichaxebot.config import get_config
+from fichaxebot import __version__
+from fichaxebot.config import MADRID_TZ, get_config, scoped_path, write_atomic
+from fichaxebot.coordinator import get_portal_coordinator
+from fichaxebot.latency import get_latency_stats
 from fichaxebot.logging_config import get_logger
+from fichaxebot.metrics import get_metrics
+from fichaxebot.profiling import profiled
+from fichaxebot.retry import (
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryPolicy,
+    get_circuit_breaker,
+    retry_call,
+)
 
 
 @dataclass
@@ -22,188 +57,1653 @@ class CheckInResult:
     success: bool
     action: str
     message: str
+    registered_at: Optional[datetime] = None
+    records: Optional[list[dict[str, str]]] = None
+    retryable: bool = False
+    rejected: bool = False
+    # Whether the mark was sent to the portal: the button clicked or the POST issued.
+    submitted: bool = False
 
 
-LOGIN_URL: Final[str] = "https://fichaxe.usc.gal/pas/marcaxesDiarias"
+class Credentials(NamedTuple):
+    """Portal account of one bot user."""
+
+    user: str
+    password: str
+
+    def __repr__(self) -> str:
+        return f"Credentials(user={self.user!r}, password='***')"
+
+
+class CalendarFetchError(RuntimeError):
+    """Raised when the calendar page cannot be processed."""
+
+
+class PortalLoginError(RuntimeError):
+    """Raised when the portal rejects the configured credentials."""
+
+
+class TransientPortalError(RuntimeError):
+    """Raised when the portal reports a temporary error for an operation.
+
+    ``submitted`` tells whether the mark had already been sent when it failed,
+    in which case it may have been registered.
+    """
+
+    def __init__(self, message: str, submitted: bool = False) -> None:
+        super().__init__(message)
+        self.submitted = submitted
+
+
+class PortalUnavailableError(TransientPortalError):
+    """Raised when the portal host answers with a server error."""
+
+
+PORTAL_DOMAIN: Final[str] = "fichaxe.usc.gal"
+PORTAL_ORIGIN: Final[str] = f"https://{PORTAL_DOMAIN}"
+MARKS_PATH: Final[str] = "/pas/marcaxesDiarias"
+CALENDAR_PATH: Final[str] = "/pas/calendarioAnual"
+MARK_PATH: Final[str] = "/pas/marcaxe/marcaxe"
+RECENT_MARK_PATH: Final[str] = "/pas/marcaxe/marcaxe-recente"
+MARKS_TABLE_ID: Final[str] = "taboaMarcaxesPropios"
+LOGIN_URL: Final[str] = f"{PORTAL_ORIGIN}{MARKS_PATH}"
+CALENDAR_URL: Final[str] = f"{PORTAL_ORIGIN}{CALENDAR_PATH}"
+
+SESSION_FILE = Path(".session.data")
+SESSION_CHECK_INTERVAL: Final[float] = 60.0
+CONFIRMATION_POLL_INTERVAL: Final[float] = 0.2
+DEFAULT_WAIT_TIMEOUT: Final[float] = 20.0
+# HTTP sessions kept open at once; the least recently used one is closed first.
+MAX_HTTP_ACCOUNTS: Final[int] = 32
 
 logger = get_logger(__name__)
 
 
-def _create_driver() -> webdriver.Chrome:
-    options = Options()
-    options.add_argument("--headless")
-    options.add_argument("--no-sandbox")
-    options.add_argument("--disable-dev-shm-usage")
-    return webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+# Launch flags that keep Chrome small: no extensions, GPU or background
+# services, a single renderer process and a capped V8 heap.
+CHROME_ARGUMENTS: Final[tuple[str, ...]] = (
+    "--headless",
+    "--no-sandbox",
+    "--disable-dev-shm-usage",
+    "--disable-gpu",
+    "--disable-extensions",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--disable-background-networking",
+    "--disable-component-update",
+    "--disable-features=Translate,MediaRouter,OptimizationHints",
+    "--no-first-run",
+    "--mute-audio",
+    "--renderer-process-limit=1",
+    "--js-flags=--max-old-space-size=128",
+)
 
+_EXTENSIONS_BY_CATEGORY: Final[dict[str, tuple[str, ...]]] = {
+    "images": ("png", "jpg", "jpeg", "gif", "svg", "ico", "webp"),
+    "fonts": ("woff", "woff2", "ttf", "otf", "eot"),
+    "media": ("mp3", "mp4", "ogg", "wav", "webm"),
+    "stylesheets": ("css",),
+}
 
-def _login(driver: webdriver.Chrome, wait: WebDriverWait, user: str, password: str) -> None:
-    driver.get(LOGIN_URL)
-    logger.info("Login page loaded")
+_ANALYTICS_PATTERNS: Final[tuple[str, ...]] = (
+    "*google-analytics.com*",
+    "*googletagmanager.com*",
+    "*doubleclick.net*",
+    "*hotjar.com*",
+    "*matomo*",
+    "*piwik*",
+)
 
-    user_input = wait.until(EC.presence_of_element_located((By.ID, "username-input")))
-    pass_input = driver.find_element(By.ID, "password")
-    user_input.send_keys(user)
-    pass_input.send_keys(password)
-    driver.find_element(By.CSS_SELECTOR, "button[type='submit']").click()
-    logger.info("Credentials submitted")
 
-    wait.until(EC.presence_of_element_located((By.ID, "novaMarcaxe")))
+def _blocked_url_patterns(categories: list[str]) -> list[str]:
+    """Translate the configured resource categories into CDP URL patterns.
 
+    The portal's own scripts are never blocked: the marking button relies on
+    jQuery and bootstrap, and the calendar page on its inline scripts.
+    """
 
-def perform_check_in(action: str) -> CheckInResult:
-    """Execute the requested check-in action if valid and return the outcome."""
+    patterns: list[str] = []
+    for category in categories:
+        if category == "analytics":
+            patterns.extend(_ANALYTICS_PATTERNS)
+            continue
+        for extension in _EXTENSIONS_BY_CATEGORY.get(category, ()):
+            patterns.extend((f"*.{extension}", f"*.{extension}?*"))
+    return patterns
 
-    action = action.lower().strip()
-    if action not in {"entrada", "salida"}:
-        raise ValueError("La acción de fichaje debe ser 'entrada' o 'salida'.")
 
-    logger.info("Starting check-in process for %s", action)
+CHROME_BINARIES: Final[tuple[str, ...]] = (
+    "google-chrome",
+    "google-chrome-stable",
+    "chromium",
+    "chromium-browser",
+)
 
-    config = get_config()
-    user = config.usc_user
-    password = config.usc_pass
+CHROMEDRIVER_LOCATIONS: Final[tuple[str, ...]] = (
+    "/usr/local/bin/chromedriver",
+    "/usr/local/bin/chromedriver-linux64/chromedriver",
+    "/usr/bin/chromedriver",
+)
 
-    if not user or not password:
-        raise ValueError("Las credenciales de USC no están configuradas correctamente")
+_VERSION_RE = re.compile(r"\b(\d+)(?:\.\d+){2,3}\b")
 
-    driver = _create_driver()
-    wait = WebDriverWait(driver, 20)
+_chromedriver_path: Optional[str] = None
+_chromedriver_lock = threading.Lock()
 
+
+def _binary_version(executable: str) -> Optional[str]:
     try:
-        _login(driver, wait, user, password)
+        completed = subprocess.run(
+            [executable, "--version"], capture_output=True, text=True, timeout=15
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    match = _VERSION_RE.search(completed.stdout)
+    return match.group(0) if match else None
 
-        table = driver.find_element(By.ID, "taboaMarcaxesPropios")
-        rows = table.find_elements(By.TAG_NAME, "tr")
 
-        last_row = rows[-1] if rows else None
-        cells_before = last_row.find_elements(By.TAG_NAME, "td") if last_row else []
-        entry_before = cells_before[0].text.strip() if len(cells_before) > 0 else "-"
-        exit_before = cells_before[1].text.strip() if len(cells_before) > 1 else "-"
+def _installed_chrome_version() -> Optional[str]:
+    for name in CHROME_BINARIES:
+        executable = shutil.which(name)
+        if executable:
+            version = _binary_version(executable)
+            if version:
+                return version
+    return None
 
-        if entry_before == "-":
-            if exit_before == "-":
-                allowed_action = "entrada"
-            else:
-                raise InvalidStateError()
-        else:
-            if exit_before == "-":
-                allowed_action = "salida"
-            else:
-                allowed_action = "entrada"
 
-        logger.info("Allowed action on the website: %s", allowed_action)
+def resolve_chromedriver() -> str:
+    """Return the chromedriver executable to use, resolving it only once.
 
-        if action != allowed_action:
-            if allowed_action == "salida":
-                message = (
-                    "⚠️ Ya existe una entrada pendiente de cerrar. Marca la salida antes de "
-                    "registrar una nueva entrada."
+    A configured or system chromedriver whose major version matches the
+    installed Chrome is preferred, so no network access is needed. The
+    webdriver-manager download is only a fallback.
+    """
+
+    global _chromedriver_path
+    with _chromedriver_lock:
+        if _chromedriver_path is not None:
+            return _chromedriver_path
+
+        chrome_version = _installed_chrome_version()
+        chrome_major = chrome_version.split(".")[0] if chrome_version else None
+
+        candidates = [get_config().chromedriver_path, shutil.which("chromedriver") or ""]
+        candidates.extend(CHROMEDRIVER_LOCATIONS)
+        seen: set[str] = set()
+        for candidate in candidates:
+            if not candidate or candidate in seen:
+                continue
+            seen.add(candidate)
+            if not os.access(candidate, os.X_OK):
+                continue
+            version = _binary_version(candidate)
+            if version is None:
+                continue
+            if chrome_major is not None and version.split(".")[0] != chrome_major:
+                logger.warning(
+                    "Ignoring chromedriver %s at %s: installed Chrome is %s",
+                    version,
+                    candidate,
+                    chrome_version,
                 )
-            else:
-                message = "⚠️ No hay una entrada pendiente para cerrar."
-            logger.warning("Action '%s' not permitted at this time", action)
-            return CheckInResult(False, action, message)
+                continue
+            logger.info("Using chromedriver %s at %s", version, candidate)
+            _chromedriver_path = candidate
+            return candidate
 
-        # --- CLICK EN NOVA MARCAXE ---
-        nova_btn = driver.find_element(By.ID, "novaMarcaxe")
-        driver.execute_script("arguments[0].click();", nova_btn)
-        logger.info("Click on 'novaMarcaxe' executed")
-        time.sleep(5)
-
-        # --- REFRESH AND VERIFY CHANGE ---
-        driver.refresh()
-        wait.until(EC.presence_of_element_located((By.ID, "taboaMarcaxesPropios")))
-        table = driver.find_element(By.ID, "taboaMarcaxesPropios")
-        rows_after = table.find_elements(By.TAG_NAME, "tr")
-        last_row_after = rows_after[-1] if rows_after else None
-        cells_after = (
-            last_row_after.find_elements(By.TAG_NAME, "td") if last_row_after else []
+        logger.warning("No matching local chromedriver found. Falling back to webdriver-manager.")
+        _chromedriver_path = ChromeDriverManager().install()
+        return _chromedriver_path
+
+
+def _create_driver() -> webdriver.Chrome:
+    blocked_resources = get_config().blocked_resources
+
+    options = Options()
+    for argument in CHROME_ARGUMENTS:
+        options.add_argument(argument)
+    if "images" in blocked_resources:
+        options.add_argument("--blink-settings=imagesEnabled=false")
+
+    driver = webdriver.Chrome(service=Service(resolve_chromedriver()), options=options)
+
+    patterns = _blocked_url_patterns(blocked_resources)
+    if patterns:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
+    return driver
+
+
+@dataclass
+class _PooledDriver:
+    driver: webdriver.Chrome
+    uses: int = 0
+    # Portal account whose cookies the browser holds.
+    account: Optional[str] = None
+
+
+class DriverPool:
+    """Bounded pool of long-lived Chrome drivers leased per portal operation.
+
+    Drivers are created lazily, health-checked before every lease and recycled
+    once they reach ``max_uses`` or when an operation fails while holding them.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        max_uses: int,
+        factory: Callable[[], webdriver.Chrome] = _create_driver,
+    ) -> None:
+        self._max_size = max(1, max_size)
+        self._max_uses = max(1, max_uses)
+        self._factory = factory
+        self._idle: list[_PooledDriver] = []
+        self._size = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def lease(self) -> Iterator[webdriver.Chrome]:
+        pooled = self.checkout()
+        healthy = False
+        try:
+            yield pooled.driver
+            healthy = True
+        finally:
+            self.checkin(pooled, healthy)
+
+    def checkout(self) -> _PooledDriver:
+        while True:
+            with self._condition:
+                while not self._closed and not self._idle and self._size >= self._max_size:
+                    self._condition.wait()
+                if self._closed:
+                    raise RuntimeError("El pool de navegadores está cerrado")
+                pooled = self._idle.pop() if self._idle else None
+                if pooled is None:
+                    self._size += 1
+
+            if pooled is None:
+                try:
+                    with get_latency_stats().measure("driver_start"):
+                        driver = self._factory()
+                except Exception:
+                    self._discard_slot()
+                    raise
+                logger.info("Started new pooled Chrome driver")
+                return _PooledDriver(driver)
+
+            if self._is_healthy(pooled.driver):
+                return pooled
+
+            logger.warning("Pooled Chrome driver failed the health check. Recycling it.")
+            self._quit(pooled.driver)
+            self._discard_slot()
+
+    def checkin(self, pooled: _PooledDriver, healthy: bool) -> None:
+        pooled.uses += 1
+        recycle = not healthy or pooled.uses >= self._max_uses
+        with self._condition:
+            if not recycle and not self._closed:
+                self._idle.append(pooled)
+                self._condition.notify()
+                return
+
+        if not healthy:
+            logger.info("Recycling Chrome driver after a failed operation")
+        elif pooled.uses >= self._max_uses:
+            logger.info("Recycling Chrome driver after %s uses", pooled.uses)
+        self._quit(pooled.driver)
+        self._discard_slot()
+
+    def _discard_slot(self) -> None:
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+    @staticmethod
+    def _is_healthy(driver: webdriver.Chrome) -> bool:
+        try:
+            driver.execute_script("return 1;")
+        except Exception:  # noqa: BLE001
+            return False
+        return True
+
+    @staticmethod
+    def _quit(driver: webdriver.Chrome) -> None:
+        try:
+            driver.quit()
+        except Exception:  # noqa: BLE001
+            logger.warning("Error while quitting Chrome driver", exc_info=True)
+
+    def shutdown(self) -> None:
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._condition.notify_all()
+
+        for pooled in idle:
+            self._quit(pooled.driver)
+        if idle:
+            logger.info("Closed %s pooled Chrome drivers", len(idle))
+
+
+_pool: Optional[DriverPool] = None
+_lock = threading.Lock()
+
+
+def get_driver_pool() -> DriverPool:
+    global _pool
+    with _lock:
+        if _pool is None:
+            config = get_config()
+            _pool = DriverPool(config.driver_pool_size, config.driver_max_uses)
+        return _pool
+
+
+def shutdown_driver_pool() -> None:
+    """Quit every idle pooled driver; leased ones are closed when returned."""
+
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
+
+
+class PortalSession:
+    """Authenticated portal cookies persisted on disk between operations.
+
+    Only cookies for the portal host are kept. The file is written with
+    ``0600`` permissions because it grants access to the user's account.
+    """
+
+    def __init__(self, path: Path = SESSION_FILE, base_url: str = PORTAL_ORIGIN) -> None:
+        self._path = path
+        self._base_url = base_url.rstrip("/")
+        self._domain = urlparse(self._base_url).hostname or PORTAL_DOMAIN
+        self._lock = threading.Lock()
+        self._cookies: Optional[list[dict[str, Any]]] = None
+        self._checked_at: Optional[float] = None
+
+    @property
+    def domain(self) -> str:
+        return self._domain
+
+    @property
+    def cookies(self) -> list[dict[str, Any]]:
+        """Return the stored cookies that have not expired yet."""
+
+        with self._lock:
+            if self._cookies is None:
+                self._cookies = self._load()
+            now = time.time()
+            return [
+                cookie
+                for cookie in self._cookies
+                if not cookie.get("expiry") or cookie["expiry"] > now
+            ]
+
+    def _load(self) -> list[dict[str, Any]]:
+        if not self._path.exists():
+            return []
+        try:
+            data = json.loads(self._path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            logger.warning("Invalid format in %s. Stored session will be ignored.", self._path)
+            return []
+        if not isinstance(data, list):
+            return []
+        return [cookie for cookie in data if isinstance(cookie, dict) and "name" in cookie]
+
+    def save(self, cookies: list[dict[str, Any]]) -> None:
+        portal_cookies = [
+            cookie
+            for cookie in cookies
+            if str(cookie.get("domain", "")).lstrip(".").endswith(self._domain)
+        ]
+        write_atomic(self._path, json.dumps(portal_cookies), mode=0o600)
+
+        with self._lock:
+            self._cookies = portal_cookies
+            self._checked_at = time.monotonic()
+        logger.info("Stored %s portal session cookies", len(portal_cookies))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cookies = []
+            self._checked_at = None
+        self._path.unlink(missing_ok=True)
+
+    def mark_valid(self) -> None:
+        with self._lock:
+            self._checked_at = time.monotonic()
+
+    def is_valid(self) -> bool:
+        """Check with a single redirect-less request whether the cookies still work."""
+
+        cookies = self.cookies
+        if not cookies:
+            return False
+
+        with self._lock:
+            checked_at = self._checked_at
+        if checked_at is not None and time.monotonic() - checked_at < SESSION_CHECK_INTERVAL:
+            return True
+
+        try:
+            response = requests.get(
+                f"{self._base_url}{MARKS_PATH}",
+                cookies=_cookie_jar(cookies, self._domain),
+                allow_redirects=False,
+                timeout=10,
+            )
+        except requests.RequestException as exc:
+            logger.warning("Could not validate the stored portal session: %s", exc)
+            return False
+
+        if response.status_code != 200:
+            logger.info("Stored portal session has expired (HTTP %s)", response.status_code)
+            self.clear()
+            return False
+
+        self.mark_valid()
+        return True
+
+    def apply_to(self, driver: webdriver.Chrome) -> None:
+        """Install the stored cookies in a fresh browser without loading a page."""
+
+        for cookie in self.cookies:
+            params: dict[str, Any] = {
+                "name": cookie["name"],
+                "value": cookie.get("value", ""),
+                "domain": cookie.get("domain", self._domain),
+                "path": cookie.get("path", "/"),
+                "secure": bool(cookie.get("secure", False)),
+                "httpOnly": bool(cookie.get("httpOnly", False)),
+            }
+            if cookie.get("expiry"):
+                params["expires"] = cookie["expiry"]
+            driver.execute_cdp_cmd("Network.setCookie", params)
+
+
+def _cookie_jar(cookies: list[dict[str, Any]], domain: str) -> RequestsCookieJar:
+    jar = RequestsCookieJar()
+    for cookie in cookies:
+        jar.set(
+            cookie["name"],
+            cookie.get("value", ""),
+            domain=cookie.get("domain", domain),
+            path=cookie.get("path", "/"),
         )
+    return jar
 
-        if action == "entrada":
-            entry_after = cells_after[0].text.strip() if len(cells_after) > 0 else "-"
-            if entry_after and entry_after != entry_before:
-                logger.info("Entry registered at %s", entry_after)
-                return CheckInResult(
-                    True, action, f"✅ Fichaje de entrada registrado a las {entry_after}"
-                )
 
-            if len(rows_after) > len(rows):
-                logger.info("Entry detected in new row after performing the check-in")
-                return CheckInResult(
-                    True,
-                    action,
-                    f"✅ Fichaje de entrada registrado a las {entry_after or 'hora desconocida'}",
-                )
+def account_key(user: str, password: str) -> str:
+    """Key of the portal state that only ``user`` with this ``password`` may reuse.
+
+    Sessions and browsers are keyed by it rather than by the user name, so
+    that a wrong password never rides on a colleague's open session.
+    """
+
+    return hashlib.sha256(f"{user}\0{password}".encode("utf-8")).hexdigest()
+
+
+_sessions: dict[str, PortalSession] = {}
+
+
+def get_portal_session(user: str, password: str) -> PortalSession:
+    """Return the stored session of the portal account ``user`` logged in with ``password``."""
+
+    key = account_key(user, password)
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            config = get_config()
+            owner = user == config.usc_user and password == config.usc_pass
+            session = _sessions[key] = PortalSession(
+                scoped_path(SESSION_FILE, None if owner else key), base_url=config.portal_url
+            )
+        return session
+
+
+def forget_portal_session(user: str, password: str) -> None:
+    """Drop the in-memory session of an account that is no longer active."""
+
+    with _lock:
+        _sessions.pop(account_key(user, password), None)
 
-            logger.warning("No entry time detected after attempting the check-in.")
+
+MarkRow = tuple[str, str]
+"""Entry and exit times of one row of ``taboaMarcaxesPropios``."""
+
+
+class _MarksTableParser(HTMLParser):
+    """Collect the ``td`` texts of the rows inside ``#taboaMarcaxesPropios``."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.rows: list[list[str]] = []
+        self._table_depth = 0
+        self._in_body = False
+        self._cell: Optional[list[str]] = None
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, Optional[str]]]) -> None:
+        if tag == "table":
+            if self._table_depth or dict(attrs).get("id") == MARKS_TABLE_ID:
+                self._table_depth += 1
+        elif not self._table_depth:
+            return
+        elif tag == "tbody":
+            self._in_body = True
+        elif tag == "tr" and self._in_body:
+            self.rows.append([])
+        elif tag == "td" and self._in_body and self.rows:
+            self._cell = []
+
+    def handle_endtag(self, tag: str) -> None:
+        if not self._table_depth:
+            return
+        if tag == "table":
+            self._table_depth -= 1
+        elif tag == "tbody":
+            self._in_body = False
+        elif tag == "td" and self._cell is not None:
+            self.rows[-1].append(" ".join("".join(self._cell).split()))
+            self._cell = None
+
+    def handle_data(self, data: str) -> None:
+        if self._cell is not None:
+            self._cell.append(data)
+
+
+def _parse_marks_table(html: str) -> list[MarkRow]:
+    parser = _MarksTableParser()
+    with get_latency_stats().measure("table_read"):
+        parser.feed(html)
+    return [(cells[0], cells[1]) for cells in parser.rows if len(cells) >= 2]
+
+
+# Same normalisation as _MarksTableParser so both backends produce equal rows.
+_READ_MARKS_SCRIPT = """
+const table = document.getElementById(arguments[0]);
+if (!table) return null;
+return Array.from(table.querySelectorAll("tbody tr"))
+  .map((row) => Array.from(row.querySelectorAll("td"),
+    (cell) => cell.textContent.replace(/\\s+/g, " ").trim()))
+  .filter((cells) => cells.length >= 2)
+  .map((cells) => [cells[0], cells[1]]);
+"""
+
+
+def _allowed_action(rows: list[MarkRow]) -> str:
+    entry_before, exit_before = rows[-1] if rows else ("-", "-")
+
+    if entry_before == "-":
+        if exit_before == "-":
+            return "entrada"
+        raise InvalidStateError()
+    if exit_before == "-":
+        return "salida"
+    return "entrada"
+
+
+def _rejected_check_in(action: str, allowed_action: str, rows: list[MarkRow]) -> CheckInResult:
+    if allowed_action == "salida":
+        message = (
+            "⚠️ Ya existe una entrada pendiente de cerrar. Marca la salida antes de "
+            "registrar una nueva entrada."
+        )
+    else:
+        message = "⚠️ No hay una entrada pendiente para cerrar."
+    logger.warning("Action '%s' not permitted at this time", action)
+    return CheckInResult(
+        False, action, message, records=_records_from_rows(rows), rejected=True
+    )
+
+
+def _confirm_check_in(
+    action: str,
+    rows_before: list[MarkRow],
+    rows_after: list[MarkRow],
+    registered_at: Optional[datetime] = None,
+) -> CheckInResult:
+    entry_before, exit_before = rows_before[-1] if rows_before else ("-", "-")
+    entry_after, exit_after = rows_after[-1] if rows_after else ("-", "-")
+    records = _records_from_rows(rows_after)
+
+    if action == "entrada":
+        if entry_after and entry_after != entry_before:
+            logger.info("Entry registered at %s", entry_after)
             return CheckInResult(
-                False,
+                True,
                 action,
-                "⚠️ No se confirmó el fichaje de entrada (puede que ya estuviese registrado).",
+                f"✅ Fichaje de entrada registrado a las {entry_after}",
+                registered_at,
+                records,
             )
 
-        exit_after = cells_after[1].text.strip() if len(cells_after) > 1 else "-"
-        if exit_after != "-" and exit_after != exit_before:
-            logger.info("Exit registered at %s", exit_after)
+        if len(rows_after) > len(rows_before):
+            logger.info("Entry detected in new row after performing the check-in")
             return CheckInResult(
-                True, action, f"✅ Fichaje de salida registrado a las {exit_after}"
+                True,
+                action,
+                f"✅ Fichaje de entrada registrado a las {entry_after or 'hora desconocida'}",
+                registered_at,
+                records,
             )
 
-        logger.warning("No exit time detected after attempting the check-in.")
+        logger.warning("No entry time detected after attempting the check-in.")
         return CheckInResult(
             False,
             action,
-            "⚠️ No se confirmó el fichaje de salida (puede que ya estuviese registrado).",
+            "⚠️ No se confirmó el fichaje de entrada (puede que ya estuviese registrado).",
+            records=records,
         )
 
-    except Exception as exc:  # noqa: BLE001
-        logger.exception("Error during the check-in process")
-        return CheckInResult(False, action, f"❌ Error en fichaje: {exc}")
+    if exit_after != "-" and exit_after != exit_before:
+        logger.info("Exit registered at %s", exit_after)
+        return CheckInResult(
+            True,
+            action,
+            f"✅ Fichaje de salida registrado a las {exit_after}",
+            registered_at,
+            records,
+        )
 
-    finally:
-        driver.quit()
+    logger.warning("No exit time detected after attempting the check-in.")
+    return CheckInResult(
+        False,
+        action,
+        "⚠️ No se confirmó el fichaje de salida (puede que ya estuviese registrado).",
+        records=records,
+    )
 
 
-def get_today_records() -> list[dict[str, str]]:
-    """Return the list of check-ins registered today (entry/exit)."""
+def _recent_mark_result(action: str) -> CheckInResult:
+    logger.warning("Portal reports a recent mark; not registering a new one")
+    return CheckInResult(
+        False,
+        action,
+        f"⚠️ El portal indica que ya se realizó un marcaje hace poco. No se registró la {action}.",
+    )
 
-    config = get_config()
-    user = config.usc_user
-    password = config.usc_pass
 
-    if not user or not password:
-        raise ValueError("Las credenciales de USC no están configuradas correctamente")
+# Called with ``true`` right before clicking to remember which banners were
+# already visible; afterwards it reports the first reaction of the page: the
+# reload issued by the AJAX ``done`` callback (the marker disappears), a banner
+# that was not visible before, or the "recent mark" confirmation modal.
+_CONFIRMATION_PROBE = """
+const banners = ["erroInterno", "erroLocalizacionDeshabilitada", "mensaxeWarning"];
+const visible = (el) => !!el && getComputedStyle(el).display !== "none";
+if (arguments[0]) {
+  window.__fichaxeBanners = {};
+  for (const id of banners) {
+    window.__fichaxeBanners[id] = visible(document.getElementById(id));
+  }
+  return "armed";
+}
+if (!window.__fichaxeBanners) {
+  return document.readyState === "complete" ? "reloaded" : null;
+}
+for (const id of banners) {
+  if (visible(document.getElementById(id)) && !window.__fichaxeBanners[id]) {
+    return id;
+  }
+}
+const modal = document.getElementById("modal-confirmar-marcaxe");
+if (modal && (modal.classList.contains("in") || modal.style.display === "block")) {
+  return "modal-confirmar-marcaxe";
+}
+return null;
+"""
+
+
+def _confirmation_outcome(driver: webdriver.Chrome) -> Optional[str]:
+    return driver.execute_script(_CONFIRMATION_PROBE, False)
+
+
+def _wait_for(driver: webdriver.Chrome) -> WebDriverWait:
+    """Return the page wait used for navigation, stretched on a slow portal."""
+
+    return WebDriverWait(driver, get_latency_stats().deadline("login", DEFAULT_WAIT_TIMEOUT))
+
 
-    driver = _create_driver()
-    wait = WebDriverWait(driver, 20)
+_NAVIGATION_STATUS_SCRIPT = """
+const navigation = performance.getEntriesByType("navigation")[0];
+return navigation ? navigation.responseStatus || null : null;
+"""
+
+
+def _wait_for_element(driver: webdriver.Chrome, wait: WebDriverWait, *ids: str) -> None:
+    """Wait until one of the elements ``ids`` is on the page.
+
+    On a timeout, a page answered with a server error is reported as such.
+    """
 
     try:
-        _login(driver, wait, user, password)
-        wait.until(EC.presence_of_element_located((By.ID, "taboaMarcaxesPropios")))
-        table = driver.find_element(By.ID, "taboaMarcaxesPropios")
-        rows = table.find_elements(By.CSS_SELECTOR, "tbody tr")
-
-        records: list[dict[str, str]] = []
-        for row in rows:
-            cells = row.find_elements(By.TAG_NAME, "td")
-            if len(cells) < 2:
+        wait.until(EC.any_of(*(EC.presence_of_element_located((By.ID, id_)) for id_ in ids)))
+    except TimeoutException:
+        try:
+            status = driver.execute_script(_NAVIGATION_STATUS_SCRIPT)
+        except WebDriverException:
+            status = None
+        if isinstance(status, int) and status >= 500:
+            raise PortalUnavailableError(f"El portal respondió con el error {status}")
+        raise
+
+
+@contextmanager
+def _mark_sent(action: str) -> Iterator[None]:
+    """Flag the errors raised once the mark was sent, as it may be registered."""
+
+    try:
+        yield
+    except TransientPortalError as exc:
+        exc.submitted = True
+        raise
+    except Exception as exc:  # noqa: BLE001
+        raise TransientPortalError(
+            f"❌ Error al confirmar la {action}: {exc}", submitted=True
+        ) from exc
+
+
+def _records_from_rows(rows: list[MarkRow]) -> list[dict[str, str]]:
+    return [
+        {"entrada": entry or "-", "salida": exit_value or "-"}
+        for entry, exit_value in rows
+        if entry or exit_value
+    ]
+
+
+class PortalBackend(ABC):
+    """Strategy used to run the portal operations.
+
+    Implementations receive the credentials on every call so that the session
+    handling stays inside the backend.
+    """
+
+    name: str
+
+    def __init__(self, base_url: str = PORTAL_ORIGIN) -> None:
+        self.base_url = base_url.rstrip("/")
+
+    @property
+    def marks_url(self) -> str:
+        return f"{self.base_url}{MARKS_PATH}"
+
+    @property
+    def calendar_url(self) -> str:
+        return f"{self.base_url}{CALENDAR_PATH}"
+
+    @abstractmethod
+    def check_in(self, action: str, user: str, password: str) -> CheckInResult:
+        """Register ``action`` if the portal allows it and report the outcome."""
+
+    @abstractmethod
+    def today_records(self, user: str, password: str) -> list[dict[str, str]]:
+        """Return today's entry/exit pairs."""
+
+    @abstractmethod
+    def calendar_entries(self, user: str, password: str) -> list[dict[str, Any]]:
+        """Return the ``calendario`` array as left by the portal's page script."""
+
+    def prepare(self) -> None:
+        """Do the one-off setup needed before the first operation."""
+
+    def verify_login(self, user: str, password: str) -> None:
+        """Log in from scratch, ignoring any stored session, to check the credentials.
+
+        Raises :class:`PortalLoginError` if the portal rejects them.
+        """
+
+        raise NotImplementedError
+
+    def prewarm(self, user: str, password: str, hold: float) -> None:
+        """Log in and park on the marks page so the next check-in only marks.
+
+        The parked state is dropped if no check-in uses it within ``hold``
+        seconds.
+        """
+
+    def close(self) -> None:
+        """Release the resources held by the backend."""
+
+
+class SeleniumBackend(PortalBackend):
+    """Drive the portal pages with a pooled headless Chrome."""
+
+    name = "selenium"
+
+    def __init__(self, base_url: str = PORTAL_ORIGIN) -> None:
+        super().__init__(base_url)
+        self._parked: dict[str, tuple[_PooledDriver, threading.Timer]] = {}
+        self._parked_lock = threading.Lock()
+
+    def prepare(self) -> None:
+        resolve_chromedriver()
+
+    def prewarm(self, user: str, password: str, hold: float) -> None:
+        account = account_key(user, password)
+        with self._parked_lock:
+            if account in self._parked:
+                return
+
+        pool = get_driver_pool()
+        pooled = self._checkout(account)
+        try:
+            self._login(pooled.driver, _wait_for(pooled.driver), user, password)
+        except Exception:
+            pool.checkin(pooled, False)
+            raise
+
+        timer = threading.Timer(hold, self._release_parked, args=(account,))
+        timer.daemon = True
+        with self._parked_lock:
+            if account in self._parked:
+                pool.checkin(pooled, True)
+                return
+            self._parked[account] = (pooled, timer)
+        timer.start()
+        logger.info("Browser parked on the marks page for %.0f s", hold)
+
+    def _take_parked(self, account: str) -> Optional[_PooledDriver]:
+        with self._parked_lock:
+            parked = self._parked.pop(account, None)
+        if parked is None:
+            return None
+        pooled, timer = parked
+        timer.cancel()
+        return pooled
+
+    def _release_parked(self, account: str) -> None:
+        pooled = self._take_parked(account)
+        if pooled is not None:
+            logger.info("Parked browser was not used. Returning it to the pool.")
+            get_driver_pool().checkin(pooled, True)
+
+    @contextmanager
+    def _logged_in(
+        self, user: str, password: str, use_parked: bool = False
+    ) -> Iterator[tuple[webdriver.Chrome, WebDriverWait]]:
+        """Yield a driver showing the marks page.
+
+        With ``use_parked`` the browser left by :meth:`prewarm` is used as is,
+        skipping the navigation and login.
+        """
+
+        pool = get_driver_pool()
+        account = account_key(user, password)
+        pooled = self._take_parked(account) if use_parked else None
+        if pooled is not None:
+            try:
+                parked = bool(pooled.driver.find_elements(By.ID, "novaMarcaxe"))
+            except WebDriverException:
+                parked = False
+            if not parked:
+                pool.checkin(pooled, False)
+                pooled = None
+        if pooled is None:
+            pooled = self._checkout(account)
+            parked = False
+        else:
+            logger.info("Using browser parked on the marks page")
+
+        healthy = False
+        try:
+            wait = _wait_for(pooled.driver)
+            if not parked:
+                self._login(pooled.driver, wait, user, password)
+            yield pooled.driver, wait
+            healthy = True
+        finally:
+            pool.checkin(pooled, healthy)
+
+    @staticmethod
+    def _checkout(account: Optional[str]) -> _PooledDriver:
+        """Lease a browser, dropping the cookies of any other account it served.
+
+        Without an ``account`` the browser always starts without cookies.
+        """
+
+        pool = get_driver_pool()
+        pooled = pool.checkout()
+        if account is None or pooled.account not in (None, account):
+            try:
+                pooled.driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+                pooled.driver.get("about:blank")
+            except WebDriverException:
+                pool.checkin(pooled, False)
+                raise
+        pooled.account = account
+        return pooled
+
+    def _login(
+        self, driver: webdriver.Chrome, wait: WebDriverWait, user: str, password: str
+    ) -> None:
+        with get_latency_stats().measure("login"):
+            self._open_marks_page(driver, wait, user, password)
+
+    def verify_login(self, user: str, password: str) -> None:
+        pool = get_driver_pool()
+        pooled = self._checkout(None)
+        healthy = False
+        try:
+            self._open_marks_page(
+                pooled.driver, _wait_for(pooled.driver), user, password, restore=False
+            )
+            pooled.account = account_key(user, password)
+            healthy = True
+        except PortalLoginError:
+            healthy = True
+            raise
+        finally:
+            pool.checkin(pooled, healthy)
+
+    def _open_marks_page(
+        self,
+        driver: webdriver.Chrome,
+        wait: WebDriverWait,
+        user: str,
+        password: str,
+        restore: bool = True,
+    ) -> None:
+        session = get_portal_session(user, password)
+        if (
+            restore
+            and not driver.current_url.startswith(self.base_url)
+            and session.is_valid()
+        ):
+            session.apply_to(driver)
+            logger.info("Restored stored portal session in a fresh browser")
+
+        driver.get(self.marks_url)
+        logger.info("Login page loaded")
+
+        _wait_for_element(driver, wait, "novaMarcaxe", "username-input")
+        if driver.find_elements(By.ID, "novaMarcaxe"):
+            logger.info("Portal session still active; skipping login form")
+            session.mark_valid()
+            return
+
+        user_input = wait.until(EC.presence_of_element_located((By.ID, "username-input")))
+        pass_input = driver.find_element(By.ID, "password")
+        user_input.send_keys(user)
+        pass_input.send_keys(password)
+        submit = driver.find_element(By.CSS_SELECTOR, "button[type='submit']")
+        submit.click()
+        logger.info("Credentials submitted")
+
+        # The portal answers wrong credentials with the login form again.
+        wait.until(EC.staleness_of(submit))
+        _wait_for_element(driver, wait, "novaMarcaxe", "username-input")
+        if not driver.find_elements(By.ID, "novaMarcaxe"):
+            raise PortalLoginError("No se pudo iniciar sesión en el portal de fichaje")
+        session.save(driver.get_cookies())
+
+    @staticmethod
+    def _read_rows(driver: webdriver.Chrome) -> list[MarkRow]:
+        """Read the whole marks table with a single WebDriver round trip."""
+
+        with get_latency_stats().measure("table_read"):
+            rows = driver.execute_script(_READ_MARKS_SCRIPT, MARKS_TABLE_ID)
+        if rows is None:
+            raise NoSuchElementException(f"No se encontró la tabla '{MARKS_TABLE_ID}'")
+        return [(entry, exit_value) for entry, exit_value in rows]
+
+    def check_in(self, action: str, user: str, password: str) -> CheckInResult:
+        with self._logged_in(user, password, use_parked=True) as (driver, wait):
+            rows = self._read_rows(driver)
+            allowed_action = _allowed_action(rows)
+            logger.info("Allowed action on the website: %s", allowed_action)
+
+            if action != allowed_action:
+                return _rejected_check_in(action, allowed_action, rows)
+
+            driver.execute_script(_CONFIRMATION_PROBE, True)
+            with _mark_sent(action):
+                result = self._click_and_confirm(driver, wait, action, rows)
+            result.submitted = True
+            return result
+
+    def _click_and_confirm(
+        self, driver: webdriver.Chrome, wait: WebDriverWait, action: str, rows: list[MarkRow]
+    ) -> CheckInResult:
+        stats = get_latency_stats()
+        timeout = stats.deadline("mark", get_config().mark_confirmation_timeout.total_seconds())
+        started = time.perf_counter()
+
+        # --- CLICK EN NOVA MARCAXE ---
+        nova_btn = driver.find_element(By.ID, "novaMarcaxe")
+        driver.execute_script("arguments[0].click();", nova_btn)
+        logger.info("Click on 'novaMarcaxe' executed")
+
+        try:
+            outcome = WebDriverWait(
+                driver,
+                timeout,
+                poll_frequency=CONFIRMATION_POLL_INTERVAL,
+                ignored_exceptions=(JavascriptException,),
+            ).until(_confirmation_outcome)
+        except TimeoutException:
+            logger.warning(
+                "No reaction from the portal after %.0f s. Reloading the marks page.",
+                timeout,
+            )
+            driver.refresh()
+            outcome = "reloaded"
+
+        registered_at = datetime.now(timezone.utc)
+        elapsed = time.perf_counter() - started
+        stats.record("mark", elapsed)
+        get_metrics().observe("mark", elapsed)
+        logger.info("Portal reaction to the mark: %s", outcome)
+        if outcome == "modal-confirmar-marcaxe":
+            return _recent_mark_result(action)
+        if outcome == "mensaxeWarning":
+            warning = driver.find_element(By.ID, "mensaxeWarning").text.strip()
+            return CheckInResult(False, action, f"⚠️ Aviso del portal: {warning}")
+        if outcome == "erroInterno":
+            raise PortalUnavailableError(
+                f"❌ El portal devolvió un error al registrar la {action}."
+            )
+        if outcome != "reloaded":
+            return CheckInResult(
+                False, action, f"❌ El portal devolvió un error al registrar la {action}."
+            )
+
+        with stats.measure("confirmation"):
+            wait.until(EC.presence_of_element_located((By.ID, MARKS_TABLE_ID)))
+            rows_after = self._read_rows(driver)
+        return _confirm_check_in(action, rows, rows_after, registered_at)
+
+    def today_records(self, user: str, password: str) -> list[dict[str, str]]:
+        with self._logged_in(user, password) as (driver, wait):
+            wait.until(EC.presence_of_element_located((By.ID, MARKS_TABLE_ID)))
+            return _records_from_rows(self._read_rows(driver))
+
+    def calendar_entries(self, user: str, password: str) -> list[dict[str, Any]]:
+        with self._logged_in(user, password) as (driver, wait):
+            with get_metrics().span("calendar_wait"):
+                driver.get(self.calendar_url)
+                try:
+                    wait.until(
+                        lambda d: d.execute_script(
+                            "return Array.isArray(window.calendario)"
+                            " && window.calendario.length >= 0;"
+                        )
+                    )
+                except TimeoutException as exc:  # pragma: no cover - depends on remote load
+                    raise CalendarFetchError(
+                        "No se pudo cargar el calendario en la página"
+                    ) from exc
+
+                try:
+                    data_json = driver.execute_script(
+                        "return JSON.stringify(window.calendario || []);"
+                    )
+                except JavascriptException as exc:  # pragma: no cover - depends on remote content
+                    raise CalendarFetchError(
+                        "No se pudo acceder al calendario en la página"
+                    ) from exc
+
+        return _decode_calendar_json(data_json)
+
+
+class _LoginFormParser(HTMLParser):
+    """Locate the SSO form that contains a password field."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.forms: list[dict[str, Any]] = []
+        self._current: Optional[dict[str, Any]] = None
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, Optional[str]]]) -> None:
+        attributes = {key: value or "" for key, value in attrs}
+        if tag == "form":
+            self._current = {
+                "action": attributes.get("action", ""),
+                "method": attributes.get("method", "get").lower(),
+                "inputs": [],
+            }
+            self.forms.append(self._current)
+        elif tag == "input" and self._current is not None:
+            self._current["inputs"].append(attributes)
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == "form":
+            self._current = None
+
+    def login_form(self) -> Optional[dict[str, Any]]:
+        for form in self.forms:
+            if any(field.get("type") == "password" for field in form["inputs"]):
+                return form
+        return None
+
+
+class _HttpAccount:
+    """Connection, cookies and parked page of one portal account."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.restored = False
+        self.parked: Optional[tuple[str, float]] = None
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4)
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+        self.http.headers["User-Agent"] = "fichaxebot/" + __version__
+
+
+class HttpBackend(PortalBackend):
+    """Talk to the portal with plain HTTP requests instead of a browser.
+
+    It replays what the page scripts do: the SSO form login, the POST to
+    ``marcaxe-recente`` followed by the POST to ``marcaxe`` and the reload of
+    the marks page.
+    """
+
+    name = "http"
+
+    def __init__(
+        self, base_url: str = PORTAL_ORIGIN, timeout: float = DEFAULT_WAIT_TIMEOUT
+    ) -> None:
+        super().__init__(base_url)
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._accounts: OrderedDict[str, _HttpAccount] = OrderedDict()
+
+    def _account(self, user: str, password: str) -> _HttpAccount:
+        key = account_key(user, password)
+        with self._lock:
+            account = self._accounts.get(key)
+            if account is None:
+                account = self._accounts[key] = _HttpAccount()
+            self._accounts.move_to_end(key)
+            stale = []
+            while len(self._accounts) > MAX_HTTP_ACCOUNTS:
+                stale.append(self._accounts.popitem(last=False)[1])
+        # The cookies stay on disk, so a closed account only pays a reload.
+        for item in stale:
+            item.http.close()
+        return account
+
+    def _store_session(self, user: str, password: str, account: _HttpAccount) -> None:
+        cookies = [
+            {
+                "name": cookie.name,
+                "value": cookie.value or "",
+                "domain": cookie.domain,
+                "path": cookie.path,
+                "secure": cookie.secure,
+                "httpOnly": cookie.has_nonstandard_attr("HttpOnly"),
+                **({"expiry": cookie.expires} if cookie.expires else {}),
+            }
+            for cookie in account.http.cookies
+        ]
+        get_portal_session(user, password).save(cookies)
+
+    def _submit_login(
+        self, account: _HttpAccount, response: requests.Response, user: str, password: str
+    ) -> str:
+        parser = _LoginFormParser()
+        parser.feed(response.text)
+        form = parser.login_form()
+        if form is None:
+            raise PortalLoginError("No se encontró el formulario de acceso del portal")
+
+        data: dict[str, str] = {}
+        for field in form["inputs"]:
+            name = field.get("name")
+            if not name:
                 continue
-            entry_value = cells[0].text.strip()
-            exit_value = cells[1].text.strip()
-            if not entry_value and not exit_value:
+            field_type = field.get("type", "text").lower()
+            if field_type == "password":
+                data[name] = password
+            elif field.get("id") == "username-input" or field_type in {"text", "email"}:
+                data[name] = user
+            elif field_type not in {"submit", "button", "checkbox", "radio"}:
+                data[name] = field.get("value", "")
+
+        target = urljoin(response.url, form["action"] or response.url)
+        logger.info("Submitting portal login form")
+        if form["method"] == "post":
+            result = account.http.post(target, data=data, timeout=self._request_timeout)
+        else:
+            result = account.http.get(target, params=data, timeout=self._request_timeout)
+        result.raise_for_status()
+
+        if 'id="novaMarcaxe"' not in result.text:
+            raise PortalLoginError("No se pudo iniciar sesión en el portal de fichaje")
+        self._store_session(user, password, account)
+        return result.text
+
+    @property
+    def _request_timeout(self) -> float:
+        return get_latency_stats().deadline("login", self._timeout)
+
+    def _open_marks_page(self, user: str, password: str) -> str:
+        account = self._account(user, password)
+        with get_latency_stats().measure("login"), account.lock:
+            session = get_portal_session(user, password)
+            if not account.restored:
+                account.http.cookies.update(_cookie_jar(session.cookies, session.domain))
+                account.restored = True
+
+            response = account.http.get(self.marks_url, timeout=self._request_timeout)
+            response.raise_for_status()
+            if 'id="novaMarcaxe"' in response.text:
+                session.mark_valid()
+                return response.text
+            return self._submit_login(account, response, user, password)
+
+    def verify_login(self, user: str, password: str) -> None:
+        account = _HttpAccount()
+        try:
+            with get_latency_stats().measure("login"):
+                response = account.http.get(self.marks_url, timeout=self._request_timeout)
+                response.raise_for_status()
+                self._submit_login(account, response, user, password)
+        finally:
+            account.http.close()
+
+    def _post(
+        self, user: str, password: str, path: str, data: Optional[dict[str, str]] = None
+    ) -> str:
+        response = self._account(user, password).http.post(
+            f"{self.base_url}{path}",
+            data=data,
+            headers={"X-Requested-With": "XMLHttpRequest"},
+            timeout=self._request_timeout,
+        )
+        response.raise_for_status()
+        return response.text
+
+    def prewarm(self, user: str, password: str, hold: float) -> None:
+        html = self._open_marks_page(user, password)
+        account = self._account(user, password)
+        with account.lock:
+            account.parked = (html, time.monotonic() + hold)
+        logger.info("HTTP session warmed up on the marks page for %.0f s", hold)
+
+    def _take_parked(self, user: str, password: str) -> Optional[str]:
+        account = self._account(user, password)
+        with account.lock:
+            parked, account.parked = account.parked, None
+        if parked is None or parked[1] < time.monotonic():
+            return None
+        return parked[0]
+
+    def check_in(self, action: str, user: str, password: str) -> CheckInResult:
+        html = self._take_parked(user, password) or self._open_marks_page(user, password)
+        rows = _parse_marks_table(html)
+        allowed_action = _allowed_action(rows)
+        logger.info("Allowed action on the website: %s", allowed_action)
+
+        if action != allowed_action:
+            return _rejected_check_in(action, allowed_action, rows)
+
+        stats = get_latency_stats()
+        with stats.measure("mark"):
+            if self._post(user, password, RECENT_MARK_PATH).strip() == "success":
+                return _recent_mark_result(action)
+
+            with _mark_sent(action):
+                self._post(user, password, MARK_PATH, {"coordenadas": ""})
+        registered_at = datetime.now(timezone.utc)
+        logger.info("Mark request accepted by the portal")
+
+        with stats.measure("confirmation"), _mark_sent(action):
+            rows_after = _parse_marks_table(self._open_marks_page(user, password))
+        result = _confirm_check_in(action, rows, rows_after, registered_at)
+        result.submitted = True
+        return result
+
+    def today_records(self, user: str, password: str) -> list[dict[str, str]]:
+        return _records_from_rows(_parse_marks_table(self._open_marks_page(user, password)))
+
+    def calendar_entries(self, user: str, password: str) -> list[dict[str, Any]]:
+        self._open_marks_page(user, password)
+        with get_metrics().span("calendar_wait"):
+            response = self._account(user, password).http.get(
+                self.calendar_url, timeout=self._request_timeout
+            )
+            response.raise_for_status()
+
+        match = _CALENDAR_RE.search(response.text)
+        if not match:
+            raise CalendarFetchError("No se pudo acceder al calendario en la página")
+
+        entries = _decode_calendar_json(match.group(1))
+        # The page script moves every startDate one day back before rendering;
+        # mimic it so both backends return the same data.
+        for entry in entries:
+            try:
+                start = date.fromisoformat(str(entry.get("startDate", ""))[:10])
+            except ValueError:
                 continue
-            records.append(
-                {
-                    "entrada": entry_value or "-",
-                    "salida": exit_value or "-",
-                }
+            entry["startDate"] = (start - timedelta(days=1)).isoformat()
+        return entries
+
+    def close(self) -> None:
+        with self._lock:
+            accounts = list(self._accounts.values())
+            self._accounts.clear()
+        for account in accounts:
+            account.http.close()
+
+
+_CALENDAR_RE = re.compile(r"var\s+calendario\s*=\s*(\[.*?\])\s*;", re.DOTALL)
+
+
+def _decode_calendar_json(data_json: Optional[str]) -> list[dict[str, Any]]:
+    if not data_json:
+        return []
+
+    try:
+        data = json.loads(data_json)
+    except json.JSONDecodeError as exc:  # pragma: no cover - depends on remote format
+        raise CalendarFetchError("El calendario recibido tiene un formato desconocido") from exc
+    return [entry for entry in data if isinstance(entry, dict)]
+
+
+BACKENDS: Final[dict[str, type[PortalBackend]]] = {
+    SeleniumBackend.name: SeleniumBackend,
+    HttpBackend.name: HttpBackend,
+}
+
+_backend: Optional[PortalBackend] = None
+
+
+def get_backend() -> PortalBackend:
+    global _backend
+    with _lock:
+        if _backend is None:
+            config = get_config()
+            _backend = BACKENDS[config.portal_backend](config.portal_url)
+            logger.info("Using '%s' portal backend", _backend.name)
+        return _backend
+
+
+def shutdown_backend() -> None:
+    """Close the active backend and every pooled browser."""
+
+    global _backend
+    with _lock:
+        backend, _backend = _backend, None
+    if backend is not None:
+        backend.close()
+    shutdown_driver_pool()
+
+
+@dataclass(frozen=True)
+class RecordsSnapshot:
+    """Today's marks as read from the portal at ``fetched_at``."""
+
+    records: list[dict[str, str]]
+    fetched_at: datetime
+
+
+class _RecordsCache:
+    """Short-lived copy of today's marks, keyed per user and per day."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._entries: dict[tuple[str, date], tuple[RecordsSnapshot, float]] = {}
+
+    def get(self, user: str, ttl: float) -> Optional[RecordsSnapshot]:
+        key = (user, datetime.now(MADRID_TZ).date())
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[1] >= ttl:
+                return None
+            return entry[0]
+
+    def put(self, user: str, records: list[dict[str, str]]) -> RecordsSnapshot:
+        now = datetime.now(MADRID_TZ)
+        snapshot = RecordsSnapshot(records, now)
+        with self._lock:
+            # Entries from previous days are never read again.
+            self._entries = {
+                key: value for key, value in self._entries.items() if key[1] == now.date()
+            }
+            self._entries[(user, now.date())] = (snapshot, time.monotonic())
+        return snapshot
+
+    def invalidate(self, user: str) -> None:
+        with self._lock:
+            self._entries = {key: value for key, value in self._entries.items() if key[0] != user}
+
+
+_records_cache = _RecordsCache()
+
+MARK_RETRY_POLICY: Final[RetryPolicy] = RetryPolicy(max_attempts=3, base_delay=2.0, max_delay=30.0)
+READ_RETRY_POLICY: Final[RetryPolicy] = RetryPolicy(max_attempts=2, base_delay=1.0, max_delay=5.0)
+
+
+def _is_transient(exc: BaseException) -> bool:
+    """Whether retrying the portal operation that raised ``exc`` may help."""
+
+    return not isinstance(
+        exc, (InvalidStateError, PortalLoginError, ValueError, CircuitOpenError)
+    )
+
+
+def _is_portal_outage(exc: BaseException) -> bool:
+    """Whether ``exc`` shows the portal host down rather than a failed operation.
+
+    Only these count against the circuit breaker, so that the errors of one
+    account, such as a login that times out, do not stop every other one.
+    """
+
+    if isinstance(exc, TransientPortalError) and exc.__cause__ is not None:
+        exc = exc.__cause__
+    if isinstance(exc, (PortalUnavailableError, requests.ConnectionError)):
+        return True
+    if isinstance(exc, requests.HTTPError):
+        return exc.response is not None and exc.response.status_code >= 500
+    # Chrome reports unreachable hosts as net::ERR_CONNECTION_REFUSED and the like.
+    return isinstance(exc, WebDriverException) and "net::ERR_" in str(exc.msg)
+
+
+def _portal_breaker() -> CircuitBreaker:
+    return get_circuit_breaker(urlparse(get_config().portal_url).netloc)
+
+
+def _last_row_matches(action: str, records: list[dict[str, str]]) -> bool:
+    """Whether the last row of ``records`` ends with a mark of ``action``."""
+
+    last = records[-1]
+    if action == "entrada":
+        return last["entrada"] != "-" and last["salida"] == "-"
+    return last["salida"] != "-"
+
+
+def resolve_credentials(credentials: Optional[Credentials] = None) -> Credentials:
+    """Return ``credentials`` or, without them, the account of the configuration."""
+
+    if credentials is None:
+        config = get_config()
+        credentials = Credentials(config.usc_user, config.usc_pass)
+
+    if not credentials.user or not credentials.password:
+        raise ValueError("Las credenciales de USC no están configuradas correctamente")
+    return credentials
+
+
+@profiled
+def perform_check_in(
+    action: str,
+    budget: Optional[float] = None,
+    credentials: Optional[Credentials] = None,
+    submitted: bool = False,
+) -> CheckInResult:
+    """Execute the requested check-in action if valid and return the outcome.
+
+    Transient portal errors are retried with backoff for at most ``budget``
+    seconds; a failed result reports in ``retryable`` whether trying again
+    later may still work and in ``submitted`` whether the mark was sent.
+    ``submitted`` tells that an earlier run may already have sent this mark.
+    """
+
+    action = action.lower().strip()
+    if action not in {"entrada", "salida"}:
+        raise ValueError("La acción de fichaje debe ser 'entrada' o 'salida'.")
+
+    logger.info("Starting check-in process for %s", action)
+
+    user, password = resolve_credentials(credentials)
+
+    def attempt() -> CheckInResult:
+        nonlocal submitted
+        try:
+            outcome = get_backend().check_in(action, user, password)
+        except TransientPortalError as exc:
+            submitted = submitted or exc.submitted
+            raise
+        if outcome.retryable:
+            submitted = submitted or outcome.submitted
+            raise TransientPortalError(outcome.message, outcome.submitted)
+        return outcome
+
+    with get_portal_coordinator().exclusive(user), get_metrics().span("check_in"):
+        try:
+            result = retry_call(
+                attempt,
+                policy=MARK_RETRY_POLICY,
+                is_retryable=_is_transient,
+                breaker=_portal_breaker(),
+                is_outage=_is_portal_outage,
+                budget=budget,
+            )
+        except Exception as exc:  # noqa: BLE001
+            logger.exception("Error during the check-in process")
+            if isinstance(exc, TransientPortalError):
+                message = str(exc)
+            else:
+                message = f"❌ Error en fichaje: {exc}"
+            # An open circuit is not worth retrying now, but it is later.
+            retryable = _is_transient(exc) or isinstance(exc, CircuitOpenError)
+            result = CheckInResult(
+                False, action, message, retryable=retryable, submitted=submitted
+            )
+
+        records = result.records
+        if result.rejected and submitted and records and _last_row_matches(action, records):
+            # An earlier attempt or run sent the mark before failing and the
+            # table now ends with it, so that attempt registered it.
+            hour = records[-1][action]
+            logger.info("Mark %s found registered at %s after a retry", action, hour)
+            result = CheckInResult(
+                True,
+                action,
+                f"✅ Fichaje de {action} registrado a las {hour} (confirmado tras un reintento).",
+                records=records,
+                submitted=True,
             )
 
-        return records
+        if result.records is not None:
+            _records_cache.put(user, result.records)
+        else:
+            _records_cache.invalidate(user)
+    get_metrics().increment(
+        "checkins", action=action, outcome="success" if result.success else "failure"
+    )
+    return result
+
+
+def prewarm_session(hold: float, credentials: Optional[Credentials] = None) -> None:
+    """Log in ahead of a scheduled mark so that it only has to click."""
+
+    user, password = resolve_credentials(credentials)
+    try:
+        get_portal_coordinator().read(
+            user, "prewarm", lambda: get_backend().prewarm(user, password, hold)
+        )
+    except Exception:  # noqa: BLE001
+        logger.exception("Could not pre-warm the portal session")
+
+
+@profiled
+def get_today_snapshot(
+    force_refresh: bool = False, credentials: Optional[Credentials] = None
+) -> RecordsSnapshot:
+    """Return today's check-ins, reusing a recent read unless ``force_refresh``."""
+
+    user, password = resolve_credentials(credentials)
+    ttl = get_config().records_cache_ttl.total_seconds()
+
+    if not force_refresh:
+        cached = _records_cache.get(user, ttl)
+        if cached is not None:
+            logger.info("Serving today's check-ins read at %s", cached.fetched_at.isoformat())
+            return cached
+
+    def read() -> RecordsSnapshot:
+        with get_metrics().span("records_read"):
+            records = retry_call(
+                lambda: get_backend().today_records(user, password),
+                policy=READ_RETRY_POLICY,
+                is_retryable=_is_transient,
+                breaker=_portal_breaker(),
+                is_outage=_is_portal_outage,
+            )
+        return _records_cache.put(user, records)
+
+    try:
+        return get_portal_coordinator().read(user, "records", read)
     except Exception:  # noqa: BLE001
         logger.exception("Error while retrieving today's check-ins")
         raise
-    finally:
-        driver.quit()
+
+
+@profiled
+def get_today_records(
+    force_refresh: bool = False, credentials: Optional[Credentials] = None
+) -> list[dict[str, str]]:
+    """Return the list of check-ins registered today (entry/exit)."""
+
+    return get_today_snapshot(force_refresh, credentials).records
+
+
+def verify_credentials(credentials: Credentials) -> None:
+    """Log in afresh with ``credentials``; raise :class:`PortalLoginError` if rejected.
+
+    No stored session or open browser takes part, so only the password
+    itself can get past the login form.
+    """
+
+    user, password = resolve_credentials(credentials)
+    with get_metrics().span("verify_login"):
+        retry_call(
+            lambda: get_backend().verify_login(user, password),
+            policy=READ_RETRY_POLICY,
+            is_retryable=_is_transient,
+            breaker=_portal_breaker(),
+            is_outage=_is_portal_outage,
+        )
+
+
+def fetch_calendar_entries(credentials: Optional[Credentials] = None) -> list[dict[str, Any]]:
+    """Return the raw ``calendario`` array of the annual calendar page."""
+
+    try:
+        user, password = resolve_credentials(credentials)
+    except ValueError as exc:
+        raise CalendarFetchError(
+            "Las credenciales de USC no están configuradas; no se puede obtener el calendario.",
+        ) from exc
+    return get_portal_coordinator().read(
+        user,
+        "calendar",
+        lambda: retry_call(
+            lambda: get_backend().calendar_entries(user, password),
+            policy=READ_RETRY_POLICY,
+            is_retryable=_is_transient,
+            breaker=_portal_breaker(),
+            is_outage=_is_portal_outage,
+        ),
+    )
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import json
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Deque, Dict, Final, Iterable, Iterator, Optional
+
+from fichaxebot.config import write_atomic
+from fichaxebot.logging_config import get_logger
+from fichaxebot.metrics import get_metrics
+
+logger = get_logger(__name__)
+
+LATENCY_FILE = Path(".latency.data")
+
+PHASES: Final[tuple[str, ...]] = (
+    "driver_start",
+    "login",
+    "table_read",
+    "mark",
+    "confirmation",
+)
+
+WINDOW_SIZE: Final[int] = 200
+SAVE_INTERVAL: Final[float] = 30.0
+MAX_DEADLINE: Final[float] = 120.0
+
+
+class LatencyStats:
+    """Rolling window of the latest durations of every portal phase.
+
+    The samples are persisted to ``path`` so that the percentiles survive a
+    restart of the bot.
+    """
+
+    def __init__(self, path: Path = LATENCY_FILE, window: int = WINDOW_SIZE) -> None:
+        self._path = path
+        self._window = window
+        self._lock = threading.Lock()
+        self._samples: Dict[str, Deque[float]] = {}
+        self._saved_at = time.monotonic()
+        self._dirty = False
+        self._load()
+
+    def _load(self) -> None:
+        if not self._path.exists():
+            return
+        try:
+            data = json.loads(self._path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            logger.warning("Invalid format in %s. Latency history will be ignored.", self._path)
+            return
+        if not isinstance(data, dict):
+            return
+        for phase, values in data.items():
+            if isinstance(values, list):
+                self._samples[phase] = deque(
+                    (float(value) for value in values if isinstance(value, (int, float))),
+                    maxlen=self._window,
+                )
+
+    def record(self, phase: str, seconds: float) -> None:
+        with self._lock:
+            samples = self._samples.setdefault(phase, deque(maxlen=self._window))
+            samples.append(round(seconds, 3))
+            self._dirty = True
+            due = time.monotonic() - self._saved_at >= SAVE_INTERVAL
+        if due:
+            self.save()
+
+    @contextmanager
+    def measure(self, phase: str) -> Iterator[None]:
+        """Record the duration of the block if it completes without errors.
+
+        Every run, failed or not, is also reported as a metrics span.
+        """
+
+        started = time.perf_counter()
+        with get_metrics().span(phase):
+            yield
+        self.record(phase, time.perf_counter() - started)
+
+    def percentile(self, phase: str, quantile: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get(phase, ()))
+        if not samples:
+            return None
+        rank = max(1, math.ceil(quantile * len(samples)))
+        return samples[rank - 1]
+
+    def estimate(self, phases: Iterable[str], quantile: float) -> float:
+        """Sum the given percentile of several phases; unknown phases count as 0."""
+
+        return sum(self.percentile(phase, quantile) or 0.0 for phase in phases)
+
+    def deadline(self, phase: str, default: float, factor: float = 2.0) -> float:
+        """Return a wait deadline for ``phase`` that grows on a slow portal."""
+
+        p99 = self.percentile(phase, 0.99)
+        if p99 is None:
+            return default
+        return min(max(default, p99 * factor), max(default, MAX_DEADLINE))
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {phase: list(samples) for phase, samples in self._samples.items()}
+            self._dirty = False
+            self._saved_at = time.monotonic()
+
+        try:
+            write_atomic(self._path, json.dumps(data))
+        except OSError:
+            logger.warning("Could not persist latency history to %s", self._path, exc_info=True)
+
+
+_stats: Optional[LatencyStats] = None
+_stats_lock = threading.Lock()
+
+
+def get_latency_stats() -> LatencyStats:
+    global _stats
+    with _stats_lock:
+        if _stats is None:
+            _stats = LatencyStats()
+        return _stats
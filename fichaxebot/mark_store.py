@@ -0,0 +1,344 @@
+"""Shared SQLite queue of scheduled marks for ``python -m fichaxebot.worker``.
+
+The bot submits every scheduled mark to the store. Worker processes claim the
+due ones under a time-limited lease, renew it while they run the mark, and
+write the outcome as an event that the bot relays to the chat. A lease that
+is not renewed, because its worker died, expires and the mark is claimed
+again by another worker. A mark flagged as already sent to the portal counts
+as registered when that worker finds it at the end of the marks table.
+
+The database uses SQLite's default rollback journal, so the file can live on
+a filesystem shared by workers on several hosts as long as that filesystem
+implements POSIX locks correctly.
+"""
+
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from fichaxebot.config import get_config
+from fichaxebot.fichador import CheckInResult
+from fichaxebot.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+BUSY_TIMEOUT_MS = 10_000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS marks (
+    id TEXT PRIMARY KEY,
+    chat_id TEXT NOT NULL,
+    action TEXT NOT NULL,
+    due REAL NOT NULL,
+    deadline REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_until REAL,
+    done INTEGER NOT NULL DEFAULT 0,
+    submitted INTEGER NOT NULL DEFAULT 0,
+    rule TEXT
+);
+CREATE INDEX IF NOT EXISTS marks_due ON marks (due);
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    mark_id TEXT NOT NULL,
+    chat_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL
+);
+"""
+
+
+@dataclass(frozen=True)
+class LeasedMark:
+    """A mark claimed by a worker until ``lease_until`` (epoch seconds)."""
+
+    identifier: str
+    chat_id: str
+    action: str
+    due: float
+    deadline: float
+    attempts: int
+    lease_until: float
+    # An earlier claim may have sent the mark to the portal already.
+    submitted: bool = False
+    # Routine the mark belongs to; such marks are skipped on days off.
+    rule: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class MarkEvent:
+    """Outcome written by a worker: ``kind`` is ``retry``, ``done`` or ``skipped``."""
+
+    seq: int
+    mark_id: str
+    chat_id: str
+    kind: str
+    payload: Dict[str, Any]
+
+
+class MarkStore:
+    """Lease-based queue of scheduled marks shared by the bot and the workers."""
+
+    def __init__(self, path: Path) -> None:
+        self._path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None, check_same_thread=False
+        )
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        with self._transaction() as db:
+            for statement in filter(None, (part.strip() for part in _SCHEMA.split(";"))):
+                db.execute(statement)
+            columns = {row["name"] for row in db.execute("PRAGMA table_info(marks)")}
+            if "submitted" not in columns:
+                db.execute("ALTER TABLE marks ADD COLUMN submitted INTEGER NOT NULL DEFAULT 0")
+            if "rule" not in columns:
+                db.execute("ALTER TABLE marks ADD COLUMN rule TEXT")
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        # IMMEDIATE takes the write lock up front so that two workers never
+        # read the same due marks and then both claim them.
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._connection
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def submit(
+        self,
+        identifier: str,
+        chat_id: str,
+        action: str,
+        due: float,
+        deadline: float,
+        rule: Optional[str] = None,
+    ) -> None:
+        """Add a mark; a mark already queued, being run or done is left untouched."""
+
+        with self._transaction() as db:
+            db.execute(
+                "INSERT OR IGNORE INTO marks (id, chat_id, action, due, deadline, rule) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (identifier, chat_id, action, due, deadline, rule),
+            )
+
+    def cancel(self, identifiers: List[str]) -> None:
+        if not identifiers:
+            return
+        with self._transaction() as db:
+            db.executemany(
+                "DELETE FROM marks WHERE id = ? AND done = 0", [(item,) for item in identifiers]
+            )
+
+    def claim(self, owner: str, lease: float, horizon: float, limit: int) -> List[LeasedMark]:
+        """Lease up to ``limit`` marks due before ``horizon`` (epoch seconds).
+
+        Marks whose lease has expired are claimed again.
+        """
+
+        now = time.time()
+        lease_until = now + lease
+        with self._transaction() as db:
+            rows = db.execute(
+                "SELECT id FROM marks WHERE done = 0 AND due <= ? "
+                "AND (lease_until IS NULL OR lease_until < ?) ORDER BY due LIMIT ?",
+                (horizon, now, limit),
+            ).fetchall()
+            claimed = []
+            for row in rows:
+                leased = db.execute(
+                    "UPDATE marks SET lease_owner = ?, lease_until = ?, attempts = attempts + 1 "
+                    "WHERE id = ? RETURNING *",
+                    (owner, lease_until, row["id"]),
+                ).fetchone()
+                claimed.append(_leased(leased))
+        for mark in claimed:
+            if mark.attempts > 1:
+                logger.info("Claimed mark %s again (attempt %s)", mark.identifier, mark.attempts)
+        return claimed
+
+    def renew(self, owner: str, identifiers: List[str], lease: float) -> List[str]:
+        """Extend the leases still held by ``owner``; return the ones now held by others.
+
+        A lease is never shortened.
+        """
+
+        lease_until = time.time() + lease
+        lost = []
+        with self._transaction() as db:
+            for identifier in identifiers:
+                updated = db.execute(
+                    "UPDATE marks SET lease_until = MAX(COALESCE(lease_until, 0), ?) "
+                    "WHERE id = ? AND lease_owner = ? AND done = 0",
+                    (lease_until, identifier, owner),
+                ).rowcount
+                # A mark cancelled by the bot has no row but is not lost.
+                if not updated and db.execute(
+                    "SELECT 1 FROM marks WHERE id = ?", (identifier,)
+                ).fetchone():
+                    lost.append(identifier)
+        return lost
+
+    def mark_submitted(self, identifier: str) -> None:
+        """Record that the mark was sent, whoever holds its lease now.
+
+        The next worker that claims it reports it as registered if the marks
+        table already ends with it.
+        """
+
+        with self._transaction() as db:
+            db.execute("UPDATE marks SET submitted = 1 WHERE id = ? AND done = 0", (identifier,))
+
+    def release(self, owner: str, identifiers: List[str]) -> None:
+        """Give back marks that ``owner`` claimed but did not start."""
+
+        if not identifiers:
+            return
+        with self._transaction() as db:
+            db.executemany(
+                "UPDATE marks SET lease_owner = NULL, lease_until = NULL, "
+                "attempts = attempts - 1 WHERE id = ? AND lease_owner = ? AND done = 0",
+                [(identifier, owner) for identifier in identifiers],
+            )
+
+    def retry(
+        self, owner: str, mark: LeasedMark, retry_at: float, payload: Dict[str, Any]
+    ) -> None:
+        """Hand a failed mark back to the queue, due again at ``retry_at``."""
+
+        with self._transaction() as db:
+            released = db.execute(
+                "UPDATE marks SET due = ?, lease_owner = NULL, lease_until = NULL "
+                "WHERE id = ? AND lease_owner = ? AND done = 0",
+                (retry_at, mark.identifier, owner),
+            ).rowcount
+            if released and mark.attempts == 1:
+                self._add_event(db, mark, "retry", payload)
+
+    def complete(
+        self, owner: str, mark: LeasedMark, payload: Dict[str, Any], kind: str = "done"
+    ) -> bool:
+        """Remove the mark and record its outcome; ``False`` if the lease was lost."""
+
+        with self._transaction() as db:
+            row = db.execute(
+                "SELECT lease_owner, done FROM marks WHERE id = ?", (mark.identifier,)
+            ).fetchone()
+            if row is not None and (row["lease_owner"] != owner or row["done"]):
+                return False
+            # The row stays until its deadline so that the bot, restoring its
+            # schedule file, cannot submit a finished mark again. A mark
+            # cancelled while it ran has no row but still reports what it did.
+            db.execute(
+                "UPDATE marks SET done = 1, lease_until = NULL WHERE id = ?", (mark.identifier,)
+            )
+            self._add_event(db, mark, kind, payload)
+        return True
+
+    @staticmethod
+    def _add_event(
+        db: sqlite3.Connection, mark: LeasedMark, kind: str, payload: Dict[str, Any]
+    ) -> None:
+        db.execute(
+            "INSERT INTO events (mark_id, chat_id, kind, payload) VALUES (?, ?, ?, ?)",
+            (mark.identifier, mark.chat_id, kind, json.dumps(payload, ensure_ascii=False)),
+        )
+
+    def take_events(self, limit: int = 100) -> List[MarkEvent]:
+        """Remove and return the oldest events for the bot to relay."""
+
+        with self._transaction() as db:
+            db.execute("DELETE FROM marks WHERE done = 1 AND deadline < ?", (time.time(),))
+            rows = db.execute(
+                "DELETE FROM events WHERE seq IN "
+                "(SELECT seq FROM events ORDER BY seq LIMIT ?) RETURNING *",
+                (limit,),
+            ).fetchall()
+        events = [
+            MarkEvent(
+                seq=row["seq"],
+                mark_id=row["mark_id"],
+                chat_id=row["chat_id"],
+                kind=row["kind"],
+                payload=json.loads(row["payload"]),
+            )
+            for row in rows
+        ]
+        return sorted(events, key=lambda event: event.seq)
+
+    def counts(self) -> Dict[str, int]:
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT COUNT(*) AS queued, "
+                "COALESCE(SUM(lease_until IS NOT NULL AND lease_until >= ?), 0) AS leased "
+                "FROM marks WHERE done = 0",
+                (now,),
+            ).fetchone()
+            events = self._connection.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+        return {"queued": row["queued"], "leased": row["leased"], "events": events}
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+def result_payload(result: CheckInResult) -> Dict[str, Any]:
+    return {
+        "success": result.success,
+        "action": result.action,
+        "message": result.message,
+        "registered_at": result.registered_at.isoformat() if result.registered_at else None,
+        "retryable": result.retryable,
+    }
+
+
+def result_from_payload(payload: Dict[str, Any]) -> CheckInResult:
+    registered_at = payload.get("registered_at")
+    return CheckInResult(
+        success=bool(payload.get("success")),
+        action=str(payload.get("action", "")),
+        message=str(payload.get("message", "")),
+        registered_at=datetime.fromisoformat(registered_at) if registered_at else None,
+        retryable=bool(payload.get("retryable")),
+    )
+
+
+def _leased(row: sqlite3.Row) -> LeasedMark:
+    return LeasedMark(
+        identifier=row["id"],
+        chat_id=row["chat_id"],
+        action=row["action"],
+        due=row["due"],
+        deadline=row["deadline"],
+        attempts=row["attempts"],
+        lease_until=row["lease_until"],
+        submitted=bool(row["submitted"]),
+        rule=row["rule"],
+    )
+
+
+_store: Optional[MarkStore] = None
+_store_lock = threading.Lock()
+
+
+def get_mark_store() -> MarkStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = MarkStore(Path(get_config().mark_store_path))
+        return _store
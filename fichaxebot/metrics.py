@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Deque, Dict, Final, Iterable, Iterator, Optional
+
+from fichaxebot.config import write_atomic
+from fichaxebot.logging_config import get_log_directory, get_logger
+
+logger = get_logger(__name__)
+
+METRICS_FILE_NAME: Final[str] = "metrics.prom"
+WINDOW_SIZE: Final[int] = 500
+QUANTILES: Final[tuple[float, ...]] = (0.5, 0.9, 0.99)
+
+Labels = tuple[tuple[str, str], ...]
+# A collector returns extra gauge samples (name, labels, value) at export time.
+Collector = Callable[[], Iterable[tuple[str, Dict[str, str], float]]]
+
+
+@dataclass
+class SpanSummary:
+    """Aggregated figures of one span name."""
+
+    count: int
+    errors: int
+    p50: Optional[float]
+    p95: Optional[float]
+
+
+class Metrics:
+    """In-memory registry of timing spans and counters.
+
+    Span durations are kept in a rolling window per name to compute
+    percentiles, next to lifetime totals that follow Prometheus semantics.
+    """
+
+    def __init__(self, window: int = WINDOW_SIZE) -> None:
+        self._window = window
+        self._lock = threading.Lock()
+        self._durations: Dict[str, Deque[float]] = {}
+        self._totals: Dict[str, list[float]] = {}
+        self._outcomes: Dict[tuple[str, str], int] = {}
+        self._counters: Dict[tuple[str, Labels], int] = {}
+        self._collectors: list[Collector] = []
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """Time the block under ``name``, counting it as an error if it raises."""
+
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            yield
+            outcome = "ok"
+        finally:
+            self.observe(name, time.perf_counter() - started, outcome)
+
+    def observe(self, name: str, seconds: float, outcome: str = "ok") -> None:
+        with self._lock:
+            self._durations.setdefault(name, deque(maxlen=self._window)).append(seconds)
+            totals = self._totals.setdefault(name, [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+            key = (name, outcome)
+            self._outcomes[key] = self._outcomes.get(key, 0) + 1
+
+    def increment(self, name: str, amount: int = 1, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def register_collector(self, collector: Collector) -> None:
+        with self._lock:
+            self._collectors.append(collector)
+
+    def percentile(self, name: str, quantile: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._durations.get(name, ()))
+        if not samples:
+            return None
+        return samples[max(1, math.ceil(quantile * len(samples))) - 1]
+
+    def spans(self) -> Dict[str, SpanSummary]:
+        with self._lock:
+            names = sorted(self._totals)
+            counts = {name: int(self._totals[name][0]) for name in names}
+            errors = {name: self._outcomes.get((name, "error"), 0) for name in names}
+        return {
+            name: SpanSummary(
+                counts[name],
+                errors[name],
+                self.percentile(name, 0.5),
+                self.percentile(name, 0.95),
+            )
+            for name in names
+        }
+
+    def counter(self, name: str, **labels: str) -> int:
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def to_prometheus(self) -> str:
+        """Render every metric in the Prometheus text exposition format."""
+
+        with self._lock:
+            durations = {name: sorted(values) for name, values in self._durations.items()}
+            totals = {name: tuple(values) for name, values in self._totals.items()}
+            outcomes = dict(self._outcomes)
+            counters = dict(self._counters)
+            collectors = list(self._collectors)
+
+        lines = [
+            "# HELP fichaxe_span_seconds Duration of bot and portal phases.",
+            "# TYPE fichaxe_span_seconds summary",
+        ]
+        for name in sorted(totals):
+            samples = durations.get(name, [])
+            for quantile in QUANTILES:
+                if samples:
+                    value = samples[max(1, math.ceil(quantile * len(samples))) - 1]
+                    lines.append(
+                        f'fichaxe_span_seconds{{span="{name}",quantile="{quantile}"}} {value:.6f}'
+                    )
+            count, total = totals[name]
+            lines.append(f'fichaxe_span_seconds_count{{span="{name}"}} {int(count)}')
+            lines.append(f'fichaxe_span_seconds_sum{{span="{name}"}} {total:.6f}')
+
+        lines += [
+            "# HELP fichaxe_span_total Finished spans by outcome.",
+            "# TYPE fichaxe_span_total counter",
+        ]
+        for (name, outcome), value in sorted(outcomes.items()):
+            lines.append(f'fichaxe_span_total{{span="{name}",outcome="{outcome}"}} {value}')
+
+        for counter in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE fichaxe_{counter}_total counter")
+            for (name, labels), value in sorted(counters.items()):
+                if name == counter:
+                    lines.append(f"fichaxe_{name}_total{_format_labels(labels)} {value}")
+
+        gauges: Dict[str, list[str]] = {}
+        for collector in collectors:
+            try:
+                samples_iter = list(collector())
+            except Exception:  # noqa: BLE001
+                logger.exception("Metrics collector failed")
+                continue
+            for name, labels, value in samples_iter:
+                gauges.setdefault(name, []).append(
+                    f"fichaxe_{name}{_format_labels(tuple(sorted(labels.items())))} {value:g}"
+                )
+        for name in sorted(gauges):
+            lines.append(f"# TYPE fichaxe_{name} gauge")
+            lines.extend(gauges[name])
+
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: Optional[Path] = None) -> Path:
+        """Write the Prometheus text file, by default into the log directory."""
+
+        path = path or get_log_directory() / METRICS_FILE_NAME
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write_atomic(path, self.to_prometheus())
+        return path
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = ",".join(
+        '{}="{}"'.format(key, value.replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in labels
+    )
+    return "{" + escaped + "}"
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    return _metrics
@@ -0,0 +1,374 @@
+"""Rate-limited delivery of every message the bot sends to Telegram.
+
+Messages are queued per chat and sent by a single dispatcher task that
+respects a global token bucket and one bucket per chat, so a fan-out to many
+chats stays under Telegram's flood limits. A ``RetryAfter`` answer pauses all
+sending for the time Telegram asks. Consecutive texts waiting for the same
+chat are merged into one message.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Final, List, Optional, Union
+
+from telegram import Bot, Message, Update
+from telegram.constants import MessageLimit
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+
+from fichaxebot.config import get_config
+from fichaxebot.logging_config import get_logger
+from fichaxebot.metrics import get_metrics
+
+logger = get_logger(__name__)
+
+ChatId = Union[int, str]
+
+CHAT_BURST: Final[int] = 3
+MAX_IN_FLIGHT: Final[int] = 8
+MAX_SEND_ATTEMPTS: Final[int] = 3
+NETWORK_RETRY_DELAY: Final[float] = 2.0
+MERGE_SEPARATOR: Final[str] = "\n\n"
+
+
+class TokenBucket:
+    """``rate`` tokens per second, holding at most ``capacity`` of them."""
+
+    def __init__(
+        self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        self._rate = rate
+        self._capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def delay(self) -> float:
+        """Seconds until a token is available."""
+
+        self._refill()
+        return max(0.0, (1 - self._tokens) / self._rate)
+
+    def take(self) -> None:
+        self._refill()
+        self._tokens -= 1
+
+    def full(self) -> bool:
+        self._refill()
+        return self._tokens >= self._capacity
+
+
+@dataclass
+class _Outgoing:
+    sequence: int
+    text: str
+    reply_markup: Any
+    future: asyncio.Future
+    merge: bool = True
+    # Message to edit instead of sending a new one.
+    edit: Optional[Message] = None
+    attempts: int = 0
+
+
+@dataclass
+class _ChatQueue:
+    bucket: TokenBucket
+    items: Deque[_Outgoing] = field(default_factory=deque)
+    busy: bool = False
+    not_before: float = 0.0
+
+
+def _retrieve_exception(future: asyncio.Future) -> None:
+    # Callers usually do not await their messages; failures are logged here.
+    if not future.cancelled():
+        future.exception()
+
+
+class MessageOutbox:
+    """Queue of outgoing Telegram messages drained under the flood limits."""
+
+    def __init__(
+        self,
+        bot: Bot,
+        global_rate: float,
+        chat_rate: float,
+        chat_burst: int = CHAT_BURST,
+        max_in_flight: int = MAX_IN_FLIGHT,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._bot = bot
+        self._clock = clock
+        self._global = TokenBucket(global_rate, max(1.0, global_rate), clock)
+        self._chat_rate = chat_rate
+        self._chat_burst = max(1, chat_burst)
+        self._max_in_flight = max(1, max_in_flight)
+        self._chats: Dict[str, _ChatQueue] = {}
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._paused_until = 0.0
+        self._in_flight: set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def depth(self) -> int:
+        return sum(len(queue.items) for queue in self._chats.values())
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="telegram-outbox")
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Deliver what is queued, waiting at most ``timeout`` seconds, and stop."""
+
+        deadline = self._clock() + timeout
+        while (self.depth or self._in_flight) and self._clock() < deadline:
+            await asyncio.sleep(0.1)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for queue in self._chats.values():
+            for item in queue.items:
+                item.future.cancel()
+        if self.depth:
+            logger.warning("Dropped %s unsent Telegram messages on shutdown", self.depth)
+        self._chats.clear()
+
+    def send(
+        self, chat_id: ChatId, text: str, reply_markup: Any = None, *, merge: bool = True
+    ) -> asyncio.Future:
+        """Queue ``text`` for ``chat_id`` and return a future of the sent message.
+
+        With ``merge`` off the text is always sent as a message of its own,
+        e.g. because it is going to be edited later.
+        """
+
+        return self._enqueue(chat_id, text, reply_markup, merge=merge)
+
+    def edit(self, message: Message, text: str, reply_markup: Any = None) -> asyncio.Future:
+        """Queue an edit of ``message`` behind the messages pending for its chat."""
+
+        return self._enqueue(message.chat_id, text, reply_markup, merge=False, edit=message)
+
+    async def edit_or_send(
+        self, pending: asyncio.Future, chat_id: ChatId, text: str, reply_markup: Any = None
+    ) -> asyncio.Future:
+        """Edit the message of ``pending`` into ``text``, or send it anew if that one failed."""
+
+        try:
+            message = await pending
+        except TelegramError:
+            message = None
+        if not isinstance(message, Message):
+            return self.send(chat_id, text, reply_markup, merge=False)
+        return self.edit(message, text, reply_markup)
+
+    def _enqueue(
+        self,
+        chat_id: ChatId,
+        text: str,
+        reply_markup: Any,
+        *,
+        merge: bool,
+        edit: Optional[Message] = None,
+    ) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_retrieve_exception)
+        key = str(chat_id)
+        queue = self._chats.get(key)
+        if queue is None:
+            queue = self._chats[key] = _ChatQueue(
+                TokenBucket(self._chat_rate, self._chat_burst, self._clock)
+            )
+        queue.items.append(
+            _Outgoing(next(self._sequence), text, reply_markup, future, merge, edit)
+        )
+        self._wakeup.set()
+        return future
+
+    def _next_chat(self) -> tuple[Optional[str], float]:
+        """Return the ready chat with the oldest message, or how long to wait."""
+
+        now = self._clock()
+        best: Optional[str] = None
+        wait = float("inf")
+        for key, queue in list(self._chats.items()):
+            if not queue.items:
+                if not queue.busy and queue.bucket.full():
+                    del self._chats[key]
+                continue
+            if queue.busy:
+                continue
+            delay = max(queue.bucket.delay(), queue.not_before - now)
+            if delay > 0:
+                wait = min(wait, delay)
+            elif best is None or queue.items[0].sequence < self._chats[best].items[0].sequence:
+                best = key
+        return best, wait
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            pause = self._paused_until - self._clock()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+
+            key, wait = self._next_chat()
+            if key is None or len(self._in_flight) >= self._max_in_flight:
+                timeout = None if wait == float("inf") else wait
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            delay = self._global.delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            queue = self._chats[key]
+            batch = self._take_batch(queue)
+            self._global.take()
+            queue.bucket.take()
+            queue.busy = True
+            task = asyncio.create_task(self._deliver(key, queue, batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._finished)
+
+    def _finished(self, task: asyncio.Task) -> None:
+        self._in_flight.discard(task)
+        self._wakeup.set()
+
+    @staticmethod
+    def _take_batch(queue: _ChatQueue) -> List[_Outgoing]:
+        first = queue.items.popleft()
+        batch = [first]
+        if not first.merge or first.edit is not None:
+            return batch
+
+        length = len(first.text)
+        # A keyboard stays on the last message of the batch.
+        while queue.items and batch[-1].reply_markup is None:
+            candidate = queue.items[0]
+            length += len(MERGE_SEPARATOR) + len(candidate.text)
+            if (
+                not candidate.merge
+                or candidate.edit is not None
+                or length > MessageLimit.MAX_TEXT_LENGTH
+            ):
+                break
+            batch.append(queue.items.popleft())
+        return batch
+
+    async def _deliver(self, key: str, queue: _ChatQueue, batch: List[_Outgoing]) -> None:
+        metrics = get_metrics()
+        head = batch[0]
+        text = MERGE_SEPARATOR.join(item.text for item in batch)
+        try:
+            if head.edit is not None:
+                result = await self._bot.edit_message_text(
+                    text,
+                    chat_id=head.edit.chat_id,
+                    message_id=head.edit.message_id,
+                    reply_markup=head.reply_markup,
+                )
+            else:
+                result = await self._bot.send_message(
+                    chat_id=key, text=text, reply_markup=batch[-1].reply_markup
+                )
+        except RetryAfter as exc:
+            retry_after = float(exc.retry_after)
+            logger.warning("Telegram flood limit hit; pausing messages for %.0f s", retry_after)
+            metrics.increment("telegram_messages", outcome="retry_after")
+            self._paused_until = max(self._paused_until, self._clock() + retry_after)
+            queue.items.extendleft(reversed(batch))
+        except (BadRequest, Forbidden) as exc:
+            self._fail(key, batch, exc)
+        except NetworkError as exc:
+            if head.attempts + 1 >= MAX_SEND_ATTEMPTS:
+                self._fail(key, batch, exc)
+            else:
+                logger.warning("Could not reach Telegram (%s); retrying message to %s", exc, key)
+                for item in batch:
+                    item.attempts += 1
+                queue.not_before = self._clock() + NETWORK_RETRY_DELAY * head.attempts
+                queue.items.extendleft(reversed(batch))
+        except TelegramError as exc:
+            self._fail(key, batch, exc)
+        else:
+            metrics.increment("telegram_messages", outcome="sent")
+            if len(batch) > 1:
+                metrics.increment("telegram_messages", len(batch) - 1, outcome="merged")
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_result(result)
+        finally:
+            queue.busy = False
+
+    @staticmethod
+    def _fail(key: str, batch: List[_Outgoing], exc: TelegramError) -> None:
+        logger.error("Could not send a message to chat %s: %s", key, exc)
+        get_metrics().increment("telegram_messages", len(batch), outcome="failed")
+        for item in batch:
+            if not item.future.done():
+                item.future.set_exception(exc)
+
+    def collect(self) -> list[tuple[str, Dict[str, str], float]]:
+        return [
+            ("outbox_depth", {}, float(self.depth)),
+            ("outbox_chats", {}, float(len(self._chats))),
+        ]
+
+
+_outbox: Optional[MessageOutbox] = None
+
+
+def start_outbox(bot: Bot) -> MessageOutbox:
+    """Create and start the outbox of ``bot``; call it from the running event loop."""
+
+    global _outbox
+    if _outbox is None:
+        config = get_config()
+        _outbox = MessageOutbox(
+            bot,
+            config.telegram_messages_per_second,
+            config.telegram_chat_messages_per_minute / 60,
+        )
+        _outbox.start()
+        get_metrics().register_collector(_outbox.collect)
+    return _outbox
+
+
+def get_outbox() -> MessageOutbox:
+    if _outbox is None:
+        raise RuntimeError("La cola de mensajes de Telegram no está iniciada")
+    return _outbox
+
+
+async def stop_outbox() -> None:
+    global _outbox
+    outbox, _outbox = _outbox, None
+    if outbox is not None:
+        await outbox.stop()
+
+
+def reply(
+    update: Update, text: str, reply_markup: Any = None, *, merge: bool = True
+) -> asyncio.Future:
+    """Queue ``text`` for the chat of ``update``."""
+
+    return get_outbox().send(update.effective_chat.id, text, reply_markup, merge=merge)
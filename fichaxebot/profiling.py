@@ -0,0 +1,146 @@
+"""Opt-in cProfile hooks for portal operations and Telegram handlers.
+
+Set ``FICHAXE_PROFILE=1`` before starting the bot to write one ``.prof`` file
+per call to ``<log dir>/profiles`` (load them with ``pstats`` or snakeviz) and
+log its hottest frames. Only the newest ``FICHAXE_PROFILE_KEEP`` files are
+kept. When the variable is unset :func:`profiled` returns the function
+untouched, so disabled profiling costs nothing.
+"""
+
+from __future__ import annotations
+
+import cProfile
+import functools
+import inspect
+import itertools
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Final, Iterator, TypeVar
+
+from fichaxebot.logging_config import get_log_directory, get_logger
+
+logger = get_logger(__name__)
+
+PROFILE_ENV_VAR: Final[str] = "FICHAXE_PROFILE"
+PROFILE_KEEP_ENV_VAR: Final[str] = "FICHAXE_PROFILE_KEEP"
+PROFILE_DIR_NAME: Final[str] = "profiles"
+DEFAULT_PROFILE_KEEP: Final[int] = 50
+TOP_FRAMES: Final[int] = 10
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+_active = threading.local()
+_prune_lock = threading.Lock()
+_sequence = itertools.count()
+
+
+def profiling_enabled() -> bool:
+    return os.environ.get(PROFILE_ENV_VAR, "").strip().lower() in {"1", "true", "yes", "on"}
+
+
+def get_profile_directory() -> Path:
+    return get_log_directory() / PROFILE_DIR_NAME
+
+
+def _retention() -> int:
+    try:
+        return max(1, int(os.environ.get(PROFILE_KEEP_ENV_VAR, DEFAULT_PROFILE_KEEP)))
+    except ValueError:
+        return DEFAULT_PROFILE_KEEP
+
+
+def _prune(directory: Path) -> None:
+    with _prune_lock:
+        files = sorted(directory.glob("*.prof"), key=lambda item: item.stat().st_mtime)
+        for stale in files[: max(0, len(files) - _retention())]:
+            stale.unlink(missing_ok=True)
+
+
+def _top_frames(stats: pstats.Stats) -> list[str]:
+    rows = sorted(
+        stats.stats.items(),  # type: ignore[attr-defined]
+        key=lambda item: item[1][3],
+        reverse=True,
+    )
+    lines = []
+    for (filename, line, function), (_, calls, own, cumulative, _) in rows[:TOP_FRAMES]:
+        location = f"{Path(filename).name}:{line}" if line else filename
+        lines.append(
+            f"{cumulative * 1000:9.1f} ms cum {own * 1000:9.1f} ms own "
+            f"{calls:>6} calls  {function} ({location})"
+        )
+    return lines
+
+
+@contextmanager
+def _profile(name: str) -> Iterator[None]:
+    # One profiler per thread: a nested profiled call is already covered by
+    # the outer one.
+    if getattr(_active, "profiling", False):
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler owns the interpreter hook; run unprofiled.
+        yield
+        return
+
+    _active.profiling = True
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _active.profiling = False
+        elapsed = time.perf_counter() - started
+        try:
+            directory = get_profile_directory()
+            directory.mkdir(parents=True, exist_ok=True)
+            stamp = time.strftime("%Y%m%d-%H%M%S")
+            path = directory / f"{stamp}-{os.getpid()}-{next(_sequence):04d}-{name}.prof"
+            profiler.dump_stats(path)
+            _prune(directory)
+            summary = _top_frames(pstats.Stats(profiler))
+            logger.info(
+                "Profile of %s (%.3f s) saved to %s. Top frames:\n%s",
+                name,
+                elapsed,
+                path,
+                "\n".join(summary),
+            )
+        except Exception:  # noqa: BLE001
+            logger.exception("Could not store the profile of %s", name)
+
+
+def profiled(func: F) -> F:
+    """Profile every call of ``func`` (sync or async) when profiling is on."""
+
+    if not profiling_enabled():
+        return func
+
+    name = func.__qualname__.replace(".", "_").replace("<", "").replace(">", "")
+
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+            # Other tasks running on the loop while this one awaits are
+            # included in the profile.
+            with _profile(name):
+                return await func(*args, **kwargs)
+
+        return async_wrapper  # type: ignore[return-value]
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        with _profile(name):
+            return func(*args, **kwargs)
+
+    return wrapper  # type: ignore[return-value]
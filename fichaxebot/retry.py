@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Final, Optional, TypeVar
+
+from fichaxebot.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+FAILURE_THRESHOLD: Final[int] = 5
+RESET_TIMEOUT: Final[float] = 120.0
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling the portal while it is considered down."""
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(
+            f"El portal no responde; se volverá a intentar en {retry_after:.0f} s"
+        )
+        self.retry_after = retry_after
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """Exponential backoff with full jitter."""
+
+    max_attempts: int = 3
+    base_delay: float = 2.0
+    max_delay: float = 30.0
+    multiplier: float = 2.0
+
+    def delay(self, attempt: int, rng: Callable[[], float] = random.random) -> float:
+        """Pause before retry number ``attempt`` (1 for the first retry)."""
+
+        ceiling = min(self.max_delay, self.base_delay * self.multiplier ** (attempt - 1))
+        return ceiling * rng()
+
+
+class CircuitBreaker:
+    """Stop calling a portal host after repeated failures.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    calls fail fast with :class:`CircuitOpenError`. Once ``reset_timeout``
+    has passed a single trial call is let through: its success closes the
+    circuit and its failure opens it again.
+    """
+
+    def __init__(
+        self, failure_threshold: int = FAILURE_THRESHOLD, reset_timeout: float = RESET_TIMEOUT
+    ) -> None:
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self._reset_timeout:
+                return "half_open"
+            return "open"
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self._opened_at + self._reset_timeout - time.monotonic()
+            if remaining > 0 or self._trial_running:
+                raise CircuitOpenError(max(remaining, 1.0))
+            self._trial_running = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("Portal circuit closed again")
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._opened_at is not None or self._failures >= self._failure_threshold:
+                if self._opened_at is None:
+                    logger.warning(
+                        "Portal circuit opened after %s consecutive failures", self._failures
+                    )
+                self._opened_at = time.monotonic()
+
+    def record_other(self) -> None:
+        """Record a call that failed for a reason that says nothing of the host."""
+
+        with self._lock:
+            self._trial_running = False
+
+
+def retry_call(
+    func: Callable[[], T],
+    *,
+    policy: RetryPolicy,
+    is_retryable: Callable[[BaseException], bool],
+    breaker: Optional[CircuitBreaker] = None,
+    is_outage: Callable[[BaseException], bool] = lambda exc: True,
+    budget: Optional[float] = None,
+    sleep: Callable[[float], None] = time.sleep,
+) -> T:
+    """Call ``func`` until it succeeds, fails for good or runs out of time.
+
+    Errors rejected by ``is_retryable`` propagate at once and do not count
+    against the circuit breaker; of the retryable ones only those accepted by
+    ``is_outage`` count as failures of the host. ``budget`` caps in seconds
+    the time spent including the pauses; no retry starts after it.
+    """
+
+    deadline = None if budget is None else time.monotonic() + budget
+    attempt = 1
+    while True:
+        if breaker is not None:
+            breaker.before_call()
+        try:
+            result = func()
+        except Exception as exc:  # noqa: BLE001
+            if not is_retryable(exc):
+                # The portal answered, so it is not down.
+                if breaker is not None:
+                    breaker.record_success()
+                raise
+            if breaker is not None:
+                if is_outage(exc):
+                    breaker.record_failure()
+                else:
+                    breaker.record_other()
+            pause = policy.delay(attempt)
+            out_of_time = deadline is not None and time.monotonic() + pause >= deadline
+            if attempt >= policy.max_attempts or out_of_time:
+                raise
+            logger.warning(
+                "Attempt %s failed with %r; retrying in %.1f s", attempt, exc, pause
+            )
+            sleep(pause)
+            attempt += 1
+            continue
+        if breaker is not None:
+            breaker.record_success()
+        return result
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(host: str) -> CircuitBreaker:
+    """Return the circuit breaker of portal ``host``, shared by every account."""
+
+    with _breakers_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = _breakers[host] = CircuitBreaker()
+        return breaker
@@ -0,0 +1,161 @@
+"""In-memory index of the pending marks of one chat.
+
+Marks are kept in a list sorted by time together with an index by action,
+so the marks of a time range and cancelling every mark of an action do
+not sort or scan the whole schedule. Removed marks are only dropped from
+the sorted list lazily, once the dead entries outnumber the live ones.
+"""
+
+from __future__ import annotations
+
+import itertools
+import sys
+from bisect import bisect_left, insort
+from datetime import datetime
+from typing import Dict, Final, Iterator, List, Optional, Set, Tuple
+
+from fichaxebot.utils import MADRID_TZ
+
+COMPACT_MIN_DEAD: Final[int] = 64
+
+
+class ScheduledMark:
+    """A mark planned for ``when``, stored as epoch seconds in ``at``.
+
+    ``rule`` is the recurrence rule the mark is an occurrence of, if any.
+    """
+
+    __slots__ = ("identifier", "action", "at", "rule")
+
+    def __init__(
+        self, identifier: str, action: str, when: datetime, rule: Optional[str] = None
+    ) -> None:
+        self.identifier = identifier
+        self.action = sys.intern(action)
+        self.at = when.timestamp()
+        self.rule = rule
+
+    @property
+    def when(self) -> datetime:
+        return datetime.fromtimestamp(self.at, MADRID_TZ)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, ScheduledMark):
+            return NotImplemented
+        return (self.identifier, self.action, self.at, self.rule) == (
+            other.identifier,
+            other.action,
+            other.at,
+            other.rule,
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"ScheduledMark(identifier={self.identifier!r}, action={self.action!r}, "
+            f"when={self.when.isoformat()!r})"
+        )
+
+    def to_dict(self) -> Dict[str, str]:
+        data = {
+            "id": self.identifier,
+            "action": self.action,
+            "when": self.when.isoformat(),
+        }
+        if self.rule is not None:
+            data["rule"] = self.rule
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, str]) -> "ScheduledMark":
+        when = datetime.fromisoformat(data["when"])
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=MADRID_TZ)
+        return cls(
+            identifier=data["id"], action=data["action"], when=when, rule=data.get("rule")
+        )
+
+
+class ScheduleIndex:
+    """Pending marks by id, ordered by time and grouped by action."""
+
+    def __init__(self) -> None:
+        self._marks: Dict[str, ScheduledMark] = {}
+        # (at, sequence, id); an entry is live while ``_live[id]`` is its sequence.
+        self._order: List[Tuple[float, int, str]] = []
+        self._live: Dict[str, int] = {}
+        self._by_action: Dict[str, Set[str]] = {}
+        self._sequence = itertools.count()
+        self._dead = 0
+
+    def __len__(self) -> int:
+        return len(self._marks)
+
+    def __contains__(self, identifier: object) -> bool:
+        return identifier in self._marks
+
+    def __iter__(self) -> Iterator[ScheduledMark]:
+        return (self._marks[identifier] for _, _, identifier in self._live_entries(self._order))
+
+    def get(self, identifier: str) -> Optional[ScheduledMark]:
+        return self._marks.get(identifier)
+
+    def add(self, mark: ScheduledMark) -> None:
+        if mark.identifier in self._marks:
+            self.remove(mark.identifier)
+        sequence = next(self._sequence)
+        insort(self._order, (mark.at, sequence, mark.identifier))
+        self._marks[mark.identifier] = mark
+        self._live[mark.identifier] = sequence
+        self._by_action.setdefault(mark.action, set()).add(mark.identifier)
+
+    def remove(self, identifier: str) -> Optional[ScheduledMark]:
+        mark = self._marks.pop(identifier, None)
+        if mark is None:
+            return None
+        del self._live[identifier]
+        same_action = self._by_action[mark.action]
+        same_action.discard(identifier)
+        if not same_action:
+            del self._by_action[mark.action]
+        self._forget(1)
+        return mark
+
+    def remove_action(self, action: str) -> List[ScheduledMark]:
+        """Remove every mark of ``action`` and return them."""
+
+        removed = [self._marks.pop(identifier) for identifier in self._by_action.pop(action, ())]
+        for mark in removed:
+            del self._live[mark.identifier]
+        self._forget(len(removed))
+        return removed
+
+    def clear(self) -> List[ScheduledMark]:
+        removed = list(self._marks.values())
+        self._marks.clear()
+        self._order.clear()
+        self._live.clear()
+        self._by_action.clear()
+        self._dead = 0
+        return removed
+
+    def between(self, start: datetime, end: datetime) -> List[ScheduledMark]:
+        """Marks planned in ``[start, end)``, in time order."""
+
+        low = bisect_left(self._order, (start.timestamp(),))
+        high = bisect_left(self._order, (end.timestamp(),), low)
+        return [
+            self._marks[identifier]
+            for _, _, identifier in self._live_entries(self._order[low:high])
+        ]
+
+    def _live_entries(
+        self, entries: List[Tuple[float, int, str]]
+    ) -> Iterator[Tuple[float, int, str]]:
+        live = self._live
+        return (entry for entry in entries if live.get(entry[2]) == entry[1])
+
+    def _forget(self, count: int) -> None:
+        self._dead += count
+        if self._dead > max(COMPACT_MIN_DEAD, len(self._marks)):
+            self._order = list(self._live_entries(self._order))
+            self._dead = 0
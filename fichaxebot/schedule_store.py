@@ -0,0 +1,265 @@
+"""Crash-safe storage of the scheduled marks of one chat.
+
+The marks live in a snapshot, the JSON array of ``.schedule.data``, plus an
+append-only journal next to it (``.schedule.journal``) with one JSON record
+per change. A change costs one appended line instead of rewriting every
+pending mark. Loading replays the journal over the snapshot; a line torn by
+a crash is ignored. Once the journal grows past a few times the number of
+marks it is compacted: the snapshot is rewritten through a temporary file
+and ``os.replace`` and the journal is emptied. Replaying a record twice is
+harmless, so a crash between both steps loses nothing.
+
+Writes are queued to a single background thread shared by every chat. It
+appends whatever is pending for a journal in one write and one ``fsync``.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import queue
+import threading
+from pathlib import Path
+from typing import Any, Dict, Final, List, Optional
+
+from fichaxebot.config import write_atomic
+from fichaxebot.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# Compact when the journal holds this many records and more than
+# ``COMPACT_RATIO`` times the number of pending marks.
+COMPACT_MIN_RECORDS: Final[int] = 64
+COMPACT_RATIO: Final[int] = 4
+
+MarkData = Dict[str, str]
+
+
+def journal_path(snapshot: Path) -> Path:
+    return snapshot.with_suffix(".journal")
+
+
+def has_stored_marks(snapshot: Path) -> bool:
+    """Whether ``snapshot`` or its journal may hold marks, without replaying them."""
+
+    for path in (snapshot, journal_path(snapshot)):
+        try:
+            if path.stat().st_size and path.read_text(encoding="utf-8").strip() not in ("", "[]"):
+                return True
+        except FileNotFoundError:
+            continue
+        except OSError:
+            # Let the scheduler report the broken file.
+            return True
+    return False
+
+
+def _fsync_directory(path: Path) -> None:
+    try:
+        fd = os.open(path.parent, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class ScheduleJournal:
+    """Snapshot plus journal of the pending marks, keyed by mark id."""
+
+    def __init__(self, snapshot: Path) -> None:
+        self._snapshot = snapshot
+        self._journal = journal_path(snapshot)
+        self._lock = threading.Lock()
+        self._marks: Dict[str, MarkData] = {}
+        self._pending: List[Dict[str, Any]] = []
+        self._records = 0
+        self._compact_requested = False
+
+    def replay(self) -> List[MarkData]:
+        """Read the stored marks back: the snapshot with the journal applied."""
+
+        marks: Dict[str, MarkData] = {}
+        for item in self._read_snapshot():
+            if isinstance(item, dict) and "id" in item:
+                marks[str(item["id"])] = item
+
+        records = 0
+        try:
+            lines = self._journal.read_text(encoding="utf-8").splitlines()
+        except FileNotFoundError:
+            lines = []
+        for number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                _apply(marks, record)
+            except (ValueError, KeyError, TypeError, AttributeError):
+                if number == len(lines):
+                    logger.warning("Ignoring a torn last record in %s", self._journal)
+                else:
+                    logger.warning("Ignoring invalid record %s in %s", number, self._journal)
+                continue
+            records += 1
+
+        with self._lock:
+            self._marks = dict(marks)
+            self._records = records
+        return list(marks.values())
+
+    def _read_snapshot(self) -> List[Any]:
+        try:
+            raw = self._snapshot.read_text(encoding="utf-8").strip()
+        except FileNotFoundError:
+            return []
+        if not raw:
+            return []
+        try:
+            data = json.loads(raw)
+            if not isinstance(data, list):
+                raise ValueError("not a list")
+        except ValueError:
+            broken = self._snapshot.with_name(self._snapshot.name + ".corrupt")
+            logger.warning(
+                "Invalid format in %s. Content will be ignored and kept in %s.",
+                self._snapshot,
+                broken,
+            )
+            os.replace(self._snapshot, broken)
+            return []
+        return data
+
+    def add(self, mark: MarkData) -> None:
+        self._queue({"op": "add", "mark": mark})
+
+    def remove(self, identifiers: List[str]) -> None:
+        for identifier in identifiers:
+            self._queue({"op": "remove", "id": identifier})
+
+    def reset(self, marks: List[MarkData]) -> None:
+        """Replace the stored marks with ``marks`` through a compaction."""
+
+        with self._lock:
+            self._marks = {item["id"]: item for item in marks}
+            self._pending.clear()
+            self._compact_requested = True
+        _get_writer().notify(self)
+
+    def _queue(self, record: Dict[str, Any]) -> None:
+        with self._lock:
+            _apply(self._marks, record)
+            self._pending.append(record)
+        _get_writer().notify(self)
+
+    def write_pending(self) -> None:
+        """Append the queued records and compact if needed; called by the writer."""
+
+        with self._lock:
+            records = list(self._pending)
+        if records:
+            payload = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+            with open(self._journal, "a", encoding="utf-8") as handle:
+                handle.write(payload)
+                handle.flush()
+                os.fsync(handle.fileno())
+
+        # Records are only dropped once written, so a failed write is retried
+        # with the next change.
+        with self._lock:
+            del self._pending[: len(records)]
+            self._records += len(records)
+            compact = self._compact_requested or self._records >= max(
+                COMPACT_MIN_RECORDS, COMPACT_RATIO * len(self._marks)
+            )
+            snapshot = list(self._marks.values()) if compact else None
+        if snapshot is not None:
+            self._compact(snapshot)
+            with self._lock:
+                self._records = 0
+                self._compact_requested = False
+
+    def _compact(self, marks: List[MarkData]) -> None:
+        marks = sorted(marks, key=lambda item: item.get("when", ""))
+        write_atomic(self._snapshot, json.dumps(marks, indent=2), durable=True)
+        _fsync_directory(self._snapshot)
+        # Records written after the snapshot was taken are replayed again
+        # over it, which is harmless, so the journal can simply be emptied.
+        with open(self._journal, "w", encoding="utf-8") as handle:
+            handle.flush()
+            os.fsync(handle.fileno())
+        logger.debug("Compacted %s (%s marks)", self._snapshot, len(marks))
+
+
+def _apply(marks: Dict[str, MarkData], record: Dict[str, Any]) -> None:
+    op = record["op"]
+    if op == "add":
+        mark = dict(record["mark"])
+        marks[str(mark["id"])] = mark
+    elif op == "remove":
+        marks.pop(str(record["id"]), None)
+    else:
+        raise ValueError(f"unknown operation {op!r}")
+
+
+class _JournalWriter:
+    """Background thread that writes the queued changes of every journal."""
+
+    def __init__(self) -> None:
+        self._queue: "queue.Queue[Optional[ScheduleJournal]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="schedule-writer", daemon=True)
+        self._thread.start()
+
+    def notify(self, journal: ScheduleJournal) -> None:
+        self._queue.put(journal)
+
+    def _run(self) -> None:
+        while True:
+            journal = self._queue.get()
+            try:
+                if journal is None:
+                    return
+                journal.write_pending()
+            except OSError:
+                logger.exception("Could not write the scheduled marks")
+            finally:
+                self._queue.task_done()
+
+    def flush(self) -> None:
+        """Wait until every queued change is on disk."""
+
+        self._queue.join()
+
+    def stop(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+
+_writer: Optional[_JournalWriter] = None
+_writer_lock = threading.Lock()
+
+
+def _get_writer() -> _JournalWriter:
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = _JournalWriter()
+        return _writer
+
+
+def flush_schedule_writes() -> None:
+    with _writer_lock:
+        writer = _writer
+    if writer is not None:
+        writer.flush()
+
+
+def shutdown_schedule_writer() -> None:
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.stop()
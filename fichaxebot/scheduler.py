@@ -2,43 +2,136 @@ from __future__ import annotations
 
 import json
 from dataclasses import dataclass
-from datetime import datetime, timedelta
+from datetime import date, datetime, time as dtime, timedelta
 from pathlib import Path
 from random import randint
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 from uuid import uuid4
 
 from telegram.ext import Application, ContextTypes, Job
 
-from fichaxebot.utils import MADRID_TZ, execute_check_in_async, get_madrid_now
+from fichaxebot.config import write_atomic
+from fichaxebot.executor import Priority
+from fichaxebot.fichador import CheckInResult, Credentials
+from fichaxebot.utils import (
+    MADRID_TZ,
+    execute_check_in_async,
+    get_madrid_now,
+    prewarm_check_in_async,
+)
+from fichaxebot.latency import get_latency_stats
+from fichaxebot.mark_store import MarkEvent, MarkStore, result_from_payload
+from fichaxebot.schedule_index import ScheduledMark, ScheduleIndex
+from fichaxebot.schedule_store import ScheduleJournal
+from fichaxebot.outbox import get_outbox
 from fichaxebot.logging_config import get_logger
+from fichaxebot.workdays import get_working_days
 
 logger = get_logger(__name__)
 
 SCHEDULE_FILE = Path(".schedule.data")
 
+# How long a pre-warmed session waits for its mark after the planned time.
+PREWARM_GRACE = timedelta(minutes=2)
+
+# A scheduled mark that keeps failing is retried until this long after its time.
+MARK_DEADLINE = timedelta(minutes=10)
+RETRY_DELAY = timedelta(minutes=1)
+
+# Latency phases paid before (pre-warm) and at (mark) the scheduled time.
+PREWARM_PHASES = ("driver_start", "login")
+MARK_PHASES = ("table_read", "mark")
+# Marks start early by this percentile of their cost, so that few land late.
+MARK_ADVANCE_QUANTILE = 0.95
+
+# Weekday letters as used in Spanish calendars, Monday first.
+WEEKDAY_LETTERS = ("L", "M", "X", "J", "V", "S", "D")
+WEEKDAY_ALIASES = {
+    "laborables": (0, 1, 2, 3, 4),
+    "diario": (0, 1, 2, 3, 4, 5, 6),
+}
+# A rule without an occurrence in this many days is left without a mark.
+RULE_HORIZON_DAYS = 366
+
+
+def parse_weekdays(value: str) -> Optional[Tuple[int, ...]]:
+    """Parse ``L-V``, ``L,X,V``, ``V`` or an alias such as ``laborables``."""
+
+    text = value.strip().lower()
+    if text in WEEKDAY_ALIASES:
+        return WEEKDAY_ALIASES[text]
+
+    letters = [letter.lower() for letter in WEEKDAY_LETTERS]
+    days = set()
+    for part in filter(None, text.split(",")):
+        bounds = part.split("-")
+        if len(bounds) > 2 or any(bound not in letters for bound in bounds):
+            return None
+        first, last = letters.index(bounds[0]), letters.index(bounds[-1])
+        if last < first:
+            return None
+        days.update(range(first, last + 1))
+    return tuple(sorted(days)) or None
+
+
+def format_weekdays(weekdays: Tuple[int, ...]) -> str:
+    for alias, days in WEEKDAY_ALIASES.items():
+        if weekdays == days:
+            return alias
+    if len(weekdays) > 2 and weekdays == tuple(range(weekdays[0], weekdays[-1] + 1)):
+        return f"{WEEKDAY_LETTERS[weekdays[0]]}-{WEEKDAY_LETTERS[weekdays[-1]]}"
+    return ",".join(WEEKDAY_LETTERS[day] for day in weekdays)
+
+
+@dataclass(frozen=True)
+class RecurrenceRule:
+    """Mark ``action`` at ``at`` on the given weekdays (0 is Monday)."""
 
-@dataclass
-class ScheduledMark:
     identifier: str
     action: str
-    when: datetime
-
-    def to_dict(self) -> Dict[str, str]:
+    at: dtime
+    weekdays: Tuple[int, ...]
+
+    def describe(self) -> str:
+        return f"{self.action} a las {self.at.strftime('%H:%M')} ({format_weekdays(self.weekdays)})"
+
+    def next_occurrence(
+        self, after: datetime, skip: Callable[[date], bool]
+    ) -> Optional[datetime]:
+        """First occurrence later than ``after`` on a day not rejected by ``skip``."""
+
+        day = after.astimezone(MADRID_TZ).date()
+        for _ in range(RULE_HORIZON_DAYS + 1):
+            if day.weekday() in self.weekdays and not skip(day):
+                when = datetime.combine(day, self.at, tzinfo=MADRID_TZ)
+                if when > after:
+                    return when
+            day += timedelta(days=1)
+        return None
+
+    def to_dict(self) -> Dict[str, object]:
         return {
             "id": self.identifier,
             "action": self.action,
-            "when": self.when.astimezone(MADRID_TZ).isoformat(),
+            "at": self.at.strftime("%H:%M"),
+            "weekdays": list(self.weekdays),
         }
 
     @classmethod
-    def from_dict(cls, data: Dict[str, str]) -> "ScheduledMark":
-        when = datetime.fromisoformat(data["when"])
-        if when.tzinfo is None:
-            when = MADRID_TZ.localize(when)
-        else:
-            when = when.astimezone(MADRID_TZ)
-        return cls(identifier=data["id"], action=data["action"], when=when)
+    def from_dict(cls, data: Dict[str, object]) -> "RecurrenceRule":
+        weekdays = tuple(sorted({int(day) for day in data["weekdays"]}))
+        if not weekdays or any(not 0 <= day <= 6 for day in weekdays):
+            raise ValueError(f"invalid weekdays {weekdays}")
+        return cls(
+            identifier=str(data["id"]),
+            action=str(data["action"]),
+            at=dtime.fromisoformat(str(data["at"])),
+            weekdays=weekdays,
+        )
+
+
+def rules_path(schedule_file: Path) -> Path:
+    return schedule_file.with_suffix(".rules")
 
 
 class SchedulerManager:
@@ -47,30 +140,110 @@ class SchedulerManager:
         chat_id: str,
         auto_checkout_delay: Optional[timedelta],
         auto_checkout_random_offset_minutes: int,
+        prewarm_lead: timedelta = timedelta(0),
+        target_window: timedelta = timedelta(0),
+        credentials: Optional[Credentials] = None,
+        schedule_file: Path = SCHEDULE_FILE,
+        mark_store: Optional[MarkStore] = None,
     ) -> None:
-        self._scheduled: Dict[str, ScheduledMark] = {}
+        self._scheduled = ScheduleIndex()
         self._jobs: Dict[str, Job] = {}
         self._chat_id = chat_id
+        self._credentials = credentials
+        self._journal = ScheduleJournal(schedule_file)
+        self._rules_file = rules_path(schedule_file)
+        self._rules: Dict[str, RecurrenceRule] = self._load_rules()
+        # Pending occurrence of each rule: rule id -> mark id.
+        self._rule_marks: Dict[str, str] = {}
         self._auto_checkout_delay = auto_checkout_delay
         self._auto_checkout_random_offset = max(0, auto_checkout_random_offset_minutes)
+        self._prewarm_lead = prewarm_lead
+        self._target_window = target_window
+        # With a store the marks are run by ``python -m fichaxebot.worker``.
+        self._mark_store = mark_store
+
+    @property
+    def credentials(self) -> Optional[Credentials]:
+        return self._credentials
+
+    @credentials.setter
+    def credentials(self, credentials: Optional[Credentials]) -> None:
+        self._credentials = credentials
 
     @staticmethod
     def create_mark(action: str, when: datetime) -> ScheduledMark:
         normalized_when = when.astimezone(MADRID_TZ)
         return ScheduledMark(identifier=str(uuid4()), action=action, when=normalized_when)
 
+    def _current_prewarm_lead(self) -> timedelta:
+        """Configured lead, stretched when logging in has recently been slow."""
+
+        if not self._prewarm_lead:
+            return timedelta(0)
+        observed = get_latency_stats().estimate(PREWARM_PHASES, 0.95) * 1.5
+        return max(self._prewarm_lead, timedelta(seconds=observed))
+
+    def _mark_advance(self, prewarmed: bool) -> timedelta:
+        """How early to start a mark so that it registers at its planned time."""
+
+        phases = MARK_PHASES if prewarmed else PREWARM_PHASES + MARK_PHASES
+        observed = timedelta(
+            seconds=get_latency_stats().estimate(phases, MARK_ADVANCE_QUANTILE)
+        )
+        return min(observed, self._target_window)
+
     def add_mark(self, app: Application, mark: ScheduledMark) -> None:
+        self._schedule_mark(app, mark)
+        self._journal.add(mark.to_dict())
+
+    def _schedule_mark(self, app: Application, mark: ScheduledMark) -> None:
+        if mark.rule is not None:
+            self._rule_marks[mark.rule] = mark.identifier
+        if self._mark_store is not None:
+            self._mark_store.submit(
+                mark.identifier,
+                self._chat_id,
+                mark.action,
+                mark.when.timestamp(),
+                (mark.when + MARK_DEADLINE).timestamp(),
+                mark.rule,
+            )
+            self._scheduled.add(mark)
+            logger.info(
+                "Queued mark for the workers: %s at %s", mark.action, mark.when.isoformat()
+            )
+            return
+
+        now = get_madrid_now()
+        prewarm_lead = self._current_prewarm_lead()
+        prewarm_at = mark.when - prewarm_lead
+        prewarmed = bool(prewarm_lead) and prewarm_at > now
+        start_at = max(mark.when - self._mark_advance(prewarmed), now)
+
         job = app.job_queue.run_once(
             self.execute_job,
-            when=mark.when,
+            when=start_at,
             name=f"marcaje_{mark.identifier}",
             data={"id": mark.identifier},
             job_kwargs={"misfire_grace_time": None},
         )
-        self._scheduled[mark.identifier] = mark
+        self._scheduled.add(mark)
         self._jobs[mark.identifier] = job
-        self._persist()
-        logger.info("Scheduled mark: %s at %s", mark.action, mark.when.isoformat())
+
+        if prewarmed:
+            app.job_queue.run_once(
+                self.prewarm_job,
+                when=prewarm_at,
+                name=f"precalentamiento_{mark.identifier}",
+                data={"id": mark.identifier},
+            )
+
+        logger.info(
+            "Scheduled mark: %s at %s (starting at %s)",
+            mark.action,
+            mark.when.isoformat(),
+            start_at.isoformat(),
+        )
 
     def schedule(self, app: Application, action: str, when: datetime) -> ScheduledMark:
         if when <= get_madrid_now():
@@ -110,66 +283,196 @@ class SchedulerManager:
     def has_pending(self) -> bool:
         return bool(self._scheduled)
 
-    def list_pending(self) -> List[ScheduledMark]:
-        return sorted(self._scheduled.values(), key=lambda mark: mark.when)
-
-    def cancel_all(self) -> None:
-        if self._scheduled:
-            logger.info("Cancelling %s scheduled marks", len(self._scheduled))
-        self._jobs.clear()
-        self._scheduled.clear()
-        self._persist()
-
-    def cancel_by_action(self, action: str) -> int:
-        identifiers = [mark_id for mark_id, mark in self._scheduled.items() if mark.action == action]
-        for identifier in identifiers:
-            job = self._jobs.pop(identifier, None)
-            self._scheduled.pop(identifier, None)
-        if identifiers:
-            self._persist()
-        return len(identifiers)
-
-    def _persist(self) -> None:
-        data = [mark.to_dict() for mark in self.list_pending()]
-        SCHEDULE_FILE.write_text(json.dumps(data, indent=2), encoding="utf-8")
+    def pending_on(self, day: date) -> List[ScheduledMark]:
+        start = datetime.combine(day, dtime.min, tzinfo=MADRID_TZ)
+        return self.list_pending(start, start + timedelta(days=1))
 
-    def load_from_disk(self, app: Application) -> List[ScheduledMark]:
-        if not SCHEDULE_FILE.exists():
-            return []
+    def list_pending(
+        self, start: Optional[datetime] = None, end: Optional[datetime] = None
+    ) -> List[ScheduledMark]:
+        """Pending marks in time order, optionally only those in ``[start, end)``."""
 
-        raw = SCHEDULE_FILE.read_text(encoding="utf-8").strip()
-        if not raw:
-            return []
+        if start is None and end is None:
+            return list(self._scheduled)
+        return self._scheduled.between(
+            start or datetime.min.replace(tzinfo=MADRID_TZ),
+            end or datetime.max.replace(tzinfo=MADRID_TZ),
+        )
 
+    def cancel_all(self, app: Optional[Application] = None) -> None:
+        """Cancel every pending mark.
+
+        With ``app`` the routines go on with the occurrence after the
+        cancelled one; without it they are left without a pending mark.
+        """
+
+        marks = self._scheduled.clear()
+        if marks:
+            logger.info("Cancelling %s scheduled marks", len(marks))
+        self._drop(marks)
+        if app is not None:
+            self._advance_rules(app, marks)
+
+    def cancel_by_action(self, action: str, app: Optional[Application] = None) -> int:
+        """Cancel the pending marks of ``action``.
+
+        With ``app`` routine occurrences of later days are kept and today's
+        go on with their next occurrence, as in :meth:`cancel_all`.
+        """
+
+        marks = self._scheduled.remove_action(action)
+        if app is not None:
+            today = get_madrid_now().date()
+            for mark in marks:
+                if mark.rule is not None and mark.when.date() > today:
+                    self._scheduled.add(mark)
+            marks = [mark for mark in marks if mark.identifier not in self._scheduled]
+        self._drop(marks)
+        if app is not None:
+            self._advance_rules(app, marks)
+        return len(marks)
+
+    def _drop(self, marks: List[ScheduledMark]) -> None:
+        """Forget marks already removed from the index."""
+
+        if not marks:
+            return
+        identifiers = [mark.identifier for mark in marks]
+        if self._mark_store is not None:
+            self._mark_store.cancel(identifiers)
+        self._journal.remove(identifiers)
+        for mark in marks:
+            self._jobs.pop(mark.identifier, None)
+            if mark.rule is not None and self._rule_marks.get(mark.rule) == mark.identifier:
+                del self._rule_marks[mark.rule]
+
+    def _advance_rules(self, app: Application, marks: List[ScheduledMark]) -> None:
+        for mark in marks:
+            rule = self._rules.get(mark.rule) if mark.rule is not None else None
+            if rule is not None:
+                self._materialize(app, rule, mark.when)
+
+    def _load_rules(self) -> Dict[str, RecurrenceRule]:
         try:
-            data = json.loads(raw)
-        except json.JSONDecodeError:
-            logger.warning("Invalid format in %s. Content will be ignored.", SCHEDULE_FILE)
-            SCHEDULE_FILE.write_text("[]", encoding="utf-8")
-            return []
+            data = json.loads(self._rules_file.read_text(encoding="utf-8") or "[]")
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            logger.warning("Invalid format in %s. Routines will be ignored.", self._rules_file)
+            return {}
+
+        rules: Dict[str, RecurrenceRule] = {}
+        for item in data:
+            try:
+                rule = RecurrenceRule.from_dict(item)
+            except (KeyError, TypeError, ValueError) as exc:
+                logger.warning("Invalid routine in %s: %s", self._rules_file, exc)
+                continue
+            rules[rule.identifier] = rule
+        return rules
+
+    def _save_rules(self) -> None:
+        data = [rule.to_dict() for rule in self.list_rules()]
+        write_atomic(self._rules_file, json.dumps(data, indent=2), durable=True)
+
+    def list_rules(self) -> List[RecurrenceRule]:
+        return sorted(self._rules.values(), key=lambda rule: (rule.at, rule.weekdays, rule.action))
+
+    def pending_for_rule(self, identifier: str) -> Optional[ScheduledMark]:
+        mark_id = self._rule_marks.get(identifier)
+        return self._scheduled.get(mark_id) if mark_id is not None else None
+
+    def add_rule(
+        self, app: Application, action: str, at: dtime, weekdays: Tuple[int, ...]
+    ) -> Tuple[RecurrenceRule, Optional[ScheduledMark]]:
+        """Store a routine and schedule its next occurrence, if it has one."""
+
+        rule = RecurrenceRule(str(uuid4()), action, at, weekdays)
+        self._rules[rule.identifier] = rule
+        self._save_rules()
+        logger.info("Added routine %s: %s", rule.identifier, rule.describe())
+        return rule, self._materialize(app, rule, get_madrid_now())
+
+    def remove_rule(self, identifier: str) -> bool:
+        """Delete a routine together with its pending occurrence."""
+
+        if self._rules.pop(identifier, None) is None:
+            return False
+        self._save_rules()
+        mark = self.pending_for_rule(identifier)
+        if mark is not None:
+            self._scheduled.remove(mark.identifier)
+            self._drop([mark])
+        logger.info("Removed routine %s", identifier)
+        return True
+
+    def remove_all_rules(self) -> None:
+        for identifier in list(self._rules):
+            self.remove_rule(identifier)
+
+    def _materialize(
+        self, app: Application, rule: RecurrenceRule, after: datetime
+    ) -> Optional[ScheduledMark]:
+        """Schedule the next occurrence of ``rule`` unless one is already pending."""
+
+        pending = self.pending_for_rule(rule.identifier)
+        if pending is not None:
+            return pending
+        when = rule.next_occurrence(
+            max(after, get_madrid_now()), get_working_days(self._credentials).is_day_off
+        )
+        if when is None:
+            logger.warning(
+                "Routine %s has no occurrence in the next %s days",
+                rule.identifier,
+                RULE_HORIZON_DAYS,
+            )
+            return None
+        mark = ScheduledMark(str(uuid4()), rule.action, when, rule=rule.identifier)
+        self.add_mark(app, mark)
+        return mark
 
+    def load_from_disk(self, app: Application) -> List[ScheduledMark]:
         restored: List[ScheduledMark] = []
         now = get_madrid_now()
-        for item in data:
+        stored = self._journal.replay()
+        for item in stored:
             try:
                 mark = ScheduledMark.from_dict(item)
             except Exception as exc:  # noqa: BLE001
                 logger.warning("Invalid entry in scheduling data: %s", exc)
                 continue
-            if mark.when <= now:
+            if mark.when + MARK_DEADLINE <= now:
                 logger.info(
                     "Expired scheduled mark (%s at %s). Discarding.",
                     mark.action,
                     mark.when.isoformat(),
                 )
                 continue
-            self.add_mark(app, mark)
+            self._schedule_mark(app, mark)
             restored.append(mark)
+        if stored:
+            # Start from a compact snapshot without the discarded marks.
+            self._journal.reset([mark.to_dict() for mark in restored])
         if restored:
             logger.info("Restored %s pending marks", len(restored))
+        # Routines whose occurrence expired while the bot was down move on.
+        for rule in self.list_rules():
+            self._materialize(app, rule, now)
 
         return restored
 
+    async def prewarm_job(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        job_data = context.job.data if context.job else {}
+        identifier = job_data.get("id") if job_data else None
+        mark = self._scheduled.get(identifier) if identifier else None
+        if not mark:
+            return
+
+        logger.info("Pre-warming portal session for mark %s (%s)", identifier, mark.action)
+        hold = mark.when - get_madrid_now() + PREWARM_GRACE
+        await prewarm_check_in_async(hold.total_seconds(), self._credentials)
+
     async def execute_job(self, context: ContextTypes.DEFAULT_TYPE) -> None:
         job_data = context.job.data if context.job else {}
         identifier = job_data.get("id") if job_data else None
@@ -177,36 +480,138 @@ class SchedulerManager:
             logger.error("Scheduled job without identifier")
             return
 
-        mark = self._scheduled.pop(identifier, None)
-        job = self._jobs.pop(identifier, None)
-        self._persist()
+        # The mark stays scheduled (and persisted) until it has a final outcome
+        # so that a failed attempt can be retried, even after a restart.
+        mark = self._scheduled.get(identifier)
+        self._jobs.pop(identifier, None)
 
         if not mark:
             logger.warning("Scheduled mark %s not found when executing the job", identifier)
             return
 
-        logger.info("Executing scheduled mark %s (%s)", identifier, mark.action)
-        resultado = await execute_check_in_async(mark.action, context)
+        attempt = job_data.get("attempt", 1)
+        if mark.rule is not None and get_working_days(self._credentials).is_day_off(
+            mark.when.date()
+        ):
+            # The calendar gained a day off after the occurrence was scheduled.
+            logger.info("Skipping routine mark %s on a day off", identifier)
+            self._skip_day_off(context.application, mark)
+            return
 
-        prefix = "🚪" if mark.action == "entrada" else "🏁"
-        await context.bot.send_message(
-            chat_id=self._chat_id,
-            text=f"{prefix} Marcaje programado de {mark.action} ejecutado.",
+        deadline = mark.when + MARK_DEADLINE
+        budget = max((deadline - get_madrid_now()).total_seconds(), 0.0)
+        logger.info(
+            "Executing scheduled mark %s (%s), attempt %s", identifier, mark.action, attempt
+        )
+        submitted = job_data.get("submitted", False)
+        resultado = await execute_check_in_async(
+            mark.action, context, Priority.SCHEDULED, budget, self._credentials, submitted
         )
-        await context.bot.send_message(chat_id=self._chat_id, text=resultado.message)
+
+        retry_at = get_madrid_now() + RETRY_DELAY
+        if (
+            not resultado.success
+            and resultado.retryable
+            and retry_at < deadline
+            and identifier in self._scheduled
+        ):
+            self._jobs[identifier] = context.job_queue.run_once(
+                self.execute_job,
+                when=retry_at,
+                name=f"marcaje_{identifier}",
+                data={
+                    "id": identifier,
+                    "attempt": attempt + 1,
+                    "submitted": submitted or resultado.submitted,
+                },
+                job_kwargs={"misfire_grace_time": None},
+            )
+            logger.warning(
+                "Scheduled mark %s failed (%s). Retrying at %s",
+                identifier,
+                resultado.message,
+                retry_at.isoformat(),
+            )
+            if attempt == 1:
+                self._notify_retry(mark, resultado)
+            return
+
+        self._finish(context.application, mark, resultado)
+
+    async def apply_worker_event(self, app: Application, event: MarkEvent) -> None:
+        """Relay to the chat what a worker process did with one of its marks."""
+
+        resultado = result_from_payload(event.payload)
+        mark = self._scheduled.get(event.mark_id)
+        if mark is None:
+            # Cancelled while a worker was already running it.
+            due = event.payload.get("due")
+            when = datetime.fromtimestamp(due, MADRID_TZ) if due else get_madrid_now()
+            mark = ScheduledMark(identifier=event.mark_id, action=resultado.action, when=when)
+        if event.kind == "skipped":
+            logger.info("Worker skipped routine mark %s on a day off", event.mark_id)
+            self._skip_day_off(app, mark)
+            return
+        if event.kind == "retry":
+            logger.warning(
+                "Worker failed scheduled mark %s (%s); it will be retried",
+                event.mark_id,
+                resultado.message,
+            )
+            self._notify_retry(mark, resultado)
+            return
+        self._finish(app, mark, resultado)
+
+    def _skip_day_off(self, app: Application, mark: ScheduledMark) -> None:
+        if self._scheduled.remove(mark.identifier) is not None:
+            self._drop([mark])
+            self._advance_rules(app, [mark])
+        get_outbox().send(
+            self._chat_id,
+            f"🏖️ Hoy no es laborable: se omitió el marcaje de {mark.action} de la rutina.",
+        )
+
+    def _notify_retry(self, mark: ScheduledMark, resultado: CheckInResult) -> None:
+        deadline = mark.when + MARK_DEADLINE
+        get_outbox().send(
+            self._chat_id,
+            (
+                f"{resultado.message}\n🔁 Se reintentará el marcaje de {mark.action} "
+                f"hasta las {deadline.strftime('%H:%M')}."
+            ),
+        )
+
+    def _finish(self, app: Application, mark: ScheduledMark, resultado: CheckInResult) -> None:
+        identifier = mark.identifier
+        if self._scheduled.remove(identifier) is not None:
+            self._drop([mark])
+            self._advance_rules(app, [mark])
+
+        prefix = "🚪" if mark.action == "entrada" else "🏁"
+        summary = f"{prefix} Marcaje programado de {mark.action} ejecutado"
+        if resultado.registered_at:
+            skew = (resultado.registered_at - mark.when).total_seconds()
+            logger.info("Scheduled mark %s registered with a skew of %+.1f s", identifier, skew)
+            summary += f" (desfase {skew:+.1f} s)"
+        get_outbox().send(self._chat_id, f"{summary}.")
+        get_outbox().send(self._chat_id, resultado.message)
 
         if mark.action == "entrada" and resultado.success and self._auto_checkout_delay:
+            today = self.pending_on(get_madrid_now().date())
+            if mark.rule is not None and any(item.action == "salida" for item in today):
+                logger.info("Routine exit already pending; not scheduling an auto-checkout")
+                return
             try:
-                auto_mark = self.schedule_auto_checkout(context.application)
+                auto_mark = self.schedule_auto_checkout(app)
             except ValueError:
-                await context.bot.send_message(
-                    chat_id=self._chat_id,
-                    text="⚠️ No se programó la salida porque la hora calculada ya no es válida.",
+                get_outbox().send(
+                    self._chat_id,
+                    "⚠️ No se programó la salida porque la hora calculada ya no es válida.",
                 )
             else:
-                await context.bot.send_message(
-                    chat_id=self._chat_id,
-                    text="🕐 Salida automática programada para las {}.".format(
+                get_outbox().send(
+                    self._chat_id,
+                    "🕐 Salida automática programada para las {}.".format(
                         auto_mark.when.strftime("%H:%M")
                     ),
                 )
@@ -0,0 +1,309 @@
+"""Registered bot users and the runtime state of the active ones.
+
+Every Telegram chat registers its own portal account. Passwords are stored
+encrypted with Fernet using the key in ``FICHAXE_SECRET_KEY`` or, when the
+variable is unset, a key generated once into ``.users.key``. The chat of
+``telegram_chat_id`` keeps working with the account of ``config.json``.
+
+The scheduler and credentials of a user are only loaded when the user is
+needed and dropped again after ``user_idle_minutes`` without activity, so
+memory follows the active users and not the registered ones.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, Final, List, Optional
+
+from cryptography.fernet import Fernet, InvalidToken
+from telegram.ext import Application
+
+from fichaxebot.calendar_store import forget_calendar_store
+from fichaxebot.config import get_config, scoped_path, write_atomic
+from fichaxebot.fichador import Credentials, forget_portal_session, get_portal_session
+from fichaxebot.logging_config import get_logger
+from fichaxebot.mark_store import get_mark_store
+from fichaxebot.schedule_store import has_stored_marks
+from fichaxebot.scheduler import SCHEDULE_FILE, ScheduledMark, SchedulerManager
+from fichaxebot.view_calendar import refresh_calendar_if_stale
+from fichaxebot.workdays import forget_working_days
+
+logger = get_logger(__name__)
+
+USERS_FILE = Path(".users.data")
+KEY_FILE = Path(".users.key")
+SECRET_KEY_ENV_VAR: Final[str] = "FICHAXE_SECRET_KEY"
+
+
+def _write_private(path: Path, content: bytes) -> None:
+    write_atomic(path, content, mode=0o600)
+
+
+def _load_cipher(key_file: Path = KEY_FILE) -> Fernet:
+    key = os.environ.get(SECRET_KEY_ENV_VAR, "").strip()
+    if key:
+        return Fernet(key.encode("ascii"))
+    if key_file.exists():
+        return Fernet(key_file.read_bytes().strip())
+
+    generated = Fernet.generate_key()
+    _write_private(key_file, generated)
+    logger.warning(
+        "Generated a new credentials key in %s. Keep a copy: without it the stored "
+        "passwords cannot be read.",
+        key_file,
+    )
+    return Fernet(generated)
+
+
+@dataclass
+class UserContext:
+    """Runtime state of one active user."""
+
+    chat_id: int
+    credentials: Credentials
+    scheduler: SchedulerManager
+    last_seen: float = field(default_factory=time.monotonic)
+
+
+class UserRegistry:
+    """Portal accounts by chat id, with lazy loading of each user's scheduler."""
+
+    def __init__(self, path: Path = USERS_FILE, cipher: Optional[Fernet] = None) -> None:
+        self._path = path
+        self._cipher = cipher
+        self._lock = threading.Lock()
+        self._stamp = self._file_stamp()
+        self._accounts: Dict[int, Dict[str, str]] = self._load()
+        self._active: Dict[int, UserContext] = {}
+
+    def _file_stamp(self) -> Optional[tuple[int, int]]:
+        try:
+            stat = self._path.stat()
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _reload_if_changed(self) -> None:
+        """Read the accounts again if another process, such as the bot, rewrote the file."""
+
+        stamp = self._file_stamp()
+        with self._lock:
+            if stamp == self._stamp:
+                return
+            self._stamp = stamp
+            self._accounts = self._load()
+        logger.info("Reloaded the registered users from %s", self._path)
+
+    def _load(self) -> Dict[int, Dict[str, str]]:
+        if not self._path.exists():
+            return {}
+        try:
+            data = json.loads(self._path.read_text(encoding="utf-8"))
+            return {
+                int(chat_id): {
+                    "usc_user": str(item["usc_user"]),
+                    "usc_pass": str(item["usc_pass"]),
+                    "registered_at": str(item.get("registered_at", "")),
+                }
+                for chat_id, item in data.items()
+            }
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            logger.warning("Invalid format in %s. Registered users will be ignored.", self._path)
+            return {}
+
+    def _save(self) -> None:
+        data = {str(chat_id): item for chat_id, item in sorted(self._accounts.items())}
+        _write_private(self._path, json.dumps(data, indent=2).encode("utf-8"))
+        self._stamp = self._file_stamp()
+
+    def _fernet(self) -> Fernet:
+        if self._cipher is None:
+            self._cipher = _load_cipher()
+        return self._cipher
+
+    @property
+    def owner_chat_id(self) -> Optional[int]:
+        """Chat served with the account of ``config.json``, if it has one."""
+
+        config = get_config()
+        if not config.usc_user or not config.usc_pass:
+            return None
+        try:
+            return int(config.telegram_chat_id)
+        except ValueError:
+            return None
+
+    def chat_ids(self) -> List[int]:
+        owner = self.owner_chat_id
+        with self._lock:
+            chat_ids = set(self._accounts)
+        if owner is not None:
+            chat_ids.add(owner)
+        return sorted(chat_ids)
+
+    def is_registered(self, chat_id: int) -> bool:
+        with self._lock:
+            if chat_id in self._accounts:
+                return True
+        return chat_id == self.owner_chat_id
+
+    @property
+    def registered_count(self) -> int:
+        return len(self.chat_ids())
+
+    @property
+    def active_count(self) -> int:
+        with self._lock:
+            return len(self._active)
+
+    def register(self, chat_id: int, credentials: Credentials) -> None:
+        token = self._fernet().encrypt(credentials.password.encode("utf-8")).decode("ascii")
+        with self._lock:
+            self._accounts[chat_id] = {
+                "usc_user": credentials.user,
+                "usc_pass": token,
+                "registered_at": datetime.now(timezone.utc).isoformat(),
+            }
+            self._save()
+            active = self._active.get(chat_id)
+            if active is not None:
+                active.credentials = credentials
+                active.scheduler.credentials = credentials
+        logger.info("Registered portal account for chat %s", chat_id)
+
+    def unregister(self, chat_id: int) -> bool:
+        """Forget the account of ``chat_id`` and its portal session."""
+
+        credentials = self.credentials(chat_id)
+        with self._lock:
+            account = self._accounts.pop(chat_id, None)
+            if account is None:
+                return False
+            self._save()
+            self._active.pop(chat_id, None)
+        if credentials is not None:
+            get_portal_session(credentials.user, credentials.password).clear()
+            self._forget_accounts([credentials])
+        logger.info("Removed portal account of chat %s", chat_id)
+        return True
+
+    def _forget_accounts(self, released: List[Credentials]) -> None:
+        """Drop the cached portal state of accounts that no active chat uses any more."""
+
+        with self._lock:
+            in_use = {context.credentials.user for context in self._active.values()}
+        for credentials in released:
+            if credentials.user in in_use:
+                continue
+            forget_portal_session(credentials.user, credentials.password)
+            forget_calendar_store(credentials.user)
+            forget_working_days(credentials.user)
+
+    def credentials(self, chat_id: int) -> Optional[Credentials]:
+        """Portal account of ``chat_id``; ``None`` if it has none or it cannot be read."""
+
+        self._reload_if_changed()
+        with self._lock:
+            account = self._accounts.get(chat_id)
+        if account is None:
+            if chat_id != self.owner_chat_id:
+                return None
+            config = get_config()
+            return Credentials(config.usc_user, config.usc_pass)
+        try:
+            password = self._fernet().decrypt(account["usc_pass"].encode("ascii"))
+        except (InvalidToken, ValueError):
+            logger.error("Could not decrypt the password of chat %s", chat_id)
+            return None
+        return Credentials(account["usc_user"], password.decode("utf-8"))
+
+    def _schedule_file(self, chat_id: int) -> Path:
+        scope = None if chat_id == self.owner_chat_id else str(chat_id)
+        return scoped_path(SCHEDULE_FILE, scope)
+
+    def _activate(
+        self, app: Application, chat_id: int
+    ) -> tuple[Optional[UserContext], List[ScheduledMark]]:
+        with self._lock:
+            context = self._active.get(chat_id)
+        if context is not None:
+            context.last_seen = time.monotonic()
+            return context, []
+
+        credentials = self.credentials(chat_id)
+        if credentials is None:
+            return None, []
+
+        config = get_config()
+        scheduler = SchedulerManager(
+            str(chat_id),
+            config.auto_checkout_delay,
+            config.auto_checkout_random_offset_minutes,
+            config.prewarm_lead,
+            config.mark_target_window,
+            credentials=credentials,
+            schedule_file=self._schedule_file(chat_id),
+            mark_store=get_mark_store() if config.scheduled_marks_runner == "workers" else None,
+        )
+        restored = scheduler.load_from_disk(app)
+        context = UserContext(chat_id, credentials, scheduler)
+        with self._lock:
+            self._active[chat_id] = context
+        logger.info("Loaded state of chat %s", chat_id)
+        # The days off of the calendar decide when the user is asked to mark.
+        refresh_calendar_if_stale(credentials)
+        return context, restored
+
+    def get(self, app: Application, chat_id: int) -> Optional[UserContext]:
+        """Return the state of ``chat_id``, loading it if needed; ``None`` if unknown."""
+
+        return self._activate(app, chat_id)[0]
+
+    def restore(self, app: Application) -> Dict[int, List[ScheduledMark]]:
+        """Load the users that have marks stored on disk and reschedule them."""
+
+        restored: Dict[int, List[ScheduledMark]] = {}
+        for chat_id in self.chat_ids():
+            if not has_stored_marks(self._schedule_file(chat_id)):
+                continue
+            _, marks = self._activate(app, chat_id)
+            if marks:
+                restored[chat_id] = marks
+        return restored
+
+    def evict_idle(self, max_idle: float, keep: Callable[[int], bool]) -> List[int]:
+        """Drop the state of users idle for ``max_idle`` seconds without pending work."""
+
+        now = time.monotonic()
+        with self._lock:
+            evicted = [
+                chat_id
+                for chat_id, context in self._active.items()
+                if now - context.last_seen >= max_idle
+                and not context.scheduler.has_pending()
+                and not keep(chat_id)
+            ]
+            released = [self._active.pop(chat_id).credentials for chat_id in evicted]
+        if evicted:
+            self._forget_accounts(released)
+            logger.info("Unloaded %s idle users", len(evicted))
+        return evicted
+
+
+_registry: Optional[UserRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_user_registry() -> UserRegistry:
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = UserRegistry()
+        return _registry
@@ -1,18 +1,17 @@
 from __future__ import annotations
 
-import asyncio
 from datetime import date, datetime, time as dtime
-from typing import Optional, Final
-from zoneinfo import ZoneInfo
+from functools import lru_cache
+from typing import Any, MutableMapping, Optional
 
 from holidays.countries.spain import Spain
 from telegram.ext import ContextTypes
 
-from fichaxebot.fichador import perform_check_in
+from fichaxebot.config import MADRID_TZ
+from fichaxebot.executor import Priority, run_portal_task
+from fichaxebot.fichador import Credentials, perform_check_in, prewarm_session
 from fichaxebot.logging_config import get_logger
 
-MADRID_TZ: Final[ZoneInfo] = ZoneInfo("Europe/Madrid")
-
 logger = get_logger(__name__)
 
 
@@ -21,16 +20,34 @@ def get_madrid_now() -> datetime:
 
 
 async def execute_check_in_async(
-    action: str, context: ContextTypes.DEFAULT_TYPE
+    action: str,
+    context: ContextTypes.DEFAULT_TYPE,
+    priority: Priority = Priority.INTERACTIVE,
+    budget: Optional[float] = None,
+    credentials: Optional[Credentials] = None,
+    submitted: bool = False,
 ):
-    result = await asyncio.to_thread(perform_check_in, action)
+    result = await run_portal_task(
+        perform_check_in, action, budget, credentials, submitted, priority=priority
+    )
     logger.info("Check-in result for %s: %s", action, result.message)
     return result
 
 
+async def prewarm_check_in_async(hold: float, credentials: Optional[Credentials] = None) -> None:
+    # A session that cannot be opened before the mark is of no use.
+    await run_portal_task(
+        prewarm_session, hold, credentials, priority=Priority.SCHEDULED, deadline=hold
+    )
+
+
+@lru_cache(maxsize=8)
+def galicia_holidays(year: int) -> frozenset[date]:
+    return frozenset(Spain(years=year, subdiv="GA"))
+
+
 def is_galicia_holiday(day: date) -> bool:
-    galicia_holidays = Spain(years=day.year, subdiv="GA")
-    return day in galicia_holidays
+    return day in galicia_holidays(day.year)
 
 
 def parse_hour_minute(value: str) -> Optional[dtime]:
@@ -50,8 +67,10 @@ def parse_hour_minute(value: str) -> Optional[dtime]:
     return dtime(hour=hour, minute=minute)
 
 
-def cancel_reminder(app, job_key: str, attempts_key: str) -> None:
-    job = app.bot_data.pop(job_key, None)
+def cancel_reminder(state: MutableMapping[str, Any], job_key: str, attempts_key: str) -> None:
+    """Stop the reminder job kept in ``state`` (the chat data of one user)."""
+
+    job = state.pop(job_key, None)
     if job:
         job.schedule_removal()
-    app.bot_data.pop(attempts_key, None)
+    state.pop(attempts_key, None)
@@ -1,20 +1,36 @@
 from __future__ import annotations
 
-import json
+import base64
+import threading
+from concurrent.futures import Future
 from dataclasses import dataclass
-from datetime import datetime, timedelta, timezone
-from typing import Any, Callable, Iterable, Optional
-
-from selenium.common.exceptions import JavascriptException, TimeoutException
-from selenium.webdriver.support.ui import WebDriverWait
-
-from fichaxebot.config import get_config
-from fichaxebot.fichador import _create_driver, _login
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Final, Iterable, Optional
+
+from fichaxebot.calendar_store import StoredCalendar, get_calendar_store
+from fichaxebot.config import MADRID_TZ, get_config
+from fichaxebot.executor import Priority, get_executor
+from fichaxebot.fichador import (
+    CalendarFetchError,
+    Credentials,
+    fetch_calendar_entries,
+    resolve_credentials,
+)
 from fichaxebot.logging_config import get_logger
+from fichaxebot.metrics import get_metrics
+from fichaxebot.profiling import profiled
 
 logger = get_logger(__name__)
 
-CALENDAR_URL = "https://fichaxe.usc.gal/pas/calendarioAnual"
+# Compact WebApp payload: a version byte, the year in two bytes and then two
+# bits per day of the year (0 none, 1 vacation, 2 non-working), base64url
+# encoded without padding. docs/show_calendar.html decodes it.
+CALENDAR_FORMAT_VERSION: Final[int] = 2
+DAY_CODES: Final[dict[str, int]] = {"V": 1, "N": 2}
+_DAY_BYTES: Final[int] = (366 * 2 + 7) // 8
+
+_refresh_lock = threading.Lock()
+_refreshing: set[str] = set()
 
 
 @dataclass
@@ -33,31 +49,6 @@ class CalendarEntry:
         return f"{self.code}{self.start}:{self.end}"
 
 
-class CalendarFetchError(RuntimeError):
-    """Raised when the calendar page cannot be processed."""
-
-
-def _wait_until(wait: WebDriverWait, condition: Callable[..., Any]) -> Any:
-    return wait.until(condition)
-
-
-def _read_calendar_array(driver) -> list[dict[str, Any]]:
-    """Return the raw calendario array from the loaded page."""
-
-    try:
-        data_json = driver.execute_script("return JSON.stringify(window.calendario || []);")
-    except JavascriptException as exc:  # pragma: no cover - depends on remote content
-        raise CalendarFetchError("No se pudo acceder al calendario en la página") from exc
-
-    if not data_json:
-        return []
-
-    try:
-        return json.loads(data_json)
-    except json.JSONDecodeError as exc:  # pragma: no cover - depends on remote format
-        raise CalendarFetchError("El calendario recibido tiene un formato desconocido") from exc
-
-
 def _map_kind(tipo: str) -> Optional[str]:
     normalized = tipo.upper()
     if "VACACION" in normalized:
@@ -122,36 +113,177 @@ def _iter_relevant_entries(raw_entries: Iterable[dict[str, Any]]) -> Iterable[Ca
         yield CalendarEntry(start=start.date().isoformat(), end=end.date().isoformat(), code=kind)
 
 
-def fetch_calendar_summary() -> list[str]:
-    """Return compact calendar entries relevant for the vacation viewer."""
+def _entry_days(entry: CalendarEntry) -> Iterable[date]:
+    current = date.fromisoformat(entry.start)
+    end = date.fromisoformat(entry.end)
+    while current <= end:
+        yield current
+        current += timedelta(days=1)
 
-    config = get_config()
-    if not config.usc_user or not config.usc_pass:
-        raise CalendarFetchError(
-            "Las credenciales de USC no están configuradas; no se puede obtener el calendario.",
-        )
 
-    driver = _create_driver()
-    wait = WebDriverWait(driver, 20)
+def encode_calendar(entries: Iterable[CalendarEntry], year: int) -> str:
+    """Pack the days of ``year`` into the fixed-size WebApp payload.
 
-    try:
-        _login(driver, wait, config.usc_user, config.usc_pass)
-        driver.get(CALENDAR_URL)
-        try:
-            _wait_until(
-                wait,
-                lambda d: d.execute_script(
-                    "return Array.isArray(window.calendario) && window.calendario.length >= 0;"
-                ),
-            )
-        except TimeoutException as exc:  # pragma: no cover - depends on remote load
-            raise CalendarFetchError("No se pudo cargar el calendario en la página") from exc
-
-        raw_entries = _read_calendar_array(driver)
+    A day that is both a vacation and a non-working day is sent as vacation.
+    """
+
+    packed = bytearray(3 + _DAY_BYTES)
+    packed[0] = CALENDAR_FORMAT_VERSION
+    packed[1:3] = year.to_bytes(2, "big")
+    for entry in entries:
+        code = DAY_CODES[entry.code]
+        for day in _entry_days(entry):
+            if day.year != year:
+                continue
+            index = day.timetuple().tm_yday - 1
+            position, shift = 3 + (index >> 2), (index & 3) * 2
+            if (packed[position] >> shift) & 3 != DAY_CODES["V"]:
+                packed[position] = packed[position] & ~(3 << shift) | code << shift
+    return base64.urlsafe_b64encode(bytes(packed)).rstrip(b"=").decode("ascii")
+
+
+@dataclass
+class CalendarSummary:
+    """Viewer entries together with the moment the calendar was read.
+
+    ``payload`` is the same calendar in the compact WebApp format.
+    """
+
+    entries: list[str]
+    payload: str
+    fetched_at: datetime
+    cached: bool = False
+    refreshing: bool = False
+
+
+def _simplify(raw_entries: Iterable[dict[str, Any]]) -> list[CalendarEntry]:
+    with get_metrics().span("calendar_parse"):
         simplified = list(_iter_relevant_entries(raw_entries))
-    finally:
-        driver.quit()
 
     simplified.sort(key=lambda item: item.start)
     logger.info("Recovered %s calendar entries for the viewer", len(simplified))
-    return [entry.as_payload() for entry in simplified]
+    return simplified
+
+
+def _summarize(raw_entries: Iterable[dict[str, Any]]) -> list[str]:
+    return [entry.as_payload() for entry in _simplify(raw_entries)]
+
+
+def _build_summary(stored: StoredCalendar, year: int, **flags: bool) -> CalendarSummary:
+    simplified = _simplify(stored.entries)
+    return CalendarSummary(
+        [entry.as_payload() for entry in simplified],
+        encode_calendar(simplified, year),
+        stored.fetched_at,
+        **flags,
+    )
+
+
+def _store_user(credentials: Optional[Credentials]) -> str:
+    try:
+        return resolve_credentials(credentials).user
+    except ValueError as exc:
+        raise CalendarFetchError(
+            "Las credenciales de USC no están configuradas; no se puede obtener el calendario.",
+        ) from exc
+
+
+def refresh_calendar(credentials: Optional[Credentials] = None) -> StoredCalendar:
+    """Read the calendar from the portal and update the on-disk copy."""
+
+    now = datetime.now(MADRID_TZ)
+    with get_metrics().span("calendar_read"):
+        raw_entries = fetch_calendar_entries(credentials)
+    store = get_calendar_store(_store_user(credentials))
+    stored, changed = store.update(now.year, raw_entries, now)
+    if changed:
+        logger.info("Calendar for %s changed; cached copy replaced", now.year)
+    return stored
+
+
+def _refresh_in_background(credentials: Optional[Credentials]) -> None:
+    """Queue a refresh of the calendar unless one is already pending for the account.
+
+    It runs on the portal executor with READ priority, so it never holds a
+    browser that a scheduled mark is waiting for.
+    """
+
+    user = _store_user(credentials)
+    with _refresh_lock:
+        if user in _refreshing:
+            return
+        _refreshing.add(user)
+
+    def done(future: Future) -> None:
+        with _refresh_lock:
+            _refreshing.discard(user)
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Background calendar refresh failed", exc_info=future.exception())
+
+    try:
+        future = get_executor().submit(refresh_calendar, credentials, priority=Priority.READ)
+    except RuntimeError:
+        logger.warning("Portal executor stopped; calendar refresh not queued")
+        with _refresh_lock:
+            _refreshing.discard(user)
+        return
+    future.add_done_callback(done)
+
+
+def has_current_calendar(credentials: Optional[Credentials] = None) -> bool:
+    """Whether a copy of this year's calendar is stored on disk, however old."""
+
+    year = datetime.now(MADRID_TZ).year
+    return get_calendar_store(_store_user(credentials)).get(year) is not None
+
+
+def calendar_is_stale(credentials: Optional[Credentials] = None) -> bool:
+    """Whether this year's copy is missing or older than ``calendar_max_age``."""
+
+    now = datetime.now(MADRID_TZ)
+    stored = get_calendar_store(_store_user(credentials)).get(now.year)
+    return stored is None or now - stored.fetched_at >= get_config().calendar_max_age
+
+
+def refresh_calendar_if_stale(credentials: Optional[Credentials] = None) -> None:
+    """Queue a refresh when this year's copy is missing or older than ``calendar_max_age``.
+
+    Keeps the days off known to :mod:`fichaxebot.workdays` current for users
+    who never open /calendario.
+    """
+
+    if calendar_is_stale(credentials):
+        _refresh_in_background(credentials)
+
+
+@profiled
+def load_calendar_summary(credentials: Optional[Credentials] = None) -> CalendarSummary:
+    """Return the viewer entries, answering from the cached calendar when possible.
+
+    A cached copy older than ``calendar_max_age`` is still returned right away
+    while a fresh read runs in the background.
+    """
+
+    now = datetime.now(MADRID_TZ)
+    stored = get_calendar_store(_store_user(credentials)).get(now.year)
+    if stored is None:
+        stored = refresh_calendar(credentials)
+        return _build_summary(stored, now.year)
+
+    refreshing = now - stored.fetched_at >= get_config().calendar_max_age
+    if refreshing:
+        _refresh_in_background(credentials)
+    return _build_summary(stored, now.year, cached=True, refreshing=refreshing)
+
+
+def calendar_days_off(raw_entries: Iterable[dict[str, Any]]) -> set[date]:
+    """Vacation and non-working days listed in a raw ``calendario`` array."""
+
+    return {day for entry in _iter_relevant_entries(raw_entries) for day in _entry_days(entry)}
+
+
+@profiled
+def fetch_calendar_summary(credentials: Optional[Credentials] = None) -> list[str]:
+    """Return compact calendar entries relevant for the vacation viewer."""
+
+    return _summarize(refresh_calendar(credentials).entries)
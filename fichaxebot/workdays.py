@@ -0,0 +1,94 @@
+"""Working days of each portal account.
+
+A day is a working day when it is a weekday and not a day off: a Galician
+holiday or a vacation or non-working day of the account's calendar as stored
+on disk. The days off of each year are computed once into a bitset with one
+bit per day and computed again only when the stored calendar of that year
+changes, so a lookup is a dictionary access and a bit test.
+"""
+
+from __future__ import annotations
+
+import threading
+from datetime import date
+from typing import Dict, Optional, Tuple
+
+from fichaxebot.calendar_store import get_calendar_store
+from fichaxebot.fichador import Credentials, resolve_credentials
+from fichaxebot.logging_config import get_logger
+from fichaxebot.utils import galicia_holidays
+from fichaxebot.view_calendar import calendar_days_off
+
+logger = get_logger(__name__)
+
+
+def _day_index(day: date) -> int:
+    return day.timetuple().tm_yday - 1
+
+
+class WorkingDays:
+    """Per-year bitsets of the days off of portal account ``user``.
+
+    Without a ``user`` only weekends and holidays are days off.
+    """
+
+    def __init__(self, user: Optional[str]) -> None:
+        self._user = user
+        self._lock = threading.Lock()
+        # year -> (digest of the calendar it was built from, bitset)
+        self._years: Dict[int, Tuple[Optional[str], bytes]] = {}
+
+    def is_working_day(self, day: date) -> bool:
+        return day.weekday() < 5 and not self.is_day_off(day)
+
+    def is_day_off(self, day: date) -> bool:
+        """Holiday, vacation or non-working day, whatever its weekday."""
+
+        stored = get_calendar_store(self._user).get(day.year) if self._user else None
+        digest = stored.digest if stored is not None else None
+        with self._lock:
+            cached = self._years.get(day.year)
+            if cached is None or cached[0] != digest:
+                days_off = calendar_days_off(stored.entries) if stored is not None else set()
+                cached = self._years[day.year] = (digest, _build_year(day.year, days_off))
+        index = _day_index(day)
+        return bool(cached[1][index >> 3] >> (index & 7) & 1)
+
+
+def _build_year(year: int, calendar_days: set[date]) -> bytes:
+    bits = bytearray(47)  # 366 days
+    for day in galicia_holidays(year) | calendar_days:
+        if day.year == year:
+            index = _day_index(day)
+            bits[index >> 3] |= 1 << (index & 7)
+    logger.debug("Built days off of %s (%s from the calendar)", year, len(calendar_days))
+    return bytes(bits)
+
+
+_calendars: Dict[Optional[str], WorkingDays] = {}
+_calendars_lock = threading.Lock()
+
+
+def get_working_days(credentials: Optional[Credentials] = None) -> WorkingDays:
+    """Return the working days of the account of ``credentials`` (default: configured one)."""
+
+    try:
+        user: Optional[str] = resolve_credentials(credentials).user
+    except ValueError:
+        user = None
+    with _calendars_lock:
+        working_days = _calendars.get(user)
+        if working_days is None:
+            working_days = _calendars[user] = WorkingDays(user)
+        return working_days
+
+
+def forget_working_days(user: str) -> None:
+    """Drop the working days of an account that is no longer active."""
+
+    with _calendars_lock:
+        _calendars.pop(user, None)
+
+
+def is_working_day(day: date, credentials: Optional[Credentials] = None) -> bool:
+    return get_working_days(credentials).is_working_day(day)
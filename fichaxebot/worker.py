@@ -0,0 +1,277 @@
+"""Worker process that runs the scheduled marks queued in the mark store.
+
+Start as many as needed with ``python -m fichaxebot.worker`` next to a bot
+configured with ``"scheduled_marks_runner": "workers"``. Each worker claims
+the marks that are about to be due under a lease, renews the lease while it
+holds them and writes the outcome back to the store, where the bot picks it
+up and tells the chat. If a worker dies its leases expire after ``--lease``
+seconds and another worker claims the marks again. Once a mark starts, its
+lease covers the whole retry budget up to the deadline, so that it is not
+claimed again while it may still be registering.
+
+Workers read the same ``config.json``, ``.users.data`` and ``.users.key`` (or
+``FICHAXE_SECRET_KEY``) as the bot, so every host running them needs a copy.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Set
+
+from fichaxebot.config import get_config
+from fichaxebot.fichador import CheckInResult, perform_check_in, shutdown_backend
+from fichaxebot.latency import get_latency_stats
+from fichaxebot.logging_config import get_logger
+from fichaxebot.mark_store import LeasedMark, MarkStore, get_mark_store, result_payload
+from fichaxebot.metrics import get_metrics
+from fichaxebot.scheduler import (
+    MARK_ADVANCE_QUANTILE,
+    MARK_PHASES,
+    PREWARM_PHASES,
+    RETRY_DELAY,
+)
+from fichaxebot.users import UserRegistry, get_user_registry
+from fichaxebot.utils import MADRID_TZ
+from fichaxebot.workdays import get_working_days
+
+logger = get_logger(__name__)
+
+DEFAULT_LEASE = 60.0
+DEFAULT_POLL = 1.0
+
+
+class MarkWorker:
+    """Claim due marks from ``store`` and run up to ``concurrency`` at a time."""
+
+    def __init__(
+        self,
+        store: MarkStore,
+        registry: UserRegistry,
+        owner: str,
+        concurrency: int,
+        lease: float = DEFAULT_LEASE,
+        poll: float = DEFAULT_POLL,
+    ) -> None:
+        self._store = store
+        self._registry = registry
+        self._owner = owner
+        self._concurrency = max(1, concurrency)
+        self._lease = lease
+        self._poll = poll
+        self._lock = threading.Lock()
+        self._held: Dict[str, LeasedMark] = {}
+        self._started: Set[str] = set()
+        self._lost: Set[str] = set()
+        self._stop = threading.Event()
+        self._finished = threading.Event()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _advance(self) -> float:
+        """How early to start a mark so that it registers at its planned time."""
+
+        observed = get_latency_stats().estimate(
+            PREWARM_PHASES + MARK_PHASES, MARK_ADVANCE_QUANTILE
+        )
+        return min(observed, get_config().mark_target_window.total_seconds())
+
+    def run(self) -> None:
+        logger.info(
+            "Worker %s started (concurrency %s, lease %.0f s)",
+            self._owner,
+            self._concurrency,
+            self._lease,
+        )
+        heartbeat = threading.Thread(target=self._heartbeat, name="lease-heartbeat", daemon=True)
+        heartbeat.start()
+        with ThreadPoolExecutor(self._concurrency, thread_name_prefix="mark") as pool:
+            while not self._stop.is_set():
+                with self._lock:
+                    free = self._concurrency - len(self._held)
+                if free > 0:
+                    advance = self._advance()
+                    horizon = time.time() + advance + self._poll
+                    try:
+                        claimed = self._store.claim(self._owner, self._lease, horizon, free)
+                    except Exception:  # noqa: BLE001
+                        logger.exception("Could not claim marks from the store")
+                        claimed = []
+                    for mark in claimed:
+                        with self._lock:
+                            self._held[mark.identifier] = mark
+                        pool.submit(self._run_mark, mark, mark.due - advance)
+                self._stop.wait(self._poll)
+
+            # Marks that are still waiting for their time go back to the queue.
+            with self._lock:
+                waiting = [item for item in self._held if item not in self._started]
+            self._store.release(self._owner, waiting)
+        # Keep renewing the leases of the marks that are still running.
+        self._finished.set()
+        heartbeat.join()
+        logger.info("Worker %s stopped", self._owner)
+
+    def _heartbeat(self) -> None:
+        while not self._finished.wait(self._lease / 3):
+            with self._lock:
+                identifiers = list(self._held)
+            if not identifiers:
+                continue
+            try:
+                lost = self._store.renew(self._owner, identifiers, self._lease)
+            except Exception:  # noqa: BLE001
+                logger.exception("Could not renew the leases of worker %s", self._owner)
+                continue
+            if lost:
+                logger.warning("Worker %s lost the lease of marks %s", self._owner, lost)
+                with self._lock:
+                    self._lost.update(lost)
+
+    def _run_mark(self, mark: LeasedMark, start_at: float) -> None:
+        try:
+            if self._stop.wait(max(0.0, start_at - time.time())):
+                return
+            with self._lock:
+                if mark.identifier in self._lost:
+                    return
+                self._started.add(mark.identifier)
+            run_lease = max(mark.deadline - time.time(), 0.0) + self._lease
+            if self._store.renew(self._owner, [mark.identifier], run_lease):
+                logger.warning("Worker %s lost the lease of mark %s", self._owner, mark.identifier)
+                return
+            if self._is_day_off(mark):
+                self._skip(mark)
+                return
+            result = self._check_in(mark)
+            self._report(mark, result)
+        except Exception:  # noqa: BLE001
+            logger.exception("Unexpected error running mark %s", mark.identifier)
+        finally:
+            with self._lock:
+                self._held.pop(mark.identifier, None)
+                self._started.discard(mark.identifier)
+                self._lost.discard(mark.identifier)
+
+    def _is_day_off(self, mark: LeasedMark) -> bool:
+        """Whether ``mark`` belongs to a routine and falls on a day off of its account."""
+
+        if mark.rule is None:
+            return False
+        credentials = self._registry.credentials(int(mark.chat_id))
+        if credentials is None:
+            return False
+        day = datetime.fromtimestamp(mark.due, MADRID_TZ).date()
+        return get_working_days(credentials).is_day_off(day)
+
+    def _skip(self, mark: LeasedMark) -> None:
+        # The calendar gained a day off after the occurrence was scheduled.
+        logger.info("Skipping routine mark %s on a day off", mark.identifier)
+        payload = {"action": mark.action, "due": mark.due}
+        if self._store.complete(self._owner, mark, payload, kind="skipped"):
+            get_metrics().increment("worker_marks", outcome="skipped")
+        else:
+            logger.warning("Mark %s was completed by another worker", mark.identifier)
+
+    def _check_in(self, mark: LeasedMark) -> CheckInResult:
+        credentials = self._registry.credentials(int(mark.chat_id))
+        if credentials is None:
+            return CheckInResult(
+                success=False,
+                action=mark.action,
+                message="❌ No hay ninguna cuenta del portal registrada para este chat.",
+            )
+        logger.info(
+            "Executing scheduled mark %s (%s), attempt %s",
+            mark.identifier,
+            mark.action,
+            mark.attempts,
+        )
+        budget = max(mark.deadline - time.time(), 0.0)
+        try:
+            result = perform_check_in(mark.action, budget, credentials, mark.submitted)
+        except Exception as exc:  # noqa: BLE001
+            logger.exception("Error running mark %s", mark.identifier)
+            return CheckInResult(
+                success=False, action=mark.action, message=f"❌ Error al fichar: {exc}"
+            )
+        if result.submitted and not mark.submitted:
+            # Whoever runs the mark next must not take a rejection as a failure.
+            self._store.mark_submitted(mark.identifier)
+        return result
+
+    def _report(self, mark: LeasedMark, result: CheckInResult) -> None:
+        with self._lock:
+            if mark.identifier in self._lost:
+                logger.warning(
+                    "Mark %s finished after its lease was lost; not reporting it",
+                    mark.identifier,
+                )
+                return
+        payload = {**result_payload(result), "due": mark.due}
+        retry_at = time.time() + RETRY_DELAY.total_seconds()
+        metrics = get_metrics()
+        if not result.success and result.retryable and retry_at < mark.deadline:
+            logger.warning(
+                "Scheduled mark %s failed (%s); retrying", mark.identifier, result.message
+            )
+            self._store.retry(self._owner, mark, retry_at, payload)
+            metrics.increment("worker_marks", outcome="retry")
+            return
+        if self._store.complete(self._owner, mark, payload):
+            metrics.increment("worker_marks", outcome="ok" if result.success else "failed")
+        else:
+            logger.warning("Mark %s was completed by another worker", mark.identifier)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--id",
+        default=f"{socket.gethostname()}-{os.getpid()}",
+        help="name of this worker in the store (default: host-pid)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=None,
+        help="marks run at the same time (default: portal_workers)",
+    )
+    parser.add_argument("--lease", type=float, default=DEFAULT_LEASE, help="lease in seconds")
+    parser.add_argument("--poll", type=float, default=DEFAULT_POLL, help="poll interval in seconds")
+    args = parser.parse_args()
+    if args.lease <= 0 or args.poll <= 0:
+        parser.error("--lease and --poll must be positive")
+
+    worker = MarkWorker(
+        get_mark_store(),
+        get_user_registry(),
+        args.id,
+        args.concurrency or get_config().portal_workers,
+        args.lease,
+        args.poll,
+    )
+
+    def handle_stop(*_):
+        print("🛑 Stopping worker...")
+        worker.stop()
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, handle_stop)
+
+    try:
+        worker.run()
+    finally:
+        shutdown_backend()
+        get_mark_store().close()
+
+
+if __name__ == "__main__":
+    main()